@@ -0,0 +1,4 @@
+# 确保Django启动时加载Celery应用，使 @shared_task 使用该应用
+from .celery import app as celery_app
+
+__all__ = ('celery_app',)
@@ -0,0 +1,23 @@
+"""
+Celery application for PocketAi project.
+
+Start a worker with:
+    celery -A PocketAi worker -l info
+
+Periodic tasks (settings.CELERY_BEAT_SCHEDULE) are sent by a single beat process:
+    celery -A PocketAi beat -l info
+"""
+
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'PocketAi.settings')
+
+app = Celery('PocketAi')
+
+# 从Django设置中读取以 CELERY_ 开头的配置
+app.config_from_object('django.conf:settings', namespace='CELERY')
+
+# 自动发现各应用下的 tasks.py
+app.autodiscover_tasks()
@@ -74,6 +74,9 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 20,
 }
 
+# 分页 count_mode=cached 时总数的缓存时间（秒）
+PAGINATION_COUNT_CACHE_TTL = int(os.environ.get('PAGINATION_COUNT_CACHE_TTL', 60))
+
 ROOT_URLCONF = 'PocketAi.urls'
 
 TEMPLATES = [
@@ -135,6 +138,100 @@ if os.environ.get('REDIS_URL'):
         }
     }
 
+# Token验证结果缓存（秒），设置为0可关闭缓存
+AUTH_TOKEN_CACHE_TTL = int(os.environ.get('AUTH_TOKEN_CACHE_TTL', 300))
+# 无效Token（401）的负缓存时间（秒）
+AUTH_TOKEN_NEGATIVE_CACHE_TTL = int(os.environ.get('AUTH_TOKEN_NEGATIVE_CACHE_TTL', 30))
+# 用户服务回调 /api/auth/invalidate/ 使用的密钥（请求头 X-Service-Key），为空时关闭该接口
+AUTH_INVALIDATE_SERVICE_KEY = os.environ.get('AUTH_INVALIDATE_SERVICE_KEY', '')
+
+# 运维指标接口 /api/internal/stats/ 使用的密钥（请求头 X-Service-Key），为空时关闭该接口
+INTERNAL_STATS_KEY = os.environ.get('INTERNAL_STATS_KEY', '')
+
+# 出站HTTP客户端：每个上游服务的连接池大小、超时（秒）和重试策略
+OUTBOUND_HTTP_UPSTREAMS = {
+    # 用户服务Token验证
+    'auth': {
+        'pool_maxsize': 20,
+        'timeout': 3,
+        'retries': 2,
+    },
+    # 用户服务其他接口（utils.utils.fire）
+    'users': {
+        'pool_maxsize': 10,
+        'timeout': 10,
+        'retries': 3,
+        'status_forcelist': (500, 502, 503, 504),
+    },
+    # AI Agent服务
+    'agent': {
+        'pool_maxsize': 20,
+        'timeout': 30,
+        'retries': 0,
+    },
+}
+
+# 出站调用的熔断器（utils.resilience），未声明的名称使用 default：
+# 最近 window_size 次调用（至少 minimum_calls 次）中失败率或慢调用（超过 slow_call_duration 秒）比例
+# 达到阈值时熔断 open_seconds 秒，之后放行 half_open_max_calls 次试探调用
+CIRCUIT_BREAKERS = {
+    'default': {
+        'window_size': 20,
+        'minimum_calls': 5,
+        'failure_rate_threshold': 0.5,
+        'slow_call_duration': 10,
+        'slow_call_rate_threshold': 0.5,
+        'open_seconds': 30,
+        'half_open_max_calls': 1,
+    },
+}
+# 每个进程同时调用AI服务的最大数量，已满时最多等待 AI_AGENT_BULKHEAD_WAIT 秒
+AI_AGENT_MAX_CONCURRENT = int(os.environ.get('AI_AGENT_MAX_CONCURRENT', 8))
+AI_AGENT_BULKHEAD_WAIT = int(os.environ.get('AI_AGENT_BULKHEAD_WAIT', 1))
+
+# AI聊天的模型路由（ai_messages.services.route_ai_chat）
+AI_MODEL_ROUTING = {
+    # 会话选择的模型失败或熔断时可以改用的模型
+    'fallbacks': ['qwen-max', 'deepseek-chat', 'gpt-3.5-turbo'],
+    # 开启后，当前模型超过其 p95 耗时（秒，不低于 min_hedge_delay）仍未返回时向下一个模型发送对冲请求，
+    # 成功样本少于 min_samples 时等待 hedge_delay 秒。
+    # 落后的请求不会被中断，会继续占用线程和AI服务并发名额（AI_AGENT_MAX_CONCURRENT），默认关闭
+    'hedge': os.environ.get('AI_MODEL_HEDGE', '').lower() in ('1', 'true', 'yes'),
+    'hedge_delay': 8,
+    'min_hedge_delay': 1,
+    'min_samples': 20,
+    # 每个模型保留的耗时样本数
+    'window_size': 200,
+    # 执行模型调用的线程数
+    'max_workers': 16,
+}
+
+# 单次处理AI消息时调用AI服务的最大尝试次数
+AI_MESSAGE_MAX_ATTEMPTS = int(os.environ.get('AI_MESSAGE_MAX_ATTEMPTS', 2))
+# 异步处理未完成时状态接口建议的轮询间隔（秒，Retry-After 响应头）
+AI_MESSAGE_STATUS_RETRY_AFTER = int(os.environ.get('AI_MESSAGE_STATUS_RETRY_AFTER', 2))
+# 异步任务使用的用户Token在缓存中的保留时间（秒），任务积压超过该时间时消息标记为失败
+AI_TASK_TOKEN_TTL = int(os.environ.get('AI_TASK_TOKEN_TTL', 3600))
+# 免费用户可发送的消息数
+FREE_MESSAGE_LIMIT = int(os.environ.get('FREE_MESSAGE_LIMIT', 50))
+# 助手列表缓存：超过 SOFT_TTL 秒后在后台刷新，刷新失败时继续使用旧列表，最长保留 MAX_AGE 秒
+ASSISTANT_LIST_CACHE_SOFT_TTL = int(os.environ.get('ASSISTANT_LIST_CACHE_SOFT_TTL', 300))
+ASSISTANT_LIST_CACHE_MAX_AGE = int(os.environ.get('ASSISTANT_LIST_CACHE_MAX_AGE', 86400))
+# 获取共享助手列表使用的AI服务凭证（Authorization 请求头的值），为空时助手列表不缓存，按请求用户的Token获取
+AI_AGENT_SERVICE_TOKEN = os.environ.get('AI_AGENT_SERVICE_TOKEN', '')
+
+# 统计接口响应缓存时间（秒），用户数据变化时通过版本号立即失效；设置为0可关闭缓存
+STATS_CACHE_TTL = int(os.environ.get('STATS_CACHE_TTL', 600))
+# 进程内汇率表的刷新间隔（秒），本进程内汇率变化时立即失效
+CURRENCY_RATE_CACHE_TTL = int(os.environ.get('CURRENCY_RATE_CACHE_TTL', 300))
+# 进程内交易分类索引（AI提取交易的分类解析）的刷新间隔（秒），本进程内分类变化时立即失效
+CATEGORY_RESOLVER_TTL = int(os.environ.get('CATEGORY_RESOLVER_TTL', 300))
+
+# 批量创建交易记录接口单次允许的最大条数
+TRANSACTION_BULK_CREATE_MAX = int(os.environ.get('TRANSACTION_BULK_CREATE_MAX', 1000))
+# 批量删除交易记录超过该条数时转为后台任务执行
+TRANSACTION_BULK_DELETE_ASYNC_THRESHOLD = int(os.environ.get('TRANSACTION_BULK_DELETE_ASYNC_THRESHOLD', 5000))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -186,3 +283,30 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # 确保这些设置也已启用
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
 USE_X_FORWARDED_HOST = True
+
+
+# Celery
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', os.environ.get('REDIS_URL', ''))
+CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', CELERY_BROKER_URL)
+CELERY_TASK_SERIALIZER = 'json'
+CELERY_RESULT_SERIALIZER = 'json'
+CELERY_ACCEPT_CONTENT = ['json']
+CELERY_TIMEZONE = TIME_ZONE
+CELERY_TASK_ACKS_LATE = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
+# 消息用量计数的校正间隔（秒），由 celery beat 定期执行：celery -A PocketAi beat -l info
+MESSAGE_USAGE_RECONCILE_INTERVAL = int(os.environ.get('MESSAGE_USAGE_RECONCILE_INTERVAL', 86400))
+CELERY_BEAT_SCHEDULE = {
+    'reconcile-message-usage': {
+        'task': 'ai_messages.tasks.reconcile_message_usage_task',
+        'schedule': MESSAGE_USAGE_RECONCILE_INTERVAL,
+    },
+}
+
+# 未配置消息队列时（本地开发、测试）任务在当前进程中同步执行
+if not CELERY_BROKER_URL:
+    CELERY_BROKER_URL = 'memory://'
+    CELERY_RESULT_BACKEND = 'cache+memory://'
+    CELERY_TASK_ALWAYS_EAGER = True
+    CELERY_TASK_EAGER_PROPAGATES = True
@@ -20,6 +20,8 @@ from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
+from utils.views import InternalStatsView
+
 # 创建 schema 视图
 schema_view = get_schema_view(
     openapi.Info(
@@ -43,6 +45,8 @@ urlpatterns = [
     path('api/', include('transactions.urls')),  # 添加交易记录API路由
     path('api/goals/', include('goals.urls')),  # 添加梦想基金API路由
     path('api/ai_messages/', include('ai_messages.urls')),  # 添加消息会话API路由
+    path('api/auth/', include('middleware.urls')),  # Token验证缓存失效
+    path('api/internal/stats/', InternalStatsView.as_view(), name='internal-stats'),  # 出站调用指标
 
     re_path(r'^swagger(?P<format>\.json|\.yaml)$', schema_view.without_ui(cache_timeout=0), name='schema-json'),
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
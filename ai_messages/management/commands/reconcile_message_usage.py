@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from ai_messages.quota import reconcile_message_usage
+
+
+class Command(BaseCommand):
+    help = '根据消息记录校正用户消息用量计数（MessageUsage）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', dest='user_id', type=int, help='只校正指定用户的计数')
+
+    def handle(self, *args, **options):
+        user_id = options.get('user_id')
+        self.stdout.write(f"开始校正消息用量{f'（用户ID={user_id}）' if user_id else ''}...")
+        count = reconcile_message_usage(user_id=user_id)
+        self.stdout.write(self.style.SUCCESS(f'校正完成，共修正{count}条计数'))
@@ -0,0 +1,71 @@
+# Generated by Django 3.2.25 on 2026-10-18 02:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_message_transactions(apps, schema_editor):
+    """根据旧的 transaction_ids 字符串回填消息与交易记录的关联"""
+    Message = apps.get_model('ai_messages', 'Message')
+    MessageTransaction = apps.get_model('ai_messages', 'MessageTransaction')
+    Transaction = apps.get_model('transactions', 'Transaction')
+
+    messages = Message.objects.exclude(transaction_ids__in=['', '0']).values_list('id', 'transaction_ids')
+
+    batch = []
+    for message_id, transaction_ids in messages.iterator():
+        id_list = [int(id_str) for id_str in transaction_ids.split(',') if id_str.strip().isdigit()]
+        batch.extend((message_id, position, transaction_id) for position, transaction_id in enumerate(id_list))
+
+        if len(batch) >= 1000:
+            _create_links(Transaction, MessageTransaction, batch)
+            batch = []
+
+    if batch:
+        _create_links(Transaction, MessageTransaction, batch)
+
+
+def _create_links(Transaction, MessageTransaction, batch):
+    # 跳过已被删除的交易记录
+    existing_ids = set(Transaction.objects.filter(
+        id__in={transaction_id for _, _, transaction_id in batch}
+    ).values_list('id', flat=True))
+
+    MessageTransaction.objects.bulk_create([
+        MessageTransaction(message_id=message_id, transaction_id=transaction_id, position=position)
+        for message_id, position, transaction_id in batch
+        if transaction_id in existing_ids
+    ], ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0001_initial'),
+        ('ai_messages', '0006_message_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageTransaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField(default=0, verbose_name='排序')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transaction_links', to='ai_messages.message', verbose_name='消息')),
+                ('transaction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='message_links', to='transactions.transaction', verbose_name='交易记录')),
+            ],
+            options={
+                'verbose_name': '消息关联交易',
+                'verbose_name_plural': '消息关联交易',
+                'ordering': ['message', 'position'],
+                'unique_together': {('message', 'transaction')},
+            },
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='transactions',
+            field=models.ManyToManyField(blank=True, related_name='messages', through='ai_messages.MessageTransaction', to='transactions.Transaction', verbose_name='关联交易'),
+        ),
+        migrations.RunPython(backfill_message_transactions, migrations.RunPython.noop),
+    ]
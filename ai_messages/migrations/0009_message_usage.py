@@ -0,0 +1,42 @@
+# Generated by Django 3.2.25 on 2026-10-18 03:08
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_message_usage(apps, schema_editor):
+    """按已有的用户消息初始化用量计数"""
+    Message = apps.get_model('ai_messages', 'Message')
+    MessageUsage = apps.get_model('ai_messages', 'MessageUsage')
+    counts = (
+        Message.objects.filter(is_user=True, user_id__isnull=False)
+        .order_by().values('user_id').annotate(count=Count('id'))
+    )
+    MessageUsage.objects.bulk_create(
+        [MessageUsage(user_id=row['user_id'], message_count=row['count']) for row in counts],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_messages', '0008_message_session_created_at_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.IntegerField(unique=True, verbose_name='用户ID')),
+                ('message_count', models.IntegerField(default=0, verbose_name='用户消息数')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': '消息用量',
+                'verbose_name_plural': '消息用量',
+            },
+        ),
+        migrations.RunPython(backfill_message_usage, migrations.RunPython.noop),
+    ]
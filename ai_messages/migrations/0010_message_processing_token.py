@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 03:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_messages', '0009_message_usage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='processing_token',
+            field=models.CharField(blank=True, default='', editable=False, max_length=32, verbose_name='处理令牌'),
+        ),
+    ]
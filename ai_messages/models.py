@@ -48,6 +48,19 @@ class Message(models.Model):
         (TYPE_SYSTEM, _('系统')),
     )
 
+    # 处理状态常量（用户消息的AI处理流程）
+    STATUS_PENDING = 'pending'
+    STATUS_PROCESSING = 'processing'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = (
+        (STATUS_PENDING, _('待处理')),
+        (STATUS_PROCESSING, _('处理中')),
+        (STATUS_COMPLETED, _('已完成')),
+        (STATUS_FAILED, _('处理失败')),
+    )
+
     session = models.ForeignKey(
         MessageSession,
         on_delete=models.CASCADE,
@@ -59,13 +72,22 @@ class Message(models.Model):
 
     content = models.TextField(_('消息内容'))
 
-    # 存储交易记录ID数组，以逗号分隔的字符串形式
+    # 存储交易记录ID数组，以逗号分隔的字符串形式（旧字段，保留给旧版客户端读取）
     transaction_ids = models.TextField(
         _('关联交易ID'),
         default="0",
         help_text=_('以逗号分隔的交易ID列表，默认为0表示无关联交易')
     )
 
+    # 关联的交易记录，通过 MessageTransaction 建立索引，支持反向查询
+    transactions = models.ManyToManyField(
+        'transactions.Transaction',
+        through='MessageTransaction',
+        related_name='messages',
+        blank=True,
+        verbose_name=_('关联交易')
+    )
+
     # 随机数字段
     random = models.IntegerField(
         _('随机种子'),
@@ -113,6 +135,30 @@ class Message(models.Model):
         blank=True
     )
 
+    # AI处理状态，助手消息和历史消息默认为已完成
+    status = models.CharField(
+        _('处理状态'),
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default=STATUS_COMPLETED,
+        db_index=True
+    )
+
+    attempts = models.PositiveSmallIntegerField(_('AI调用次数'), default=0)
+
+    # 当前处理者的令牌，start() 时生成，complete()/fail() 只在令牌未被后来的处理替换时生效
+    processing_token = models.CharField(_('处理令牌'), max_length=32, blank=True, default='', editable=False)
+
+    # AI回复对应的用户消息
+    reply_to = models.ForeignKey(
+        'self',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='replies',
+        verbose_name=_('回复的消息')
+    )
+
     # 元数据字段
     created_at = models.DateTimeField(_('创建时间'), auto_now_add=True)
     updated_at = models.DateTimeField(_('更新时间'), auto_now=True)
@@ -121,6 +167,10 @@ class Message(models.Model):
         verbose_name = _('消息')
         verbose_name_plural = _('消息')
         ordering = ['created_at']
+        indexes = [
+            # 会话消息按时间分页（含游标分页）
+            models.Index(fields=['session', 'created_at']),
+        ]
 
     def __str__(self):
         """字符串表示"""
@@ -145,3 +195,65 @@ class Message(models.Model):
             self.transaction_ids = "0"
         else:
             self.transaction_ids = ','.join(str(id) for id in id_list)
+
+    def link_transactions(self, id_list):
+        """
+        关联交易记录（消息需已保存）
+
+        同时更新旧的 transaction_ids 字段，保证旧版客户端仍能读取
+        """
+        MessageTransaction.objects.bulk_create([
+            MessageTransaction(message=self, transaction_id=transaction_id, position=position)
+            for position, transaction_id in enumerate(id_list)
+        ], ignore_conflicts=True)
+
+        self.set_transaction_ids_list(id_list)
+        Message.objects.filter(pk=self.pk).update(transaction_ids=self.transaction_ids)
+
+
+class MessageTransaction(models.Model):
+    """消息与交易记录的关联"""
+    message = models.ForeignKey(
+        Message,
+        on_delete=models.CASCADE,
+        related_name='transaction_links',
+        verbose_name=_('消息')
+    )
+    transaction = models.ForeignKey(
+        'transactions.Transaction',
+        on_delete=models.CASCADE,
+        related_name='message_links',
+        verbose_name=_('交易记录')
+    )
+    position = models.PositiveIntegerField(_('排序'), default=0)
+
+    created_at = models.DateTimeField(_('创建时间'), auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('消息关联交易')
+        verbose_name_plural = _('消息关联交易')
+        ordering = ['message', 'position']
+        unique_together = [('message', 'transaction')]
+
+    def __str__(self):
+        return f"{self.message_id} -> {self.transaction_id}"
+
+
+class MessageUsage(models.Model):
+    """
+    用户消息用量计数
+
+    免费用户的消息额度按用户消息条数计算。创建用户消息时在同一事务中
+    条件递增计数（见 ai_messages.quota），不再每次请求统计全部消息；
+    删除消息后由定期对账任务按实际条数校正。
+    """
+    user_id = models.IntegerField(_('用户ID'), unique=True)
+    message_count = models.IntegerField(_('用户消息数'), default=0)
+    updated_at = models.DateTimeField(_('更新时间'), auto_now=True)
+
+    class Meta:
+        verbose_name = _('消息用量')
+        verbose_name_plural = _('消息用量')
+
+    def __str__(self):
+        return f"{self.user_id}: {self.message_count}"
@@ -0,0 +1,403 @@
+import logging
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from transactions.models import Transaction
+from transactions.services import bulk_create_transactions
+from .models import Message
+from .quota import consume_message
+from .services import get_routing_config, route_ai_chat, stream_ai_chat
+
+logger = logging.getLogger(__name__)
+
+
+class MessageConflict(Exception):
+    """消息正在处理或已处理完成，不能再次处理"""
+
+
+class MessagePipeline:
+    """
+    AI消息处理流程
+
+    用户消息的状态流转: pending -> processing -> completed / failed，
+    failed 的消息可以重新进入 processing。
+
+    1. 短事务内保存用户消息（pending）
+    2. 事务外调用AI服务，不持有数据库写锁
+    3. 第二个短事务内创建交易记录和AI回复，并将用户消息标记为 completed
+    """
+
+    def __init__(self, user_id, session, token, ledger_id, asset_id=None):
+        self.user_id = user_id
+        self.session = session
+        self.token = token
+        self.ledger_id = ledger_id
+        self.asset_id = asset_id
+        self.max_attempts = getattr(settings, 'AI_MESSAGE_MAX_ATTEMPTS', 2)
+
+    @staticmethod
+    def stale_processing_cutoff():
+        """
+        早于该时间仍处于 processing 的消息视为处理中断（如worker崩溃），允许重新处理
+
+        按最坏情况估算一次处理的时长：每次尝试依次调用路由中的所有模型，每次调用等待并发名额后超时。
+        超过该时间后原来的处理仍可能在进行，由 complete() 检查处理令牌避免重复保存。
+        """
+        agent_timeout = settings.OUTBOUND_HTTP_UPSTREAMS.get('agent', {}).get('timeout', 30)
+        call_seconds = agent_timeout + getattr(settings, 'AI_AGENT_BULKHEAD_WAIT', 1)
+        route_length = len(get_routing_config()['fallbacks']) + 1
+        max_attempts = getattr(settings, 'AI_MESSAGE_MAX_ATTEMPTS', 2)
+        return timezone.now() - timedelta(seconds=call_seconds * route_length * max_attempts + 30)
+
+    @staticmethod
+    def get_model_name(model):
+        """获取模型名称"""
+        if model == 'ChatGPT':
+            return 'gpt-3.5-turbo'
+        elif model == 'DeepSeek':
+            return 'deepseek-chat'
+        else:
+            return 'qwen-max'
+
+    def create_user_message(self, content, is_voice=False, file_path=None, voice_date=None, message_limit=None):
+        """
+        保存用户消息（第一个事务），同一事务内计入消息用量
+
+        Args:
+            message_limit: 免费额度，None表示不限
+
+        Raises:
+            MessageQuotaExceeded: 已达到免费额度
+        """
+        with db_transaction.atomic():
+            consume_message(self.user_id, message_limit)
+            return Message.objects.create(
+                user_id=self.user_id,
+                session=self.session,
+                content=content,
+                message_type=Message.TYPE_USER,
+                is_user=True,
+                is_voice=is_voice,
+                file_path=file_path,
+                voice_date=voice_date,
+                status=Message.STATUS_PENDING,
+            )
+
+    def run(self, user_message):
+        """
+        处理用户消息，返回AI回复消息；AI服务多次失败时返回None
+
+        Raises:
+            MessageConflict: 消息正在被其他请求处理或已完成
+        """
+        self.start(user_message)
+
+        bot_response = self.call_agent(user_message)
+        if bot_response is None:
+            self.fail(user_message)
+            return None
+
+        return self.complete(user_message, bot_response)
+
+    def stream(self, user_message):
+        """
+        流式处理用户消息
+
+        Yields:
+            ("delta", str): AI回复文本片段
+            ("done", Message): 已保存的AI回复消息
+            ("failed", None): AI服务调用失败
+
+        Raises:
+            MessageConflict: 消息正在被其他请求处理或已完成
+        """
+        self.start(user_message)
+
+        # 客户端中途断开（生成器在 yield 处被关闭）或处理出错时标记为失败，消息可以立即重试
+        finished = False
+        try:
+            Message.objects.filter(pk=user_message.pk).update(attempts=F('attempts') + 1)
+            model_name = self.get_model_name(self.session.model)
+
+            bot_response = None
+            streamed = False
+            for event, payload in stream_ai_chat(user_message.content, self.token, model_name=model_name):
+                if event == 'delta':
+                    streamed = True
+                    yield 'delta', payload
+                elif event == 'result':
+                    bot_response = payload
+
+            # 还没有向客户端输出任何片段时，可以退回到普通调用重试
+            if bot_response is None and not streamed and self.max_attempts > 1:
+                self.max_attempts -= 1
+                bot_response = self.call_agent(user_message)
+
+            if bot_response is None:
+                self.fail(user_message)
+                finished = True
+                yield 'failed', None
+                return
+
+            ai_message = self.complete(user_message, bot_response)
+            finished = True
+            yield 'done', ai_message
+        finally:
+            if not finished:
+                self.fail(user_message)
+
+    def start(self, user_message):
+        """
+        pending/failed -> processing，条件更新保证同一消息不会被并发处理
+
+        同时写入新的处理令牌：处理中断的消息被重新处理后，原来的处理即使之后返回也不能保存结果
+        """
+        token = uuid.uuid4().hex
+        updated = Message.objects.filter(
+            Q(status__in=[Message.STATUS_PENDING, Message.STATUS_FAILED]) |
+            Q(status=Message.STATUS_PROCESSING, updated_at__lt=self.stale_processing_cutoff()),
+            pk=user_message.pk,
+        ).update(status=Message.STATUS_PROCESSING, processing_token=token, updated_at=timezone.now())
+
+        if not updated:
+            raise MessageConflict(user_message.pk)
+        user_message.status = Message.STATUS_PROCESSING
+        user_message.processing_token = token
+
+    def call_agent(self, user_message):
+        """在事务外调用AI服务（按模型路由对冲和故障转移），失败时按配置重试"""
+        model_name = self.get_model_name(self.session.model)
+
+        for attempt in range(1, self.max_attempts + 1):
+            Message.objects.filter(pk=user_message.pk).update(attempts=F('attempts') + 1)
+            bot_response = route_ai_chat(user_message.content, self.token, model_name=model_name)
+            if bot_response is not None:
+                return bot_response
+            logger.warning(f"AI服务无响应，消息ID={user_message.pk}，第{attempt}次尝试")
+
+        return None
+
+    def fail(self, user_message):
+        """processing -> failed（消息没有被其他处理接管时）"""
+        Message.objects.filter(
+            pk=user_message.pk, status=Message.STATUS_PROCESSING,
+            processing_token=user_message.processing_token,
+        ).update(status=Message.STATUS_FAILED, updated_at=timezone.now())
+        user_message.refresh_from_db(fields=['status', 'attempts'])
+
+    def complete(self, user_message, bot_response):
+        """保存交易记录和AI回复（第二个事务），processing -> completed"""
+        with db_transaction.atomic():
+            locked = Message.objects.select_for_update().get(pk=user_message.pk)
+            if (locked.status != Message.STATUS_PROCESSING
+                    or locked.processing_token != user_message.processing_token):
+                # 已完成，或处理超时后被重新处理接管
+                raise MessageConflict(user_message.pk)
+
+            # 处理交易数据
+            transactions = self.extract_transactions(bot_response)
+            transaction_ids = self.process_transactions(transactions)
+
+            # 提取AI回复内容、随机值和表情
+            ai_content = self.extract_ai_content(bot_response)
+            random_value, emoji_value = self.extract_random_emoji(bot_response)
+
+            ai_message = self.create_ai_message(
+                user_message, ai_content, random_value, emoji_value, transaction_ids
+            )
+
+            locked.status = Message.STATUS_COMPLETED
+            locked.save(update_fields=['status', 'updated_at'])
+
+            # 更新会话的最后更新时间
+            self.session.save()  # 触发auto_now字段更新
+
+        user_message.refresh_from_db(fields=['status', 'attempts', 'updated_at'])
+        return ai_message
+
+    def extract_transactions(self, bot_response):
+        """从AI响应中提取交易数据"""
+        transactions = []
+
+        # 记录日志，帮助调试
+        logger.debug(f"AI响应原始数据: {bot_response}")
+
+        if not isinstance(bot_response, dict):
+            return []
+
+        # 提取content字段
+        bot_content = bot_response.get('content', bot_response)
+
+        # 从不同可能的位置提取transactions
+        if isinstance(bot_content, dict):
+            if "transactions" in bot_content:
+                transactions = bot_content["transactions"]
+            elif "content" in bot_content and isinstance(bot_content["content"], dict):
+                if "transactions" in bot_content["content"]:
+                    transactions = bot_content["content"]["transactions"]
+        elif "transactions" in bot_response:
+            transactions = bot_response["transactions"]
+
+        # 确保transactions是列表
+        if not isinstance(transactions, list):
+            transactions = []
+
+        logger.debug(f"提取的交易数据: {transactions}")
+        return transactions
+
+    def process_transactions(self, transactions):
+        """处理交易数据并批量创建交易记录，每个资产的余额只更新一次"""
+        if not transactions:
+            return []
+
+        new_transactions = []
+        category_ids = {}
+        for transaction in transactions:
+            try:
+                # 确定交易类型
+                is_expense = transaction.get('type') == 'expense'
+                is_income = not is_expense
+
+                # 解析交易日期
+                transaction_date = self.parse_transaction_date(transaction)
+
+                # 解析交易金额
+                amount = self.parse_transaction_amount(transaction)
+
+                # 获取分类ID（同一条回复中相同分类只解析一次）
+                category_key = (transaction.get('category'), is_income)
+                if category_key not in category_ids:
+                    category_ids[category_key] = get_category_id(transaction.get('category'), is_income)
+
+                new_transactions.append(Transaction(
+                    user_id=self.user_id,
+                    ledger_id=self.ledger_id,
+                    asset_id=self.asset_id,
+                    category_id=category_ids[category_key],
+                    amount=amount,
+                    transaction_date=transaction_date,
+                    notes=transaction.get('note', ''),
+                    is_expense=is_expense,
+                ))
+            except Exception as e:
+                logger.error(f"解析交易数据失败: {str(e)}, 交易数据: {transaction}")
+
+        # 保存点保证批量写入失败不影响AI回复的保存
+        try:
+            with db_transaction.atomic():
+                created = bulk_create_transactions(new_transactions)
+        except Exception as e:
+            # 批量写入失败时逐条重试，一条交易出错不影响其他交易
+            logger.warning(f"批量创建交易记录失败，改为逐条创建: {str(e)}")
+            created = self.create_transactions_one_by_one(new_transactions)
+
+        transaction_ids = [tx.id for tx in created]
+        logger.debug(f"成功创建交易记录: IDs={transaction_ids}")
+        return transaction_ids
+
+    def create_transactions_one_by_one(self, new_transactions):
+        """逐条创建交易记录，每条使用单独的保存点"""
+        created = []
+        for tx in new_transactions:
+            # 批量写入回滚后清除已分配的主键
+            tx.pk = None
+            tx._state.adding = True
+            try:
+                with db_transaction.atomic():
+                    created.extend(bulk_create_transactions([tx]))
+            except Exception as e:
+                logger.error(f"创建交易记录失败: {str(e)}, 交易数据: amount={tx.amount}, notes={tx.notes}")
+        return created
+
+    def parse_transaction_date(self, transaction):
+        """解析交易日期"""
+        try:
+            return datetime.strptime(transaction['date'], "%Y-%m-%d %H:%M:%S")
+        except (ValueError, KeyError):
+            try:
+                return datetime.strptime(transaction.get('date', ''), "%Y-%m-%d")
+            except (ValueError, KeyError):
+                logger.warning(f"无法解析交易日期，使用当前时间: {transaction}")
+                return timezone.now()
+
+    def parse_transaction_amount(self, transaction):
+        """解析交易金额"""
+        try:
+            return Decimal(str(transaction.get('amount', 0)))
+        except (ValueError, TypeError, InvalidOperation):
+            logger.warning(f"无效的交易金额: {transaction.get('amount')}")
+            return Decimal('0')
+
+    def extract_ai_content(self, bot_response):
+        """从AI响应中提取内容"""
+        default_content = "The server is busy. Please try again later."
+
+        if not isinstance(bot_response, dict):
+            return default_content
+
+        # 按优先级尝试不同的内容位置
+        if "ai_output" in bot_response:
+            return bot_response['ai_output']
+
+        if "content" in bot_response:
+            content = bot_response['content']
+            if isinstance(content, dict):
+                if "ai_output" in content:
+                    return content['ai_output']
+                if "en" in content:
+                    return content['en']
+            if isinstance(content, str):
+                return content
+
+        if "en" in bot_response:
+            en_content = bot_response['en']
+            if isinstance(en_content, dict) and "ai_output" in en_content:
+                return en_content['ai_output']
+            if isinstance(en_content, str):
+                return en_content
+
+        return default_content
+
+    def extract_random_emoji(self, bot_response):
+        """从AI响应中提取随机值和表情"""
+        if isinstance(bot_response, dict):
+            return bot_response.get('random', 0), bot_response.get('emoji', '')
+        return 0, ''
+
+    def create_ai_message(self, user_message, content, random_value, emoji_value, transaction_ids):
+        """创建AI回复消息"""
+        ai_message = Message(
+            user_id=self.user_id,
+            session=self.session,
+            content=content,
+            message_type=Message.TYPE_ASSISTANT,
+            is_user=False,
+            random=random_value,
+            emoji=emoji_value,
+            reply_to=user_message,
+        )
+        ai_message.save()
+
+        # 如果有交易ID，关联到消息
+        if transaction_ids:
+            ai_message.link_transactions(transaction_ids)
+            logger.debug(f"设置AI消息的交易IDs: {ai_message.transaction_ids}")
+
+        return ai_message
+
+
+def get_category_id(category_name, transaction_type):
+    """根据分类名称和交易类型（是否收入）获取分类ID，使用进程内的分类索引，不查询数据库"""
+    from categorization.resolver import resolve_category_id
+
+    try:
+        return resolve_category_id(category_name, transaction_type)
+    except Exception as e:
+        logger.error(f"获取分类ID失败: {str(e)}")
+        return None
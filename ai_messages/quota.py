@@ -0,0 +1,136 @@
+"""
+免费用户的消息额度
+
+每个用户一行 MessageUsage 计数：
+- 查询用量是按唯一键的单行读取；
+- 创建用户消息时在同一事务中执行 UPDATE ... SET message_count = message_count + 1
+  WHERE user_id = ? AND message_count < 限额，更新到行才允许创建，
+  并发请求由数据库行锁串行，不会超出额度；
+- 计数首次使用时按已有消息条数初始化，删除消息时按删除的条数扣减（release_messages），
+  定期任务 reconcile_message_usage_task（CELERY_BEAT_SCHEDULE）按消息记录校正。
+"""
+import logging
+
+from django.conf import settings
+from django.db import IntegrityError, transaction as db_transaction
+from django.db.models import Count, F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import Message, MessageUsage
+
+logger = logging.getLogger(__name__)
+
+
+class MessageQuotaExceeded(Exception):
+    """消息数已达到免费额度"""
+
+    def __init__(self, message_count, message_limit):
+        super().__init__(f"消息数已达到免费额度: {message_count}/{message_limit}")
+        self.message_count = message_count
+        self.message_limit = message_limit
+
+
+def get_message_limit():
+    return getattr(settings, 'FREE_MESSAGE_LIMIT', 50)
+
+
+def count_user_messages(user_id):
+    """按消息记录统计用户消息条数（初始化和对账使用）"""
+    return Message.objects.filter(user_id=user_id, is_user=True).count()
+
+
+def _get_or_create_usage(user_id):
+    usage = MessageUsage.objects.filter(user_id=user_id).first()
+    if usage is not None:
+        return usage
+    try:
+        with db_transaction.atomic():
+            return MessageUsage.objects.create(user_id=user_id, message_count=count_user_messages(user_id))
+    except IntegrityError:
+        # 并发请求已创建
+        return MessageUsage.objects.get(user_id=user_id)
+
+
+def get_message_count(user_id):
+    """用户已发送的消息数"""
+    count = MessageUsage.objects.filter(user_id=user_id).values_list('message_count', flat=True).first()
+    if count is None:
+        count = _get_or_create_usage(user_id).message_count
+    return count
+
+
+def consume_message(user_id, message_limit=None):
+    """
+    计入一条用户消息，应与创建消息在同一事务中调用
+
+    Args:
+        message_limit: 免费额度，None表示不限（付费用户仍计数）
+
+    Raises:
+        MessageQuotaExceeded: 已达到额度
+    """
+    for attempt in range(2):
+        queryset = MessageUsage.objects.filter(user_id=user_id)
+        if message_limit is not None:
+            queryset = queryset.filter(message_count__lt=message_limit)
+        if queryset.update(message_count=F('message_count') + 1, updated_at=timezone.now()):
+            return
+        if attempt == 0:
+            # 计数不存在时初始化后重试，存在则说明已达到额度
+            usage = _get_or_create_usage(user_id)
+            if message_limit is not None and usage.message_count >= message_limit:
+                raise MessageQuotaExceeded(usage.message_count, message_limit)
+    raise MessageQuotaExceeded(get_message_count(user_id), message_limit)
+
+
+def release_messages(user_id, count=1):
+    """删除用户消息后扣减计数（不低于0），不重新统计消息记录"""
+    if not user_id or count <= 0:
+        return
+    MessageUsage.objects.filter(user_id=user_id).update(
+        message_count=Greatest(F('message_count') - count, Value(0)),
+        updated_at=timezone.now(),
+    )
+
+
+def reconcile_message_usage(user_id=None):
+    """
+    按消息记录校正用量计数
+
+    Args:
+        user_id: 只校正指定用户，None表示全部用户
+
+    Returns:
+        int: 被修正的计数条数
+    """
+    messages = Message.objects.filter(is_user=True, user_id__isnull=False)
+    usages = MessageUsage.objects.all()
+    if user_id is not None:
+        messages = messages.filter(user_id=user_id)
+        usages = usages.filter(user_id=user_id)
+
+    fixed = 0
+    with db_transaction.atomic():
+        # 先锁定计数再统计消息：已更新计数但未提交的 consume_message 提交后才会统计，
+        # 锁定之后的计入在本事务提交后执行，都不会被覆盖
+        locked = list(usages.select_for_update())
+        actual = dict(
+            messages.order_by().values('user_id').annotate(count=Count('id')).values_list('user_id', 'count')
+        )
+        for usage in locked:
+            count = actual.pop(usage.user_id, 0)
+            if usage.message_count != count:
+                usage.message_count = count
+                usage.save(update_fields=['message_count', 'updated_at'])
+                fixed += 1
+        # 有消息但还没有计数的用户
+        MessageUsage.objects.bulk_create(
+            [MessageUsage(user_id=uid, message_count=count) for uid, count in actual.items()],
+            ignore_conflicts=True
+        )
+        fixed += len(actual)
+
+    if fixed:
+        logger.info(f"校正消息用量计数{fixed}条")
+    return fixed
@@ -1,9 +1,40 @@
+from django.db import models
 from rest_framework import serializers
 from django.utils.translation import gettext_lazy as _
 from utils.serializers_fields import TimestampField
-from .models import MessageSession, Message
+from .models import MessageSession, Message, MessageTransaction
 from transactions.models import Transaction
-from transactions.serializers import TransactionSerializer
+from transactions.serializers import TransactionSerializer, TRANSACTION_DETAIL_RELATED
+
+
+def build_message_transaction_map(message_ids):
+    """一次查询加载多条消息关联的交易记录及其嵌套序列化需要的关联对象"""
+    transaction_map = {message_id: [] for message_id in message_ids}
+    if not message_ids:
+        return transaction_map
+
+    related = ['transaction__' + name for name in TRANSACTION_DETAIL_RELATED]
+    links = MessageTransaction.objects.filter(
+        message_id__in=message_ids
+    ).select_related('transaction', *related)
+
+    for link in links:
+        transaction_map[link.message_id].append(link.transaction)
+    return transaction_map
+
+
+class MessageListSerializer(serializers.ListSerializer):
+    """批量序列化消息时预先加载整页消息关联的交易记录，避免逐条查询"""
+
+    def to_representation(self, data):
+        messages = data.all() if isinstance(data, models.Manager) else data
+        messages = list(messages)
+
+        transaction_map = self.context.setdefault('transaction_map', {})
+        missing_ids = [message.id for message in messages if message.id not in transaction_map]
+        transaction_map.update(build_message_transaction_map(missing_ids))
+
+        return super().to_representation(messages)
 
 
 class MessageSerializer(serializers.ModelSerializer):
@@ -18,17 +49,23 @@ class MessageSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'session', 'content', 'transaction_ids',
             'random', 'emoji', 'file_path', 'voice_date', 'message_type', 'message_type_display', 'is_user',
-            'transactions', 'created_at', 'updated_at'
+            'status', 'reply_to', 'transactions', 'created_at', 'updated_at'
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at', 'is_user']
+        # transaction_ids 是旧字段，由 link_transactions 与关联表同步维护，不允许直接修改
+        read_only_fields = ['id', 'transaction_ids', 'created_at', 'updated_at', 'is_user', 'status', 'reply_to']
+        list_serializer_class = MessageListSerializer
 
     def get_transactions(self, obj):
         """获取关联的交易记录详情"""
-        transaction_ids = obj.get_transaction_ids_list()
-        if not transaction_ids:
-            return []
-
-        transactions = Transaction.objects.filter(id__in=transaction_ids)
+        # 列表序列化时使用 MessageListSerializer 预先加载的交易记录
+        transaction_map = self.context.get('transaction_map', {})
+        if obj.id in transaction_map:
+            transactions = list(transaction_map[obj.id])
+        else:
+            transactions = build_message_transaction_map([obj.id])[obj.id]
+
+        # 与 Transaction 默认排序保持一致
+        transactions.sort(key=lambda t: t.transaction_date, reverse=True)
         return TransactionSerializer(transactions, many=True).data
 
 
@@ -67,12 +104,11 @@ class MessageCreateSerializer(serializers.ModelSerializer):
         transaction_ids = validated_data.pop('transaction_ids', None)
 
         message = Message(**validated_data)
+        message.save()
 
-        # 设置交易ID列表
+        # 关联交易记录
         if transaction_ids:
-            message.set_transaction_ids_list(transaction_ids)
-
-        message.save()
+            message.link_transactions(transaction_ids)
         return message
 
 
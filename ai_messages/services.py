@@ -1,10 +1,21 @@
 import json
 import logging
-from typing import Dict, Any, Optional, Union
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import ExitStack
+from typing import Dict, Any, Iterator, Optional, Tuple, Union
 
 import requests
+from django.conf import settings
+from django.core.cache import cache
 from requests.exceptions import RequestException
 
+from utils.http_client import get_client
+from utils.resilience import STATE_OPEN, CallRejected, get_breaker, get_bulkhead
+
 # 配置日志
 logger = logging.getLogger(__name__)
 
@@ -12,8 +23,28 @@ logger = logging.getLogger(__name__)
 BASE_URL = 'https://pocket.pulseheath.com/agent/'
 # BASE_URL = 'http://127.0.0.1:8000/'
 
+# 助手列表缓存（所有用户共享同一份列表，使用服务凭证 AI_AGENT_SERVICE_TOKEN 获取）
+ASSISTANT_LIST_CACHE_KEY = 'ai_messages:assistant_list'
+ASSISTANT_LIST_REFRESH_LOCK_KEY = 'ai_messages:assistant_list:refreshing'
+# 刷新的去重锁时间（秒），刷新任务丢失时到期后允许再次刷新
+ASSISTANT_LIST_REFRESH_LOCK_TTL = 60
+# 没有缓存且其他请求正在获取时，等待其结果的最长时间（秒）
+ASSISTANT_LIST_COLD_FILL_WAIT = 5
+
+# 模型路由的默认参数，见 settings.AI_MODEL_ROUTING
+DEFAULT_MODEL_ROUTING = {
+    'fallbacks': [],
+    'hedge': False,
+    'hedge_delay': 8,
+    'min_hedge_delay': 1,
+    'min_samples': 20,
+    'window_size': 200,
+    'max_workers': 16,
+}
+
 
-def fire(url: str, params: Dict[str, Any], token: str, method: str = "post") -> requests.Response:
+def fire(url: str, params: Dict[str, Any], token: str, method: str = "post", stream: bool = False,
+         breaker: str = 'agent') -> requests.Response:
     """
     发送HTTP请求到AI服务
 
@@ -22,41 +53,112 @@ def fire(url: str, params: Dict[str, Any], token: str, method: str = "post") ->
         params: 请求参数
         token: 认证令牌
         method: HTTP方法，默认为"post"
+        stream: 是否以流式方式读取响应体，流式响应关闭前一直占用并发名额和熔断器调用，
+            调用方必须关闭响应（见 _send_stream）
+        breaker: 熔断器名称，聊天接口按模型分别熔断（见 model_breaker_name）
 
     Returns:
         requests.Response: HTTP响应对象
+
+    Raises:
+        CallRejected: 熔断器打开或并发调用数已满，请求没有发出
     """
     headers = {
         'Content-Type': 'application/json',
         'Authorization': token,
     }
+    if stream:
+        headers['Accept'] = 'text/event-stream, application/json'
 
     full_url = f"{BASE_URL}{url}"
+    # 复用共享连接池，超时见 OUTBOUND_HTTP_UPSTREAMS['agent']
+    client = get_client('agent')
+    method = method.lower()
+    if method not in ("post", "get"):
+        logger.error(f"不支持的HTTP方法: {method}")
+        raise ValueError(f"不支持的HTTP方法: {method}")
 
-    try:
-        if method.lower() == "post":
-            return requests.post(
+    def send():
+        if method == "post":
+            return client.post(
                 full_url,
                 params=params,
                 headers=headers,
                 data=json.dumps(params),
-                timeout=30  # 添加超时设置
+                stream=stream,
             )
-        elif method.lower() == "get":
-            return requests.get(
-                full_url,
-                headers=headers,
-                timeout=30  # 添加超时设置
-            )
-        else:
-            logger.error(f"不支持的HTTP方法: {method}")
-            raise ValueError(f"不支持的HTTP方法: {method}")
+        return client.get(
+            full_url,
+            headers=headers,
+        )
+
+    # 限制进程内同时进行的AI服务调用数，熔断期间直接拒绝（抛出 CallRejected）
+    bulkhead = get_bulkhead(
+        'agent',
+        getattr(settings, 'AI_AGENT_MAX_CONCURRENT', 8),
+        getattr(settings, 'AI_AGENT_BULKHEAD_WAIT', 1),
+    )
+    try:
+        if stream:
+            return _send_stream(send, bulkhead, get_breaker(breaker))
+        with bulkhead.acquire(), get_breaker(breaker).protect() as call:
+            response = send()
+            if response.status_code >= 500:
+                call.fail()
+            return response
     except RequestException as e:
         logger.error(f"请求失败: {str(e)}")
         # 重新抛出异常，让调用者处理
         raise
 
 
+def _send_stream(send, bulkhead, breaker) -> requests.Response:
+    """
+    发送流式请求，并发名额和熔断器调用保持到响应关闭（response.close() 或 with response:）
+
+    读取响应体出错时调用方调用 response.fail() 记为失败。
+    慢调用按收到响应头的耗时判断，正常的长时间输出不计为慢调用。
+    """
+    stack = ExitStack()
+    stack.enter_context(bulkhead.acquire())
+    try:
+        breaker.before_call()
+    except CallRejected:
+        stack.close()
+        raise
+
+    started = time.monotonic()
+    state = {'failed': True, 'duration': None}
+
+    def record():
+        duration = state['duration']
+        breaker.record(state['failed'], time.monotonic() - started if duration is None else duration)
+
+    stack.callback(record)
+    try:
+        response = send()
+    except BaseException:
+        stack.close()
+        raise
+    state['duration'] = time.monotonic() - started
+    state['failed'] = response.status_code >= 500
+
+    close = response.close
+
+    def close_and_release():
+        try:
+            close()
+        finally:
+            stack.close()
+
+    def fail():
+        state['failed'] = True
+
+    response.close = close_and_release
+    response.fail = fail
+    return response
+
+
 def create_ai_chat(
         users_input: str,
         token: str,
@@ -78,6 +180,30 @@ def create_ai_chat(
     Returns:
         str: AI的回复文本，如果失败则返回None
     """
+    try:
+        return request_ai_chat(users_input, token, assistant_name, model_name, language, user_template_id)
+    except CallRejected as e:
+        logger.warning(f"AI聊天服务调用被拒绝: {str(e)}")
+        return None
+    except Exception as e:
+        logger.error(f"调用AI聊天服务失败: {str(e)}")
+        return None
+
+
+def request_ai_chat(
+        users_input: str,
+        token: str,
+        assistant_name: str = "Alice",
+        model_name: str = "qwen-max",
+        language: str = "en",
+        user_template_id: str = None,
+) -> dict[str, Any]:
+    """
+    调用AI聊天服务，失败时抛出异常（参数同 create_ai_chat）
+
+    Raises:
+        CallRejected: 熔断器打开或并发调用数已满
+    """
     params = {
         "assistant_name": assistant_name,
         "model_name": model_name,
@@ -85,15 +211,98 @@ def create_ai_chat(
         "language": language,
         "user_template_id": user_template_id
     }
-    print(params)
+    logger.debug(f"AI聊天服务请求: 模型={model_name}, 助手={assistant_name}, 输入长度={len(users_input or '')}")
+
+    response = fire(url="api/agent/chat/", token=token, method="post", params=params,
+                    breaker=model_breaker_name(model_name))
+    logger.info(f"AI聊天服务响应状态码: {response.status_code}")
+    return response.json()['data']['content']
+
+
+def stream_ai_chat(
+        users_input: str,
+        token: str,
+        assistant_name: str = "Alice",
+        model_name: str = "qwen-max",
+        language: str = "en",
+        user_template_id: str = None,
+) -> Iterator[Tuple[str, Any]]:
+    """
+    以流式方式调用AI聊天服务
+
+    AI服务返回 text/event-stream 时，逐条转发 ``data: {"delta": "..."}`` 片段，
+    最后一条 ``data: {"data": {"content": {...}}}`` 为完整结果；
+    返回普通JSON时，直接产出完整结果。
+
+    Yields:
+        ("delta", str): 回复文本片段
+        ("result", dict): 完整的回复内容，与 create_ai_chat 的返回值相同
+    """
+    params = {
+        "assistant_name": assistant_name,
+        "model_name": model_name,
+        "users_input": users_input,
+        "language": language,
+        "user_template_id": user_template_id,
+        "stream": True,
+    }
 
     try:
-        response = fire(url="api/agent/chat/", token=token, method="post", params=params)
-        logger.info(f"AI聊天服务响应状态码: {response.status_code}")
-        print(response.json())
-        return response.json()['data']['content']
+        response = fire(url="api/agent/chat/", token=token, method="post", params=params, stream=True,
+                        breaker=model_breaker_name(model_name))
+        logger.info(f"AI聊天服务（流式）响应状态码: {response.status_code}")
+    except CallRejected as e:
+        logger.warning(f"AI聊天服务调用被拒绝: {str(e)}")
+        return
     except Exception as e:
         logger.error(f"调用AI聊天服务失败: {str(e)}")
+        return
+
+    with response:
+        try:
+            if not response.headers.get('Content-Type', '').startswith('text/event-stream'):
+                yield "result", response.json()['data']['content']
+                return
+
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith('data:'):
+                    continue
+                payload = line[len('data:'):].strip()
+                if payload == '[DONE]':
+                    break
+
+                chunk = json.loads(payload)
+                if 'delta' in chunk:
+                    yield "delta", chunk['delta']
+                elif 'data' in chunk:
+                    yield "result", chunk['data']['content']
+        except Exception as e:
+            response.fail()
+            logger.error(f"读取AI聊天服务流式响应失败: {str(e)}")
+
+
+def fetch_assistant_list(token: str) -> Optional[dict]:
+    """
+    从AI服务获取助手列表
+
+    Returns:
+        dict: AI服务的响应内容（列表在 data 中），失败时返回None
+    """
+    try:
+        response = fire(url="api/assistant/", token=token, method="get", params={})
+        logger.info(f"获取助手列表响应状态码: {response.status_code}")
+
+        if response.status_code != 200:
+            logger.error(f"获取助手列表失败: {response.status_code} - {response.text}")
+            return None
+        payload = response.json()
+        if not isinstance(payload, dict) or 'data' not in payload:
+            logger.error(f"助手列表响应格式错误: {response.text[:200]}")
+            return None
+        return payload
+
+    except Exception as e:
+        logger.error(f"获取助手列表失败: {str(e)}")
         return None
 
 
@@ -107,18 +316,292 @@ def get_assistant_list(token: str) -> list:
     Returns:
         list: 助手列表，如果失败则返回空列表
     """
+    return fetch_assistant_list(token) or []
+
+
+def refresh_assistant_list() -> bool:
+    """使用服务凭证从AI服务重新获取助手列表并写入缓存，失败时保留原有缓存，完成后释放刷新锁"""
     try:
-        response = fire(url="api/assistant/", token=token, method="get", params={})
-        logger.info(f"获取助手列表响应状态码: {response.status_code}")
+        payload = fetch_assistant_list(settings.AI_AGENT_SERVICE_TOKEN)
+        if payload is None:
+            return False
+        cache.set(
+            ASSISTANT_LIST_CACHE_KEY,
+            {'payload': payload, 'fetched_at': time.time()},
+            getattr(settings, 'ASSISTANT_LIST_CACHE_MAX_AGE', 86400)
+        )
+        return True
+    finally:
+        cache.delete(ASSISTANT_LIST_REFRESH_LOCK_KEY)
+
+
+def _schedule_assistant_list_refresh() -> None:
+    """
+    在后台刷新助手列表，同一时间只有一个刷新
+
+    没有配置消息队列时 Celery 任务会在当前请求中同步执行，这时改为在线程中刷新。
+    """
+    if not cache.add(ASSISTANT_LIST_REFRESH_LOCK_KEY, 1, ASSISTANT_LIST_REFRESH_LOCK_TTL):
+        return
 
-        if response.status_code == 200:
-            return response.json()
+    from .tasks import refresh_assistant_list_task
+    try:
+        if getattr(settings, 'CELERY_TASK_ALWAYS_EAGER', False):
+            threading.Thread(target=refresh_assistant_list, name='assistant-list-refresh', daemon=True).start()
         else:
-            logger.error(f"获取助手列表失败: {response.status_code} - {response.text}")
-            return []
+            refresh_assistant_list_task.delay()
+    except Exception as e:
+        cache.delete(ASSISTANT_LIST_REFRESH_LOCK_KEY)
+        logger.error(f"提交助手列表刷新任务失败: {str(e)}")
+
+
+def _fill_assistant_list() -> Optional[dict]:
+    """
+    没有缓存时获取助手列表
+
+    取得刷新锁的请求同步请求AI服务，其他请求等待其结果，
+    避免缓存过期的瞬间每个请求都去请求AI服务。
+    """
+    if cache.add(ASSISTANT_LIST_REFRESH_LOCK_KEY, 1, ASSISTANT_LIST_REFRESH_LOCK_TTL):
+        refresh_assistant_list()
+        return cache.get(ASSISTANT_LIST_CACHE_KEY)
+
+    deadline = time.monotonic() + ASSISTANT_LIST_COLD_FILL_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(0.1)
+        entry = cache.get(ASSISTANT_LIST_CACHE_KEY)
+        if entry is not None:
+            return entry
+        if cache.get(ASSISTANT_LIST_REFRESH_LOCK_KEY) is None:
+            # 获取失败，不再等待
+            break
+    return None
+
+
+def get_cached_assistant_list(token: str) -> Tuple[Optional[dict], Optional[int]]:
+    """
+    读取缓存的助手列表（stale-while-revalidate）
+
+    - 缓存不超过 ASSISTANT_LIST_CACHE_SOFT_TTL 秒：直接返回
+    - 超过后仍返回缓存内容，同时在后台刷新；AI服务不可用时继续使用旧列表，
+      直到 ASSISTANT_LIST_CACHE_MAX_AGE 秒后从缓存中过期
+    - 没有缓存：同步请求AI服务（同一时间只有一个请求）
+
+    缓存的列表由所有用户共享，只使用服务凭证获取；没有配置 AI_AGENT_SERVICE_TOKEN 时
+    不使用缓存，直接用当前用户的Token请求。
+
+    Returns:
+        (dict, int): AI服务的响应内容和缓存时长（秒），没有可用列表时为 (None, None)
+    """
+    if not getattr(settings, 'AI_AGENT_SERVICE_TOKEN', ''):
+        return fetch_assistant_list(token), 0
+
+    entry = cache.get(ASSISTANT_LIST_CACHE_KEY)
+    if entry is None:
+        entry = _fill_assistant_list()
+        if entry is None:
+            return None, None
+
+    age = max(0, int(time.time() - entry['fetched_at']))
+    if age >= getattr(settings, 'ASSISTANT_LIST_CACHE_SOFT_TTL', 300):
+        _schedule_assistant_list_refresh()
+    return entry['payload'], age
+
+
+def model_breaker_name(model_name: str) -> str:
+    """聊天接口按模型熔断，某个模型不可用时不影响其他模型"""
+    return f"agent:{model_name}"
+
+
+def get_routing_config() -> dict:
+    return {**DEFAULT_MODEL_ROUTING, **getattr(settings, 'AI_MODEL_ROUTING', {})}
+
+
+class ModelLatency:
+    """单个模型最近成功调用的耗时和失败次数"""
+
+    def __init__(self, model_name, window_size):
+        self.model_name = model_name
+        self._samples = deque(maxlen=window_size)
+        self._lock = threading.Lock()
+        self.successes = 0
+        self.errors = 0
+
+    def record(self, duration, failed=False):
+        with self._lock:
+            if failed:
+                self.errors += 1
+            else:
+                self.successes += 1
+                self._samples.append(duration)
+
+    def percentile(self, percent):
+        """最近成功调用耗时的百分位数（秒），没有样本时返回None"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[max(0, math.ceil(len(samples) * percent / 100) - 1)]
+
+    def sample_count(self):
+        with self._lock:
+            return len(self._samples)
+
+    def stats(self):
+        p50, p95 = self.percentile(50), self.percentile(95)
+        return {
+            'model': self.model_name,
+            'samples': self.sample_count(),
+            'successes': self.successes,
+            'errors': self.errors,
+            'p50_ms': round(p50 * 1000, 2) if p50 is not None else None,
+            'p95_ms': round(p95 * 1000, 2) if p95 is not None else None,
+            'breaker': get_breaker(model_breaker_name(self.model_name)).current_state(),
+        }
+
+
+_latencies = {}
+_routing_lock = threading.Lock()
+_executor = None
 
+
+def get_model_latency(model_name: str) -> ModelLatency:
+    latency = _latencies.get(model_name)
+    if latency is None:
+        with _routing_lock:
+            latency = _latencies.setdefault(
+                model_name, ModelLatency(model_name, get_routing_config()['window_size'])
+            )
+    return latency
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """执行模型调用的共享线程池（对冲请求需要并发等待多个模型）"""
+    global _executor
+    if _executor is None:
+        with _routing_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=get_routing_config()['max_workers'], thread_name_prefix='ai-model'
+                )
+    return _executor
+
+
+def get_hedge_delay(model_name: str) -> float:
+    """发送对冲请求前等待的时间（秒）：模型的 p95 耗时，样本不足时使用配置的默认值"""
+    config = get_routing_config()
+    latency = get_model_latency(model_name)
+    if latency.sample_count() < config['min_samples']:
+        return config['hedge_delay']
+    return max(config['min_hedge_delay'], latency.percentile(95))
+
+
+def get_model_route(model_name: str) -> list:
+    """
+    本次调用依次尝试的模型
+
+    会话选择的模型在前（熔断时跳过），其余备选模型按 p95 耗时从低到高排列，
+    没有耗时数据的排在最后；熔断中的模型不参与。
+    """
+    config = get_routing_config()
+
+    def p95(name):
+        latency = get_model_latency(name)
+        if latency.sample_count() < config['min_samples']:
+            return math.inf
+        return latency.percentile(95)
+
+    fallbacks = sorted((name for name in config['fallbacks'] if name != model_name), key=p95)
+    return [
+        name for name in [model_name, *fallbacks]
+        if get_breaker(model_breaker_name(name)).current_state() != STATE_OPEN
+    ]
+
+
+def _call_model(model_name: str, users_input: str, token: str, options: dict):
+    """调用一个模型并记录耗时，失败时返回None"""
+    started = time.monotonic()
+    try:
+        content = request_ai_chat(users_input, token, model_name=model_name, **options)
+    except CallRejected as e:
+        # 请求没有发出，不计入模型的失败次数
+        logger.warning(f"AI聊天服务调用被拒绝: {str(e)}")
+        return None
     except Exception as e:
-        logger.error(f"获取助手列表失败: {str(e)}")
-        return []
+        get_model_latency(model_name).record(time.monotonic() - started, failed=True)
+        logger.error(f"调用AI聊天服务失败: 模型={model_name}, {str(e)}")
+        return None
+    get_model_latency(model_name).record(time.monotonic() - started)
+    return content
+
+
+def route_ai_chat(users_input: str, token: str, model_name: str = "qwen-max", **options) -> Optional[dict[str, Any]]:
+    """
+    按模型路由调用AI聊天服务，参数同 create_ai_chat
+
+    - 开启对冲（AI_MODEL_ROUTING['hedge']）时，当前模型超过其 p95 耗时仍未返回，
+      向下一个模型发送一次对冲请求，取先返回的结果；已发出的另一个请求无法中断，
+      会继续占用线程和并发名额直到返回或超时，尚未开始的请求会被取消
+    - 模型调用失败且没有其他请求在进行时，转到下一个模型
+    - 熔断中的模型直接跳过
+
+    Returns:
+        dict: 最先成功的回复内容，所有模型都失败时返回None
+    """
+    route = get_model_route(model_name)
+    if not route:
+        logger.warning(f"所有模型都在熔断中: {model_name}")
+        return None
+
+    config = get_routing_config()
+    executor = _get_executor()
+    pending = {}
+    hedged = False
+
+    def launch():
+        name = route.pop(0)
+        pending[executor.submit(_call_model, name, users_input, token, options)] = name
+        return name
+
+    current = launch()
+    while pending:
+        timeout = None
+        if config['hedge'] and not hedged and route:
+            timeout = get_hedge_delay(current)
+        done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+        if not done:
+            hedged = True
+            logger.info(f"模型 {current} 超过 {timeout:.2f} 秒未返回，发送对冲请求")
+            current = launch()
+            continue
+
+        for future in done:
+            name = pending.pop(future)
+            content = future.result()
+            if content is not None:
+                if name != model_name:
+                    logger.info(f"AI回复由备选模型返回: {model_name} -> {name}")
+                for other in pending:
+                    other.cancel()
+                return content
+
+        if not pending and route:
+            logger.warning(f"模型调用失败，转到下一个模型: {route[0]}")
+            current = launch()
+
+    return None
+
+
+def get_model_routing_stats() -> list:
+    """各模型的耗时、失败次数和熔断状态"""
+    return [latency.stats() for latency in list(_latencies.values())]
+
+
+def reset_model_routing():
+    """清空耗时数据（测试或修改配置后使用）"""
+    with _routing_lock:
+        _latencies.clear()
+
 
 creat_ai_chat = create_ai_chat
@@ -0,0 +1,88 @@
+import logging
+import uuid
+
+from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import Message
+from .pipeline import MessagePipeline, MessageConflict
+from .quota import reconcile_message_usage
+from .services import refresh_assistant_list
+
+logger = logging.getLogger(__name__)
+
+# 任务需要的用户Token保存在缓存中，任务参数只传引用，Token不经过消息队列
+TASK_TOKEN_PREFIX = 'ai_messages:task-token:'
+
+
+def stash_token(token):
+    """保存任务使用的Token，返回任务参数中传递的引用"""
+    token_ref = uuid.uuid4().hex
+    cache.set(f'{TASK_TOKEN_PREFIX}{token_ref}', token, getattr(settings, 'AI_TASK_TOKEN_TTL', 3600))
+    return token_ref
+
+
+def load_token(token_ref):
+    return cache.get(f'{TASK_TOKEN_PREFIX}{token_ref}')
+
+
+def discard_token(token_ref):
+    cache.delete(f'{TASK_TOKEN_PREFIX}{token_ref}')
+
+
+@shared_task(ignore_result=True)
+def process_message_task(message_id, token_ref, ledger_id, asset_id=None):
+    """异步处理用户消息：调用AI服务并保存交易记录和AI回复"""
+    try:
+        user_message = Message.objects.select_related('session').get(pk=message_id)
+    except Message.DoesNotExist:
+        logger.warning(f"异步处理的消息不存在: ID={message_id}")
+        discard_token(token_ref)
+        return
+
+    token = load_token(token_ref)
+    if token is None:
+        # Token已过期（任务积压超过 AI_TASK_TOKEN_TTL），标记失败，用户可以重试
+        logger.warning(f"异步处理的Token已过期: 消息ID={message_id}")
+        Message.objects.filter(pk=message_id, status=Message.STATUS_PENDING).update(
+            status=Message.STATUS_FAILED, updated_at=timezone.now()
+        )
+        return
+
+    pipeline = MessagePipeline(
+        user_id=user_message.user_id,
+        session=user_message.session,
+        token=token,
+        ledger_id=ledger_id,
+        asset_id=asset_id,
+    )
+
+    conflict = False
+    try:
+        pipeline.run(user_message)
+    except MessageConflict:
+        # 重复投递或已被其他worker处理，Token留给正在处理的任务
+        conflict = True
+        logger.info(f"消息已在处理或已完成，跳过: ID={message_id}")
+    except Exception:
+        # 未预期的错误：标记失败让用户可以立即重试，而不是等待过期回收
+        logger.exception(f"异步处理消息出错: ID={message_id}")
+        pipeline.fail(user_message)
+        raise
+    finally:
+        if not conflict:
+            discard_token(token_ref)
+
+
+@shared_task(ignore_result=True)
+def reconcile_message_usage_task(user_id=None):
+    """按消息记录校正消息用量计数，由 CELERY_BEAT_SCHEDULE 定期执行"""
+    reconcile_message_usage(user_id)
+
+
+@shared_task(ignore_result=True)
+def refresh_assistant_list_task():
+    """后台刷新缓存的助手列表（使用服务凭证）"""
+    refresh_assistant_list()
@@ -1,3 +1,688 @@
-from django.test import TestCase
+import json
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from importlib import import_module
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import request_finished
+from django.db import close_old_connections, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory
+
+from assets.models import Asset
+from categorization.models import TransactionCategory
+from ledger.models import Ledger
+from transactions.models import Transaction
+from transactions.services import bulk_create_transactions
+from utils.resilience import BulkheadFullError, get_resilience_stats, reset_resilience
+from . import services
+from .models import MessageSession, Message, MessageUsage
+from .pipeline import MessagePipeline, MessageConflict
+from .quota import get_message_count, reconcile_message_usage
+from .serializers import MessageSerializer
+from .tasks import load_token, process_message_task, reconcile_message_usage_task, stash_token
+from .services import ASSISTANT_LIST_CACHE_KEY, ASSISTANT_LIST_REFRESH_LOCK_KEY
+from .views import MessageSessionViewSet, MessageViewSet
+
+
+BOT_RESPONSE = {
+    'content': {
+        'ai_output': 'Recorded.',
+        'transactions': [
+            {'type': 'expense', 'category': 'Food', 'amount': 20, 'date': '2025-03-11', 'note': 'breakfast'},
+        ],
+    },
+    'random': 3,
+    'emoji': 'smile',
+}
+
+
+class MessagePipelineTestCase(TestCase):
+    def setUp(self):
+        self.ledger = Ledger.objects.create(name='Daily', user_id=1)
+        TransactionCategory.objects.create(name='Food', is_income=False)
+        self.session = MessageSession.objects.create(user_id=1, model='Qwen')
+        self.pipeline = MessagePipeline(user_id=1, session=self.session, token='token', ledger_id=self.ledger.id)
+
+    @mock.patch('ai_messages.pipeline.route_ai_chat', return_value=BOT_RESPONSE)
+    def test_run_completes_message(self, chat):
+        user_message = self.pipeline.create_user_message('breakfast 20')
+        self.assertEqual(user_message.status, Message.STATUS_PENDING)
+
+        ai_message = self.pipeline.run(user_message)
+
+        self.assertEqual(user_message.status, Message.STATUS_COMPLETED)
+        self.assertEqual(ai_message.reply_to_id, user_message.id)
+        self.assertEqual(ai_message.content, 'Recorded.')
+        self.assertEqual(ai_message.transactions.count(), 1)
+        self.assertEqual(ai_message.get_transaction_ids_list(), list(ai_message.transactions.values_list('id', flat=True)))
+        # 反向查询：交易记录由哪条消息创建
+        self.assertEqual(ai_message.transactions.get().messages.get(), ai_message)
+
+    @mock.patch('ai_messages.pipeline.route_ai_chat', return_value=None)
+    def test_failed_message_can_be_retried(self, chat):
+        user_message = self.pipeline.create_user_message('breakfast 20')
+
+        self.assertIsNone(self.pipeline.run(user_message))
+        self.assertEqual(user_message.status, Message.STATUS_FAILED)
+        self.assertEqual(user_message.attempts, self.pipeline.max_attempts)
+
+        chat.return_value = BOT_RESPONSE
+        self.assertIsNotNone(self.pipeline.run(user_message))
+        self.assertEqual(user_message.status, Message.STATUS_COMPLETED)
+
+        # 已完成的消息不能再次处理
+        with self.assertRaises(MessageConflict):
+            self.pipeline.run(user_message)
+
+    def test_stale_run_cannot_complete_after_takeover(self):
+        user_message = self.pipeline.create_user_message('breakfast 20')
+        stale = Message.objects.get(pk=user_message.pk)
+        self.pipeline.start(stale)
+
+        # 超过 stale_processing_cutoff 后重新处理，原来的处理返回时不能再保存结果
+        Message.objects.filter(pk=user_message.pk).update(
+            updated_at=self.pipeline.stale_processing_cutoff() - timedelta(seconds=1)
+        )
+        with mock.patch('ai_messages.pipeline.route_ai_chat', return_value=BOT_RESPONSE):
+            self.pipeline.run(user_message)
+        with self.assertRaises(MessageConflict):
+            self.pipeline.complete(stale, BOT_RESPONSE)
+        self.assertEqual(Transaction.objects.count(), 1)
+        self.assertEqual(Message.objects.filter(reply_to=user_message).count(), 1)
+
+        # 路由中每个模型都可能超时，中断判定时间覆盖整条路由
+        with override_settings(AI_MODEL_ROUTING={'fallbacks': ['a', 'b', 'c']}, AI_MESSAGE_MAX_ATTEMPTS=2,
+                               AI_AGENT_BULKHEAD_WAIT=1):
+            agent_timeout = settings.OUTBOUND_HTTP_UPSTREAMS['agent']['timeout']
+            cutoff = self.pipeline.stale_processing_cutoff()
+            self.assertLess(cutoff, timezone.now() - timedelta(seconds=(agent_timeout + 1) * 4 * 2))
+
+    @mock.patch('ai_messages.pipeline.stream_ai_chat')
+    def test_stream_closed_after_first_delta_fails_message(self, stream):
+        stream.return_value = iter([('delta', 'Recor'), ('delta', 'ded.'), ('result', BOT_RESPONSE)])
+        user_message = self.pipeline.create_user_message('breakfast 20')
+        events = self.pipeline.stream(user_message)
+        self.assertEqual(next(events), ('delta', 'Recor'))
+        events.close()
+
+        user_message.refresh_from_db()
+        self.assertEqual(user_message.status, Message.STATUS_FAILED)
+        # 可以立即重试
+        with mock.patch('ai_messages.pipeline.route_ai_chat', return_value=BOT_RESPONSE):
+            self.assertIsNotNone(self.pipeline.run(user_message))
+
+    def test_bad_transaction_does_not_drop_others(self):
+        def create(transactions):
+            if any(tx.notes == 'bad' for tx in transactions):
+                raise ValueError('bad row')
+            return bulk_create_transactions(transactions)
+
+        rows = [
+            {'type': 'expense', 'category': 'Food', 'amount': 20, 'note': 'breakfast'},
+            {'type': 'expense', 'category': 'Food', 'amount': 5, 'note': 'bad'},
+            {'type': 'expense', 'category': 'Food', 'amount': 30, 'note': 'lunch'},
+        ]
+        with mock.patch('ai_messages.pipeline.bulk_create_transactions', side_effect=create):
+            transaction_ids = self.pipeline.process_transactions(rows)
+
+        self.assertEqual(len(transaction_ids), 2)
+        self.assertEqual(
+            sorted(Transaction.objects.values_list('notes', flat=True)), ['breakfast', 'lunch']
+        )
+
+    @mock.patch('ai_messages.pipeline.route_ai_chat', return_value=None)
+    def test_retry_rejects_other_users_ledger_and_asset(self, chat):
+        user_message = self.pipeline.create_user_message('breakfast 20')
+        self.pipeline.run(user_message)
+        other_ledger = Ledger.objects.create(name='Other', user_id=2)
+        other_asset = Asset.objects.create(name='Other', user_id='2', balance=100)
+
+        def retry(data):
+            request = APIRequestFactory().post(f'/api/ai_messages/{user_message.id}/retry/', data, format='json')
+            request.remote_user = {'id': 1}
+            return MessageViewSet.as_view({'post': 'retry'})(request, pk=user_message.id)
+
+        self.assertEqual(retry({}).status_code, 400)
+        self.assertEqual(retry({'ledger_id': other_ledger.id}).status_code, 403)
+        self.assertEqual(retry({'ledger_id': self.ledger.id, 'asset_id': other_asset.id}).status_code, 403)
+
+        chat.return_value = BOT_RESPONSE
+        self.assertEqual(retry({'ledger_id': self.ledger.id}).status_code, 200)
+        self.assertFalse(Transaction.objects.filter(ledger=other_ledger).exists())
+
+
+class AsyncMessageTestCase(TestCase):
+    def setUp(self):
+        self.ledger = Ledger.objects.create(name='Daily', user_id=1)
+        self.session = MessageSession.objects.create(user_id=1, model='Qwen')
+
+    def _post(self, path, data):
+        request = APIRequestFactory().post(path, data, format='json', HTTP_AUTHORIZATION='Bearer token')
+        request.remote_user = {'id': 1, 'is_premium': True}
+        return MessageViewSet.as_view({'post': 'text_message'})(request)
+
+    @mock.patch('ai_messages.pipeline.route_ai_chat', return_value=BOT_RESPONSE)
+    def test_async_text_message_returns_job_id(self, chat):
+        with mock.patch.object(process_message_task, 'delay', wraps=process_message_task.delay) as delay:
+            response = self._post('/api/ai_messages/text_message/?async=true', {
+                'session_id': self.session.id, 'content': 'breakfast 20', 'ledger_id': self.ledger.id,
+            })
+
+        self.assertEqual(response.status_code, 202)
+        # 任务参数中没有用户Token，AI服务仍使用该Token调用
+        self.assertNotIn('Bearer token', delay.call_args.args)
+        self.assertEqual(chat.call_args.args[1], 'Bearer token')
+        job_id = response.data['data']['job_id']
+
+        # 测试环境下任务同步执行，状态接口可以直接拿到AI回复
+        request = APIRequestFactory().get(f'/api/ai_messages/{job_id}/status/')
+        request.remote_user = {'id': 1}
+        response = MessageViewSet.as_view({'get': 'processing_status'})(request, pk=job_id)
+
+        self.assertEqual(response.data['data']['status'], Message.STATUS_COMPLETED)
+        self.assertEqual(len(response.data['data']['results']), 2)
+        self.assertFalse(response.has_header('Retry-After'))
+
+        # 未完成时立即返回，并给出轮询间隔
+        pending = Message.objects.create(
+            user_id=1, session=self.session, content='lunch 30', is_user=True, status=Message.STATUS_PENDING
+        )
+        request = APIRequestFactory().get(f'/api/ai_messages/{pending.id}/status/')
+        request.remote_user = {'id': 1}
+        response = MessageViewSet.as_view({'get': 'processing_status'})(request, pk=pending.id)
+        self.assertEqual(response.data['data']['status'], Message.STATUS_PENDING)
+        self.assertEqual(response['Retry-After'], '2')
+
+    @mock.patch('ai_messages.pipeline.route_ai_chat', return_value=BOT_RESPONSE)
+    def test_task_error_fails_message_and_discards_token(self, chat):
+        message = Message.objects.create(
+            user_id=1, session=self.session, content='breakfast 20', is_user=True, status=Message.STATUS_PENDING
+        )
+        token_ref = stash_token('Bearer token')
+
+        with mock.patch.object(MessagePipeline, 'complete', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                process_message_task(message.id, token_ref, self.ledger.id)
+
+        message.refresh_from_db()
+        self.assertEqual(message.status, Message.STATUS_FAILED)
+        self.assertIsNone(load_token(token_ref))
+
+    @mock.patch('ai_messages.pipeline.stream_ai_chat')
+    def test_text_message_stream(self, stream):
+        stream.return_value = iter([('delta', 'Recor'), ('delta', 'ded.'), ('result', BOT_RESPONSE)])
+        request = APIRequestFactory().post('/api/ai_messages/text_message_stream/', {
+            'session_id': self.session.id, 'content': 'breakfast 20', 'ledger_id': self.ledger.id,
+        }, format='json')
+        request.remote_user = {'id': 1, 'is_premium': True}
+
+        response = MessageViewSet.as_view({'post': 'text_message_stream'})(request)
+        body = b''.join(response.streaming_content).decode()
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = [line[len('event: '):] for line in body.splitlines() if line.startswith('event: ')]
+        self.assertEqual(events, ['message', 'delta', 'delta', 'done'])
+        self.assertEqual(Message.objects.get(message_type=Message.TYPE_USER).status, Message.STATUS_COMPLETED)
+
+
+    @mock.patch('ai_messages.pipeline.stream_ai_chat')
+    def test_stream_closed_by_client_marks_failed(self, stream):
+        stream.return_value = iter([('delta', 'Recor'), ('delta', 'ded.'), ('result', BOT_RESPONSE)])
+        request = APIRequestFactory().post('/api/ai_messages/text_message_stream/', {
+            'session_id': self.session.id, 'content': 'breakfast 20', 'ledger_id': self.ledger.id,
+        }, format='json')
+        request.remote_user = {'id': 1, 'is_premium': True}
+
+        response = MessageViewSet.as_view({'post': 'text_message_stream'})(request)
+        content = response.streaming_content
+        next(content)  # message
+        next(content)  # 第一个 delta
+        # 客户端断开时WSGI服务器调用 response.close()，与测试客户端一样不关闭测试数据库连接
+        request_finished.disconnect(close_old_connections)
+        self.addCleanup(request_finished.connect, close_old_connections)
+        response.close()
+
+        user_message = Message.objects.get(message_type=Message.TYPE_USER)
+        self.assertEqual(user_message.status, Message.STATUS_FAILED)
+        self.assertFalse(Message.objects.filter(reply_to=user_message).exists())
+
+class MessageSerializerQueryTestCase(TestCase):
+    def setUp(self):
+        ledger = Ledger.objects.create(name='Daily', user_id=1)
+        category = TransactionCategory.objects.create(name='Food', is_income=False)
+        self.session = MessageSession.objects.create(user_id=1, model='Qwen')
+        for _ in range(5):
+            transaction_ids = [
+                Transaction.objects.create(
+                    user_id='1', ledger=ledger, category=category,
+                    amount=10, transaction_date=timezone.now()
+                ).id
+                for _ in range(2)
+            ]
+            message = Message.objects.create(
+                session=self.session, content='reply', message_type=Message.TYPE_ASSISTANT
+            )
+            message.link_transactions(transaction_ids)
+
+    def test_list_serialization_uses_constant_queries(self):
+        # 一次查询消息，一次查询所有关联交易
+        with self.assertNumQueries(2):
+            data = MessageSerializer(self.session.messages.all(), many=True).data
+
+        self.assertEqual(len(data), 5)
+        self.assertTrue(all(len(item['transactions']) == 2 for item in data))
+
+
+@override_settings(FREE_MESSAGE_LIMIT=2)
+class MessageQuotaTestCase(TestCase):
+    """免费用户的消息额度"""
+
+    def setUp(self):
+        self.ledger = Ledger.objects.create(name='Daily', user_id=1)
+        self.session = MessageSession.objects.create(user_id=1, model='Qwen')
+        # 计数上线前已有的消息
+        Message.objects.create(user_id=1, session=self.session, content='old', is_user=True)
+
+    def _post(self):
+        request = APIRequestFactory().post('/api/ai_messages/text_message/?async=true', {
+            'session_id': self.session.id, 'content': 'breakfast 20', 'ledger_id': self.ledger.id,
+        }, format='json')
+        request.remote_user = {'id': 1, 'is_premium': False}
+        return MessageViewSet.as_view({'post': 'text_message'})(request)
+
+    @mock.patch('ai_messages.pipeline.route_ai_chat', return_value=BOT_RESPONSE)
+    def test_limit_enforced_by_counter(self, chat):
+        # 首次读取时按已有消息初始化，之后是单行读取
+        self.assertEqual(get_message_count(1), 1)
+        with self.assertNumQueries(1):
+            self.assertEqual(get_message_count(1), 1)
+
+        self.assertEqual(self._post().status_code, 202)
+        response = self._post()
+        self.assertEqual(response.status_code, 598)
+        self.assertEqual(response.data['data'], {'message_count': 2, 'message_limit': 2})
+        self.assertEqual(Message.objects.filter(user_id=1, is_user=True).count(), 2)
+
+        # 删除消息后按实际条数校正
+        Message.objects.filter(content='old').delete()
+        self.assertEqual(reconcile_message_usage(), 1)
+        self.assertEqual(MessageUsage.objects.get(user_id=1).message_count, 1)
+
+    def _delete(self, viewset, pk):
+        request = APIRequestFactory().delete('/')
+        request.remote_user = {'id': 1}
+        return viewset.as_view({'delete': 'destroy'})(request, pk=pk)
+
+    def test_delete_releases_quota_without_recount(self):
+        self.assertEqual(get_message_count(1), 1)
+        Message.objects.create(user_id=1, session=self.session, content='new', is_user=True)
+        self.assertEqual(get_message_count(1), 1)
+
+        # 删除单条消息只扣减计数，不按用户统计消息条数
+        with CaptureQueriesContext(connection) as queries:
+            self._delete(MessageViewSet, Message.objects.get(content='old').pk)
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+        self.assertEqual(get_message_count(1), 0)
+
+        # 计数不低于0，由定期校正恢复为实际条数
+        self._delete(MessageViewSet, Message.objects.get(content='new').pk)
+        self.assertEqual(get_message_count(1), 0)
+        Message.objects.create(user_id=1, session=self.session, content='again', is_user=True)
+        self.assertEqual(reconcile_message_usage(), 1)
+        self.assertEqual(get_message_count(1), 1)
+
+        self._delete(MessageSessionViewSet, self.session.pk)
+        self.assertEqual(get_message_count(1), 0)
+
+    def test_reconcile_scheduled(self):
+        entry = settings.CELERY_BEAT_SCHEDULE['reconcile-message-usage']
+        self.assertEqual(entry['task'], reconcile_message_usage_task.name)
+
+
+class MessageTransactionLinkTestCase(TestCase):
+    """消息与交易记录的关联表"""
+
+    def setUp(self):
+        ledger = Ledger.objects.create(name='Daily', user_id=1)
+        self.session = MessageSession.objects.create(user_id=1, model='Qwen')
+        self.transactions = [
+            Transaction.objects.create(user_id='1', ledger=ledger, amount=10, transaction_date=timezone.now())
+            for _ in range(3)
+        ]
+
+    def test_backfill_from_legacy_transaction_ids(self):
+        first, second, third = self.transactions
+        linked = Message.objects.create(
+            session=self.session, content='reply', message_type=Message.TYPE_ASSISTANT,
+            transaction_ids=f'{second.id},{first.id},999999'
+        )
+        empty = Message.objects.create(
+            session=self.session, content='reply', message_type=Message.TYPE_ASSISTANT, transaction_ids='0'
+        )
+
+        migration = import_module('ai_messages.migrations.0007_message_transactions')
+        migration.backfill_message_transactions(django_apps, None)
+        # 可重复执行
+        migration.backfill_message_transactions(django_apps, None)
+
+        # 按原顺序关联，已删除的交易记录被跳过
+        self.assertEqual(
+            list(linked.transaction_links.values_list('transaction_id', 'position')),
+            [(second.id, 0), (first.id, 1)]
+        )
+        self.assertFalse(empty.transactions.exists())
+        # 反向查询：交易记录由哪条消息创建
+        self.assertEqual(list(first.messages.all()), [linked])
+        self.assertFalse(third.messages.exists())
+
+    def test_transaction_ids_not_writable(self):
+        message = Message.objects.create(session=self.session, content='reply', message_type=Message.TYPE_ASSISTANT)
+        message.link_transactions([self.transactions[0].id])
+
+        serializer = MessageSerializer(message, data={'transaction_ids': str(self.transactions[1].id)}, partial=True)
+        self.assertTrue(serializer.is_valid())
+        serializer.save()
+
+        message.refresh_from_db()
+        self.assertEqual(message.get_transaction_ids_list(), [self.transactions[0].id])
+        self.assertEqual(list(message.transactions.all()), [self.transactions[0]])
+
+
+@override_settings(AI_AGENT_SERVICE_TOKEN='Token service')
+class AssistantListCacheTestCase(TestCase):
+    """助手列表缓存"""
+
+    def setUp(self):
+        cache.clear()
+
+    def _get(self):
+        request = APIRequestFactory().get('/api/ai_messages/assistant/', HTTP_AUTHORIZATION='Bearer token')
+        request.remote_user = {'id': 1}
+        return MessageViewSet.as_view({'get': 'assistant'})(request)
+
+    def _wait_for_refresh(self):
+        # 没有消息队列时在线程中刷新
+        deadline = time.monotonic() + 5
+        while cache.get(ASSISTANT_LIST_REFRESH_LOCK_KEY) is not None and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    @mock.patch('ai_messages.services.fire')
+    def test_serves_stale_list_while_refreshing(self, fire):
+        fire.return_value = mock.Mock(status_code=200, json=lambda: {'data': [{'name': 'Alice'}]})
+        self.assertEqual(self._get().data['data'], [{'name': 'Alice'}])
+        response = self._get()
+        self.assertEqual(response['Age'], '0')
+        self.assertEqual(fire.call_count, 1)
+        # 共享的列表使用服务凭证获取，而不是触发刷新的用户的Token
+        self.assertEqual(fire.call_args.kwargs['token'], 'Token service')
+
+        # 过期后AI服务不可用：继续返回旧列表
+        entry = cache.get(ASSISTANT_LIST_CACHE_KEY)
+        entry['fetched_at'] = time.time() - 600
+        cache.set(ASSISTANT_LIST_CACHE_KEY, entry)
+        fire.side_effect = Exception('timeout')
+        response = self._get()
+        self.assertEqual(response.data['data'], [{'name': 'Alice'}])
+        self.assertEqual(int(response['Age']), 600)
+        self._wait_for_refresh()
+
+        # 刷新成功后返回新列表
+        fire.side_effect = None
+        fire.return_value = mock.Mock(status_code=200, json=lambda: {'data': [{'name': 'Bob'}]})
+        self._get()
+        self._wait_for_refresh()
+        self.assertEqual(self._get().data['data'], [{'name': 'Bob'}])
+        self.assertEqual(fire.call_args.kwargs['token'], 'Token service')
+
+    @mock.patch('ai_messages.services.fire')
+    def test_refresh_runs_outside_request_without_broker(self, fire):
+        cache.set(ASSISTANT_LIST_CACHE_KEY, {'payload': {'data': []}, 'fetched_at': time.time() - 600})
+        release = threading.Event()
+
+        def slow_fire(**kwargs):
+            release.wait(5)
+            return mock.Mock(status_code=200, json=lambda: {'data': [{'name': 'Bob'}]})
+
+        fire.side_effect = slow_fire
+        started = time.monotonic()
+        self.assertEqual(self._get().data['data'], [])
+        self.assertLess(time.monotonic() - started, 1)
+        # 刷新进行中不会重复提交
+        self._get()
+        release.set()
+        self._wait_for_refresh()
+        self.assertEqual(fire.call_count, 1)
+        self.assertEqual(self._get().data['data'], [{'name': 'Bob'}])
+
+    @mock.patch('ai_messages.services.fire')
+    def test_cold_fill_waits_for_running_fetch(self, fire):
+        cache.add(ASSISTANT_LIST_REFRESH_LOCK_KEY, 1)
+
+        def fill():
+            time.sleep(0.2)
+            cache.set(ASSISTANT_LIST_CACHE_KEY, {'payload': {'data': [{'name': 'Alice'}]}, 'fetched_at': time.time()})
+
+        threading.Thread(target=fill).start()
+        self.assertEqual(self._get().data['data'], [{'name': 'Alice'}])
+        fire.assert_not_called()
+
+    @mock.patch('ai_messages.services.fire', side_effect=Exception('timeout'))
+    def test_unavailable_without_cache(self, fire):
+        self.assertEqual(self._get().status_code, 503)
+
+    @override_settings(AI_AGENT_SERVICE_TOKEN='')
+    @mock.patch('ai_messages.services.fire')
+    def test_not_shared_without_service_token(self, fire):
+        fire.return_value = mock.Mock(status_code=200, json=lambda: {'data': [{'name': 'Alice'}]})
+        self._get()
+        self._get()
+        self.assertEqual(fire.call_count, 2)
+        self.assertEqual(fire.call_args.kwargs['token'], 'Bearer token')
+        self.assertIsNone(cache.get(ASSISTANT_LIST_CACHE_KEY))
+
+
+class FakeAgentHandler(BaseHTTPRequestHandler):
+    """
+    本地假AI服务，按请求的模型（server.modes，默认 server.mode）返回：
+    ok 成功；error 返回500；slow 等待 server.slow_seconds 秒后成功；block 等待 server.release 后成功；
+    stream 以 text/event-stream 返回一个片段，等待 server.release 后返回完整结果；
+    broken_stream 返回一个片段后返回无法解析的数据
+    """
+
+    def do_POST(self):
+        self.server.requests += 1
+        model = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or '{}').get('model_name')
+        mode = self.server.modes.get(model, self.server.mode)
+        if mode in ('stream', 'broken_stream'):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            self.write_chunk(b'data: {"delta": "Got"}\n\n')
+            if mode == 'broken_stream':
+                self.write_chunk(b'data: {broken\n\n')
+            else:
+                self.server.release.wait(5)
+                result = json.dumps({'data': {'content': self.server.replies.get(model, BOT_RESPONSE)}})
+                self.write_chunk(f'data: {result}\n\ndata: [DONE]\n\n'.encode())
+            self.write_chunk(b'')
+            return
+        if mode == 'block':
+            self.server.release.wait(5)
+        elif mode == 'slow':
+            time.sleep(self.server.slow_seconds)
+        if mode == 'error':
+            status, body = 500, {'detail': 'error'}
+        else:
+            status, body = 200, {'data': {'content': self.server.replies.get(model, BOT_RESPONSE)}}
+        body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def write_chunk(self, data):
+        try:
+            self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端提前关闭了流式响应
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+def start_fake_agent(testcase):
+    """启动本地假AI服务并让 services 请求它，测试结束时关闭"""
+    reset_resilience()
+    testcase.addCleanup(reset_resilience)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeAgentHandler)
+    server.mode = 'ok'
+    server.modes = {}
+    server.replies = {}
+    server.slow_seconds = 1
+    server.requests = 0
+    server.release = threading.Event()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    testcase.addCleanup(server.server_close)
+    testcase.addCleanup(server.shutdown)
+    patcher = mock.patch.object(services, 'BASE_URL', f'http://127.0.0.1:{server.server_port}/')
+    patcher.start()
+    testcase.addCleanup(patcher.stop)
+    return server
+
+
+@override_settings(
+    CIRCUIT_BREAKERS={'default': {'window_size': 4, 'minimum_calls': 2, 'open_seconds': 0.2}},
+    AI_AGENT_MAX_CONCURRENT=1,
+    AI_AGENT_BULKHEAD_WAIT=0,
+)
+class AgentResilienceTestCase(TestCase):
+    """AI服务调用的熔断和并发隔离"""
+
+    def setUp(self):
+        self.server = start_fake_agent(self)
+
+    def chat(self):
+        return services.create_ai_chat('breakfast 20', 'token')
+
+    def test_circuit_opens_and_recovers(self):
+        self.assertEqual(self.chat(), BOT_RESPONSE)
+
+        # 2次调用中失败率达到50%，熔断
+        self.server.mode = 'error'
+        self.assertIsNone(self.chat())
+        # 熔断期间不再请求AI服务
+        self.assertIsNone(self.chat())
+        self.assertEqual(self.server.requests, 2)
+        breaker = get_resilience_stats()['breakers'][0]
+        self.assertEqual((breaker['state'], breaker['rejected']), ('open', 1))
+
+        # 半开状态下试探调用成功后关闭
+        self.server.mode = 'ok'
+        time.sleep(0.25)
+        self.assertEqual(self.chat(), BOT_RESPONSE)
+        breaker = get_resilience_stats()['breakers'][0]
+        self.assertEqual(breaker['state'], 'closed')
+        self.assertEqual(breaker['transitions'], {'open': 1, 'half_open': 1, 'closed': 1})
+
+    def test_bulkhead_rejects_concurrent_calls(self):
+        self.server.mode = 'block'
+        results = []
+        worker = threading.Thread(target=lambda: results.append(self.chat()))
+        worker.start()
+        while not self.server.requests:
+            time.sleep(0.01)
+
+        with self.assertRaises(BulkheadFullError):
+            services.fire('api/agent/chat/', {}, 'token')
+        self.server.release.set()
+        worker.join()
+        self.assertEqual(results, [BOT_RESPONSE])
+        self.assertEqual(get_resilience_stats()['bulkheads'][0]['rejected'], 1)
+
+
+    def test_stream_holds_slot_until_consumed(self):
+        self.server.mode = 'stream'
+        events = services.stream_ai_chat('breakfast 20', 'token')
+        self.assertEqual(next(events), ('delta', 'Got'))
+        # 读取响应体期间仍占用并发名额，熔断器调用尚未结束
+        stats = get_resilience_stats()
+        self.assertEqual(stats['bulkheads'][0]['in_flight'], 1)
+        self.assertEqual(stats['breakers'][0]['calls'], 0)
+        self.assertIsNone(self.chat())
+
+        self.server.release.set()
+        self.assertEqual(list(events), [('result', BOT_RESPONSE)])
+        stats = get_resilience_stats()
+        self.assertEqual(stats['bulkheads'][0]['in_flight'], 0)
+        self.assertEqual(stats['breakers'][-1]['calls'], 1)
+        self.server.mode = 'ok'
+        self.assertEqual(self.chat(), BOT_RESPONSE)
+
+    def test_stream_closed_early_or_broken_releases_slot(self):
+        self.server.mode = 'stream'
+        events = services.stream_ai_chat('breakfast 20', 'token')
+        next(events)
+        events.close()
+        self.server.release.set()
+        self.assertEqual(get_resilience_stats()['bulkheads'][0]['in_flight'], 0)
+
+        self.server.mode = 'broken_stream'
+        self.assertEqual(list(services.stream_ai_chat('breakfast 20', 'token')), [('delta', 'Got')])
+        breaker = get_resilience_stats()['breakers'][0]
+        self.assertEqual((breaker['calls'], breaker['failures']), (2, 1))
+        self.assertEqual(get_resilience_stats()['bulkheads'][0]['in_flight'], 0)
+
+
+@override_settings(AI_MODEL_ROUTING={
+    'fallbacks': ['qwen-max', 'deepseek-chat', 'gpt-3.5-turbo'], 'hedge': True,
+    'min_samples': 3, 'hedge_delay': 5, 'min_hedge_delay': 0.05,
+})
+class ModelRoutingTestCase(TestCase):
+    """模型路由：对冲请求和故障转移"""
+
+    def setUp(self):
+        self.server = start_fake_agent(self)
+        self.server.replies = {name: {'model': name} for name in ('qwen-max', 'deepseek-chat', 'gpt-3.5-turbo')}
+        services.reset_model_routing()
+        self.addCleanup(services.reset_model_routing)
+        # deepseek-chat 比 gpt-3.5-turbo 快，优先作为备选
+        for name, duration in (('qwen-max', 0.05), ('deepseek-chat', 0.1), ('gpt-3.5-turbo', 0.5)):
+            for _ in range(3):
+                services.get_model_latency(name).record(duration)
+
+    def route(self):
+        return services.route_ai_chat('breakfast 20', 'token', model_name='qwen-max')
+
+    def test_hedges_slow_model(self):
+        self.assertEqual(services.get_model_route('qwen-max'), ['qwen-max', 'deepseek-chat', 'gpt-3.5-turbo'])
+        self.server.modes = {'qwen-max': 'slow'}
+        started = time.monotonic()
+        self.assertEqual(self.route(), {'model': 'deepseek-chat'})
+        # 不等待慢模型返回
+        self.assertLess(time.monotonic() - started, self.server.slow_seconds)
+
+    def test_no_hedging_by_default(self):
+        self.server.modes = {'qwen-max': 'slow'}
+        self.server.slow_seconds = 0.2
+        with override_settings(AI_MODEL_ROUTING={'fallbacks': ['qwen-max', 'deepseek-chat'], 'min_samples': 3}):
+            self.assertEqual(self.route(), {'model': 'qwen-max'})
+        self.assertEqual(self.server.requests, 1)
+
+    def test_fails_over_on_error(self):
+        self.server.modes = {'qwen-max': 'error', 'deepseek-chat': 'error'}
+        self.assertEqual(self.route(), {'model': 'gpt-3.5-turbo'})
+        stats = {item['model']: item for item in services.get_model_routing_stats()}
+        self.assertEqual(stats['qwen-max']['errors'], 1)
+        self.assertEqual(stats['deepseek-chat']['errors'], 1)
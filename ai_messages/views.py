@@ -2,22 +2,25 @@ from rest_framework import serializers
 from rest_framework.decorators import action
 from rest_framework.viewsets import GenericViewSet
 from django.utils.translation import gettext_lazy as _
-from django.http import Http404
+from django.http import Http404, StreamingHttpResponse
+from django.core.serializers.json import DjangoJSONEncoder
+from django.conf import settings
+import json
 
-from datetime import datetime
-from django.utils import timezone
-from decimal import Decimal, InvalidOperation
-
-from transactions.models import Transaction
 from utils.permissions import IsAuthenticatedExternal
 from utils.mixins import *
+from assets.models import Asset
+from ledger.models import Ledger
 from .models import MessageSession, Message
 from .serializers import (
     MessageSessionSerializer, MessageSessionCreateSerializer,
     MessageSerializer, MessageCreateSerializer,
     MessageSessionDetailSerializer, MessageProcessSerializer
 )
-from .services import creat_ai_chat, get_assistant_list
+from .services import get_cached_assistant_list
+from .pipeline import MessagePipeline, MessageConflict
+from .quota import MessageQuotaExceeded, get_message_count, get_message_limit, release_messages
+from .tasks import process_message_task, stash_token
 from django.db import transaction as db_transaction
 from utils.viewsets import StandardResponseViewSet
 from utils.pagination import CustomPagination
@@ -25,6 +28,9 @@ from utils.pagination import CustomPagination
 # 配置日志
 logger = logging.getLogger(__name__)
 
+# 会话消息的游标分页排序（pagination=cursor 时使用），对应 (session, created_at) 索引
+MESSAGE_KEYSET_ORDERING = ('created_at', 'id')
+
 
 class MessageSessionViewSet(CreateModelMixin,
                             RetrieveModelMixin,
@@ -76,8 +82,11 @@ class MessageSessionViewSet(CreateModelMixin,
                 # 获取用户的所有会话ID
                 session_ids = MessageSession.objects.filter(user_id=user_id).values_list('id', flat=True)
                 
-                # 删除用户的所有消息
-                deleted_messages_count = Message.objects.filter(session_id__in=session_ids).delete()[0]
+                # 删除用户的所有消息，用量计数扣减删除的用户消息条数
+                messages = Message.objects.filter(session_id__in=session_ids)
+                user_messages_count = messages.filter(user_id=user_id, is_user=True).count()
+                deleted_messages_count = messages.delete()[0]
+                release_messages(user_id, user_messages_count)
                 
                 # 删除用户的所有会话
                 deleted_sessions_count = MessageSession.objects.filter(user_id=user_id).delete()[0]
@@ -98,6 +107,13 @@ class MessageSessionViewSet(CreateModelMixin,
                 'data': None
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    def perform_destroy(self, instance):
+        user_id = self.request.remote_user.get('id')
+        # 会话中的消息随会话删除，用量计数扣减其中的用户消息条数
+        user_messages_count = instance.messages.filter(user_id=user_id, is_user=True).count()
+        super().perform_destroy(instance)
+        release_messages(user_id, user_messages_count)
+
     def get_serializer_class(self):
         """根据操作返回不同的序列化器"""
         if self.action == 'create':
@@ -164,9 +180,10 @@ class MessageSessionViewSet(CreateModelMixin,
         # 确保分页器已初始化
         paginator = self.pagination_class()
         paginator.page_size = self.pagination_class.page_size
+        paginator.keyset_ordering = MESSAGE_KEYSET_ORDERING
 
         # 分页
-        page = paginator.paginate_queryset(messages, request)
+        page = paginator.paginate_queryset(messages, request, view=self)
         if page is not None:
             serializer = MessageSerializer(page, many=True)
             return paginator.get_paginated_response(serializer.data)
@@ -206,9 +223,10 @@ class MessageSessionViewSet(CreateModelMixin,
             # 确保分页器已初始化
             paginator = self.pagination_class()
             paginator.page_size = self.pagination_class.page_size
+            paginator.keyset_ordering = MESSAGE_KEYSET_ORDERING
 
             # 分页
-            page = paginator.paginate_queryset(messages, request)
+            page = paginator.paginate_queryset(messages, request, view=self)
             if page is not None:
                 serializer = MessageSerializer(page, many=True)
                 return paginator.get_paginated_response(serializer.data)
@@ -246,12 +264,7 @@ class MessageSessionViewSet(CreateModelMixin,
             return Response({
                 'code': 200,
                 'msg': _('获取成功'),
-                'data': {
-                    'count': self.paginator.page.paginator.count,
-                    'next': self.paginator.get_next_link(),
-                    'previous': self.paginator.get_previous_link(),
-                    'results': serializer.data
-                }
+                'data': self.paginator.get_paginated_data(serializer.data)
             })
 
         # 如果没有分页，手动格式化响应
@@ -333,6 +346,12 @@ class MessageViewSet(CreateModelMixin,
 
         return obj
 
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        # 删除用户消息后扣减用量计数
+        if instance.is_user and instance.user_id:
+            release_messages(instance.user_id)
+
     def perform_create(self, serializer):
         """创建消息时验证会话归属"""
         session_id = serializer.validated_data.get('session').id
@@ -350,13 +369,23 @@ class MessageViewSet(CreateModelMixin,
 
     @action(detail=False, methods=['get'])
     def assistant(self, request):
+        """助手列表，读取缓存（Age 响应头为缓存时长），过期后在后台刷新"""
         auth_header = request.META.get('HTTP_AUTHORIZATION', '')
-        rsp = get_assistant_list(auth_header)
-        return Response({
+        rsp, age = get_cached_assistant_list(auth_header)
+        if rsp is None:
+            return Response({
+                'code': 503,
+                'msg': _('助手列表暂时不可用'),
+                'data': None
+            }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        response = Response({
             'code': 200,
             'msg': "获取成功",
             'data': rsp['data']
         })
+        response['Age'] = str(age)
+        return response
 
     def _check_message_limit(self, request):
         """Check message limit for non-premium users
@@ -380,26 +409,28 @@ class MessageViewSet(CreateModelMixin,
                 'data': None
             }, status=status.HTTP_401_UNAUTHORIZED)
 
-        # Count user messages
-        message_count = Message.objects.filter(
-            user_id=user_id,
-            is_user=True  # Only count user messages
-        ).count()
+        # Read the usage counter (one indexed row, no COUNT over messages)
+        message_count = get_message_count(user_id)
+        message_limit = get_message_limit()
 
-        # If message count exceeds 50, return upgrade prompt
-        if message_count >= 50:
-            return Response({
-                'code': 598,
-                'msg': _('Unlock unlimited voice & text chat'),
-                'data': {
-                    'message_count': message_count,
-                    'message_limit': 50
-                }
-            }, status=598)
+        # If message count reaches the limit, return upgrade prompt
+        if message_count >= message_limit:
+            return self._message_limit_response(message_count, message_limit)
 
         # Limit not reached
         return None
 
+    def _message_limit_response(self, message_count, message_limit):
+        """Upgrade prompt returned when the free message limit is reached"""
+        return Response({
+            'code': 598,
+            'msg': _('Unlock unlimited voice & text chat'),
+            'data': {
+                'message_count': message_count,
+                'message_limit': message_limit
+            }
+        }, status=598)
+
     @action(detail=False, methods=['post'])
     def text_message(self, request):
         """处理文字消息"""
@@ -423,8 +454,83 @@ class MessageViewSet(CreateModelMixin,
 
         return self._process_message(request, is_voice=True)
 
+    @action(detail=False, methods=['post'])
+    def text_message_stream(self, request):
+        """处理文字消息，以Server-Sent Events流式返回AI回复"""
+        limit_response = self._check_message_limit(request)
+        if limit_response:
+            return limit_response
+
+        prepared = self._prepare_message(request, is_voice=False)
+        if isinstance(prepared, Response):
+            return prepared
+        pipeline, user_message = prepared
+
+        response = StreamingHttpResponse(
+            self._stream_events(pipeline, user_message),
+            content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        # 禁止Nginx缓冲，保证片段实时到达客户端
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    def _stream_events(self, pipeline, user_message):
+        """生成SSE事件：message（用户消息）-> delta（回复片段）-> done / error"""
+        yield self._sse('message', MessageSerializer(user_message).data)
+
+        events = pipeline.stream(user_message)
+        try:
+            for event, payload in events:
+                if event == 'delta':
+                    yield self._sse('delta', {'content': payload})
+                elif event == 'done':
+                    yield self._sse('done', {
+                        'results': [MessageSerializer(user_message).data, MessageSerializer(payload).data],
+                        'transaction_ids': payload.get_transaction_ids_list()
+                    })
+                elif event == 'failed':
+                    yield self._sse('error', {'code': 400, 'msg': str(_('bot is None'))})
+        except MessageConflict:
+            yield self._sse('error', {'code': 409, 'msg': str(_('消息正在处理或已处理完成'))})
+        except Exception as e:
+            logger.error(f"流式处理消息时出错: {str(e)}")
+            yield self._sse('error', {'code': 500, 'msg': str(_('服务器内部错误'))})
+        finally:
+            # 客户端断开时立即结束处理流程，将消息标记为失败
+            events.close()
+
+    def _sse(self, event, data):
+        """格式化一条SSE事件"""
+        payload = json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False)
+        return f"event: {event}\ndata: {payload}\n\n"
+
     def _process_message(self, request, is_voice=False):
         """处理消息的通用方法"""
+        prepared = self._prepare_message(request, is_voice)
+        if isinstance(prepared, Response):
+            return prepared
+        pipeline, user_message = prepared
+
+        # 异步模式：交给Celery处理，立即返回用户消息和任务ID
+        if self._is_async(request):
+            process_message_task.delay(
+                user_message.id, stash_token(pipeline.token), pipeline.ledger_id, pipeline.asset_id
+            )
+            return Response({
+                'code': 202,
+                'msg': _('消息已受理'),
+                'data': {
+                    'job_id': user_message.id,
+                    'status': user_message.status,
+                    'results': [MessageSerializer(user_message).data]
+                }
+            }, status=status.HTTP_202_ACCEPTED)
+
+        return self._run_pipeline(pipeline, user_message)
+
+    def _prepare_message(self, request, is_voice=False):
+        """验证请求并保存用户消息，返回 (pipeline, user_message) 或错误响应"""
         # 1. 验证请求数据
         serializer = MessageProcessSerializer(data=request.data)
         if not serializer.is_valid():
@@ -440,11 +546,8 @@ class MessageViewSet(CreateModelMixin,
         content = validated_data['content']
         ledger_id = validated_data['ledger_id']
         asset_id = validated_data.get('asset_id')
-        language = validated_data.get('language', self.DEFAULT_LANGUAGE)
-        assistant_name = validated_data.get('assistant_name', 'Alice')
         file_path = validated_data.get('file_path')
         voice_date = validated_data.get('voice_date')
-        user_template_id = validated_data.get('user_template_id', None)
 
         # 3. 获取用户ID并验证
         user_id = self._get_user_id(request)
@@ -461,42 +564,51 @@ class MessageViewSet(CreateModelMixin,
             return session_validation_result
         session = session_validation_result
 
-        # 5. 使用事务确保数据一致性
-        with db_transaction.atomic():
-            # 5.1 保存用户消息
-            user_message = self._create_user_message(user_id, session, content, is_voice, file_path, voice_date)
-            
-            # 5.2 获取AI回复
-            auth_header = request.META.get('HTTP_AUTHORIZATION', '')
-            model_name = self._get_model_name(session.model)
-            
-            bot_response = creat_ai_chat(content, auth_header, model_name=model_name)
-            if bot_response is None:
-                return Response({
-                    'code': 400,
-                    'msg': _('bot is None'),
-                    'data': None
-                }, status=status.HTTP_400_BAD_REQUEST)
-            
-            # 5.3 处理交易数据
-            transactions = self._extract_transactions(bot_response)
-            transaction_ids = self._process_transactions(transactions, user_id, ledger_id, asset_id)
-            
-            # 5.4 提取AI回复内容
-            ai_content = self._extract_ai_content(bot_response)
-            
-            # 5.5 获取随机值和表情
-            random_value, emoji_value = self._extract_random_emoji(bot_response)
-            
-            # 5.6 创建AI回复消息
-            ai_message = self._create_ai_message(
-                user_id, session, ai_content, random_value, emoji_value, transaction_ids
-            )
+        ownership_error = self._validate_ledger_and_asset(user_id, ledger_id, asset_id)
+        if ownership_error:
+            return ownership_error
 
-        # 6. 更新会话的最后更新时间
-        session.save()  # 触发auto_now字段更新
+        # 5. 保存用户消息（短事务），AI调用和结果保存由调用方通过pipeline完成
+        pipeline = MessagePipeline(
+            user_id=user_id,
+            session=session,
+            token=request.META.get('HTTP_AUTHORIZATION', ''),
+            ledger_id=ledger_id,
+            asset_id=asset_id,
+        )
+        # 免费用户在同一事务内条件递增用量计数，并发请求也不会超出额度
+        message_limit = None if request.remote_user.get('is_premium') else get_message_limit()
+        try:
+            user_message = pipeline.create_user_message(content, is_voice, file_path, voice_date, message_limit)
+        except MessageQuotaExceeded as e:
+            return self._message_limit_response(e.message_count, e.message_limit)
+        return pipeline, user_message
+
+    def _is_async(self, request):
+        """请求是否要求异步处理（?async=true 或请求体中的 async 字段）"""
+        value = request.query_params.get('async', request.data.get('async', False))
+        if isinstance(value, str):
+            return value.lower() in ('true', '1', 'yes')
+        return bool(value)
+
+    def _run_pipeline(self, pipeline, user_message):
+        """执行AI处理流程并返回统一格式的响应"""
+        try:
+            ai_message = pipeline.run(user_message)
+        except MessageConflict:
+            return Response({
+                'code': 409,
+                'msg': _('消息正在处理或已处理完成'),
+                'data': None
+            }, status=status.HTTP_409_CONFLICT)
+
+        if ai_message is None:
+            return Response({
+                'code': 400,
+                'msg': _('bot is None'),
+                'data': None
+            }, status=status.HTTP_400_BAD_REQUEST)
 
-        # 7. 返回成功响应
         return Response({
             'code': 200,
             'msg': _('发送成功'),
@@ -505,12 +617,94 @@ class MessageViewSet(CreateModelMixin,
             }
         })
 
+    @action(detail=True, methods=['post'])
+    def retry(self, request, pk=None):
+        """重新处理AI调用失败的用户消息"""
+        user_message = self.get_object()
+
+        retryable = (Message.STATUS_FAILED, Message.STATUS_PROCESSING)
+        if user_message.message_type != Message.TYPE_USER or user_message.status not in retryable:
+            return Response({
+                'code': 409,
+                'msg': _('只能重试处理失败的用户消息'),
+                'data': None
+            }, status=status.HTTP_409_CONFLICT)
+
+        # 会话和内容取自原消息，账本和资产与发送消息时同样校验
+        data = request.data.dict() if hasattr(request.data, 'dict') else dict(request.data)
+        data.update(session_id=user_message.session_id, content=user_message.content)
+        serializer = MessageProcessSerializer(data=data)
+        if not serializer.is_valid():
+            return Response({
+                'code': 400,
+                'msg': _('请求参数错误'),
+                'data': serializer.errors
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        ledger_id = serializer.validated_data['ledger_id']
+        asset_id = serializer.validated_data.get('asset_id')
+        ownership_error = self._validate_ledger_and_asset(self._get_user_id(request), ledger_id, asset_id)
+        if ownership_error:
+            return ownership_error
+
+        pipeline = MessagePipeline(
+            user_id=user_message.user_id,
+            session=user_message.session,
+            token=request.META.get('HTTP_AUTHORIZATION', ''),
+            ledger_id=ledger_id,
+            asset_id=asset_id,
+        )
+        return self._run_pipeline(pipeline, user_message)
+
+    @action(detail=True, methods=['get'], url_path='status')
+    def processing_status(self, request, pk=None):
+        """查询异步处理的结果，未完成时立即返回并通过 Retry-After 响应头给出建议的轮询间隔"""
+        user_message = self.get_object()
+
+        results = [MessageSerializer(user_message).data]
+        reply = None
+        if user_message.status == Message.STATUS_COMPLETED:
+            reply = user_message.replies.order_by('-created_at').first()
+        if reply:
+            results.append(MessageSerializer(reply).data)
+
+        response = Response({
+            'code': 200,
+            'msg': _('获取成功'),
+            'data': {
+                'job_id': user_message.id,
+                'status': user_message.status,
+                'attempts': user_message.attempts,
+                'results': results,
+                'transaction_ids': reply.get_transaction_ids_list() if reply else []
+            }
+        })
+        if user_message.status in (Message.STATUS_PENDING, Message.STATUS_PROCESSING):
+            response['Retry-After'] = str(getattr(settings, 'AI_MESSAGE_STATUS_RETRY_AFTER', 2))
+        return response
+
     def _get_user_id(self, request):
         """从请求中获取用户ID"""
         if hasattr(request, 'remote_user'):
             return request.remote_user.get('id')
         return None
 
+    def _validate_ledger_and_asset(self, user_id, ledger_id, asset_id=None):
+        """验证账本和资产属于当前用户，返回错误响应或None"""
+        if not Ledger.objects.filter(id=ledger_id, user_id=user_id).exists():
+            return Response({
+                'code': 403,
+                'msg': _('无法使用其他用户的账本'),
+                'data': None
+            }, status=status.HTTP_403_FORBIDDEN)
+        if asset_id and not Asset.objects.filter(id=asset_id, user_id=str(user_id)).exists():
+            return Response({
+                'code': 403,
+                'msg': _('无法使用其他用户的资产'),
+                'data': None
+            }, status=status.HTTP_403_FORBIDDEN)
+        return None
+
     def _validate_session(self, session_id, user_id):
         """验证会话归属"""
         try:
@@ -529,173 +723,6 @@ class MessageViewSet(CreateModelMixin,
                 'data': None
             }, status=status.HTTP_404_NOT_FOUND)
 
-    def _create_user_message(self, user_id, session, content, is_voice, file_path, voice_date):
-        """创建用户消息"""
-        return Message.objects.create(
-            user_id=user_id,
-            session=session,
-            content=content,
-            message_type=Message.TYPE_USER,
-            is_user=True,
-            is_voice=is_voice,
-            file_path=file_path,
-            voice_date=voice_date,
-        )
-
-    def _get_model_name(self, model):
-        """获取模型名称"""
-        if model == 'ChatGPT':
-            return 'gpt-3.5-turbo'
-        elif model == 'DeepSeek':
-            return 'deepseek-chat'
-        else:
-            return 'qwen-max'
-
-    def _extract_transactions(self, bot_response):
-        """从AI响应中提取交易数据"""
-        transactions = []
-        
-        # 记录日志，帮助调试
-        logger.debug(f"AI响应原始数据: {bot_response}")
-        
-        if not isinstance(bot_response, dict):
-            return []
-        
-        # 提取content字段
-        bot_content = bot_response.get('content', bot_response)
-        
-        # 从不同可能的位置提取transactions
-        if isinstance(bot_content, dict):
-            if "transactions" in bot_content:
-                transactions = bot_content["transactions"]
-            elif "content" in bot_content and isinstance(bot_content["content"], dict):
-                if "transactions" in bot_content["content"]:
-                    transactions = bot_content["content"]["transactions"]
-        elif "transactions" in bot_response:
-            transactions = bot_response["transactions"]
-        
-        # 确保transactions是列表
-        if not isinstance(transactions, list):
-            transactions = []
-        
-        logger.debug(f"提取的交易数据: {transactions}")
-        return transactions
-
-    def _process_transactions(self, transactions, user_id, ledger_id, asset_id):
-        """处理交易数据并创建交易记录"""
-        transaction_ids = []
-        
-        if not transactions:
-            return transaction_ids
-        
-        for transaction in transactions:
-            try:
-                # 确定交易类型
-                is_expense = transaction.get('type') == 'expense'
-                is_income = not is_expense
-                
-                # 解析交易日期
-                transaction_date = self._parse_transaction_date(transaction)
-                
-                # 解析交易金额
-                amount = self._parse_transaction_amount(transaction)
-                
-                # 获取分类ID
-                category_id = get_category_id(transaction.get('category'), is_income)
-                
-                # 创建交易记录
-                new_transaction = Transaction.objects.create(
-                    user_id=user_id,
-                    ledger_id=ledger_id,
-                    asset_id=asset_id,
-                    category_id=category_id,
-                    amount=amount,
-                    transaction_date=transaction_date,
-                    notes=transaction.get('note', ''),
-                    is_expense=is_expense,
-                )
-                transaction_ids.append(new_transaction.id)
-                logger.debug(f"成功创建交易记录: ID={new_transaction.id}")
-            except Exception as e:
-                logger.error(f"创建交易记录失败: {str(e)}, 交易数据: {transaction}")
-        
-        return transaction_ids
-
-    def _parse_transaction_date(self, transaction):
-        """解析交易日期"""
-        try:
-            return datetime.strptime(transaction['date'], "%Y-%m-%d %H:%M:%S")
-        except (ValueError, KeyError):
-            try:
-                return datetime.strptime(transaction.get('date', ''), "%Y-%m-%d")
-            except (ValueError, KeyError):
-                logger.warning(f"无法解析交易日期，使用当前时间: {transaction}")
-                return timezone.now()
-
-    def _parse_transaction_amount(self, transaction):
-        """解析交易金额"""
-        try:
-            return Decimal(str(transaction.get('amount', 0)))
-        except (ValueError, TypeError, InvalidOperation):
-            logger.warning(f"无效的交易金额: {transaction.get('amount')}")
-            return Decimal('0')
-
-    def _extract_ai_content(self, bot_response):
-        """从AI响应中提取内容"""
-        default_content = "The server is busy. Please try again later."
-        
-        if not isinstance(bot_response, dict):
-            return default_content
-        
-        # 按优先级尝试不同的内容位置
-        if "ai_output" in bot_response:
-            return bot_response['ai_output']
-        
-        if "content" in bot_response:
-            content = bot_response['content']
-            if isinstance(content, dict):
-                if "ai_output" in content:
-                    return content['ai_output']
-                if "en" in content:
-                    return content['en']
-            if isinstance(content, str):
-                return content
-        
-        if "en" in bot_response:
-            en_content = bot_response['en']
-            if isinstance(en_content, dict) and "ai_output" in en_content:
-                return en_content['ai_output']
-            if isinstance(en_content, str):
-                return en_content
-        
-        return default_content
-
-    def _extract_random_emoji(self, bot_response):
-        """从AI响应中提取随机值和表情"""
-        if isinstance(bot_response, dict):
-            return bot_response.get('random', 0), bot_response.get('emoji', '')
-        return 0, ''
-
-    def _create_ai_message(self, user_id, session, content, random_value, emoji_value, transaction_ids):
-        """创建AI回复消息"""
-        ai_message = Message.objects.create(
-            user_id=user_id,
-            session=session,
-            content=content,
-            message_type=Message.TYPE_ASSISTANT,
-            is_user=False,
-            random=random_value,
-            emoji=emoji_value,
-        )
-        
-        # 如果有交易ID，设置到消息中
-        if transaction_ids:
-            ai_message.set_transaction_ids_list(transaction_ids)
-            ai_message.save()
-            logger.debug(f"设置AI消息的交易IDs: {ai_message.transaction_ids}")
-        
-        return ai_message
-
     @action(detail=False, methods=['get'])
     def message_usage(self, request):
         """Get user's message usage information"""
@@ -711,58 +738,16 @@ class MessageViewSet(CreateModelMixin,
         # Check if user is premium
         is_premium = request.remote_user.get('is_premium')
 
-        # Count user messages
-        message_count = Message.objects.filter(
-            user_id=user_id,
-            is_user=True  # Only count user messages
-        ).count()
+        # Read the usage counter
+        message_count = get_message_count(user_id)
 
         return Response({
             'code': 200,
             'msg': _('Success'),
             'data': {
                 'message_count': message_count,
-                'message_limit': None if is_premium else 50,  # No limit for premium users
+                'message_limit': None if is_premium else get_message_limit(),  # No limit for premium users
                 'is_premium': is_premium
             }
         })
 
-
-def get_category_id(category_name, transaction_type):
-    """根据分类名称和交易类型获取分类ID"""
-    from categorization.models import TransactionCategory
-
-    is_income = transaction_type
-
-    try:
-        # 尝试查找匹配的分类
-        category = TransactionCategory.objects.filter(
-            name__icontains=category_name,
-            is_income=is_income
-        ).first()
-
-        if category:
-            return category.id
-
-        # 如果找不到匹配的分类，使用默认分类
-        default_category = TransactionCategory.objects.filter(
-            is_income=is_income,
-            name='Others'
-        ).first()
-
-        if default_category:
-            return default_category.id
-
-        # 如果没有默认分类，使用第一个分类
-        first_category = TransactionCategory.objects.filter(
-            is_income=is_income
-        ).first()
-
-        if first_category:
-            return first_category.id
-
-        # 如果没有找到任何分类，返回None
-        return None
-    except Exception as e:
-        logger.error(f"获取分类ID失败: {str(e)}")
-        return None
@@ -1,10 +1,11 @@
 from django.contrib import admin
 from django.utils.translation import gettext_lazy as _
 from django.utils.html import format_html
-from django.db.models import Sum, F, DecimalField
+from django.db.models import Sum, F, Value, BooleanField, DecimalField
 from django.db.models.functions import Coalesce
 from decimal import Decimal
-from .models import Asset, CurrencyRate
+from .currency import to_usd_many
+from .models import Asset, CurrencyRate, CurrencyRateHistory
 
 
 @admin.register(CurrencyRate)
@@ -32,6 +33,15 @@ class CurrencyRateAdmin(admin.ModelAdmin):
         return False
 
 
+@admin.register(CurrencyRateHistory)
+class CurrencyRateHistoryAdmin(admin.ModelAdmin):
+    """历史汇率管理界面"""
+    list_display = ('currency', 'effective_date', 'rate_to_usd', 'created_at')
+    list_filter = ('currency',)
+    date_hierarchy = 'effective_date'
+    readonly_fields = ('created_at',)
+
+
 @admin.register(Asset)
 class AssetAdmin(admin.ModelAdmin):
     """资产管理界面"""
@@ -163,15 +173,23 @@ class AssetAdmin(admin.ModelAdmin):
             # 当前筛选的查询集
             queryset = self.get_queryset(request)
             
-            # 总资产统计(美元)
-            total_usd = sum(asset.get_balance_in_usd() for asset in queryset)
+            # 按货币和正负资产分组汇总，未分类的资产视为正资产
+            rows = list(queryset.order_by().annotate(
+                is_positive=Coalesce('category__is_positive_asset', Value(True), output_field=BooleanField())
+            ).values('currency', 'is_positive').annotate(total_balance=Sum('balance')))
+            
+            # 总资产统计(美元)，与 Asset.get_balance_in_usd 一致：负资产取反
+            total_usd = sum(to_usd_many(
+                (row['total_balance'] if row['is_positive'] else -row['total_balance'], row['currency'])
+                for row in rows
+            ), Decimal('0'))
             
             # 按货币分组
             currency_totals = {}
-            for asset in queryset:
-                if asset.currency not in currency_totals:
-                    currency_totals[asset.currency] = Decimal('0')
-                currency_totals[asset.currency] += asset.balance
+            for row in rows:
+                if row['currency'] not in currency_totals:
+                    currency_totals[row['currency']] = Decimal('0')
+                currency_totals[row['currency']] += row['total_balance']
             
             # 格式化货币统计
             formatted_totals = []
@@ -0,0 +1,191 @@
+"""
+货币换算服务
+
+汇率很少变化，这里在进程内保存一份汇率表，避免每次换算都查询 CurrencyRate。
+汇率表在 CurrencyRate 保存/删除时（见 assets.models 中的信号）失效，
+其他进程在 CURRENCY_RATE_CACHE_TTL 秒后重新加载。
+
+按日期换算使用 CurrencyRateHistory：某天的汇率为该天及之前最近一条历史汇率，
+整批金额涉及的汇率一次查询取出。
+"""
+import bisect
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.db.models import F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+BASE_CURRENCY = 'USD'
+
+_rates = None
+_loaded_at = 0.0
+_lock = threading.Lock()
+
+
+def get_rates():
+    """
+    获取汇率表
+
+    Returns:
+        dict: {货币代码: 1单位该货币等于多少美元}
+    """
+    global _rates, _loaded_at
+
+    ttl = getattr(settings, 'CURRENCY_RATE_CACHE_TTL', 300)
+    rates = _rates
+    if rates is not None and time.monotonic() - _loaded_at < ttl:
+        return rates
+
+    from .models import CurrencyRate
+
+    with _lock:
+        if _rates is None or time.monotonic() - _loaded_at >= ttl:
+            _rates = dict(CurrencyRate.objects.values_list('currency', 'rate_to_usd'))
+            _loaded_at = time.monotonic()
+            logger.debug(f"加载汇率表: {len(_rates)}种货币")
+        return _rates
+
+
+def invalidate_rates():
+    """汇率变化后调用，下次换算时重新加载汇率表"""
+    def clear():
+        global _rates
+        _rates = None
+
+    clear()
+    # 事务内重新加载的可能是未提交的数据，提交后再清空一次
+    db_transaction.on_commit(clear)
+
+
+def get_rate(currency, rates=None):
+    """货币兑美元的汇率，美元为1，汇率不存在时返回None"""
+    if currency == BASE_CURRENCY:
+        return Decimal('1')
+    if rates is None:
+        rates = get_rates()
+    return rates.get(currency)
+
+
+def to_usd(amount, currency, rates=None):
+    """将金额换算为美元，汇率不存在时按1:1计算（保留原值）"""
+    rate = get_rate(currency, rates)
+    if rate is None:
+        return amount
+    return amount * rate
+
+
+def to_usd_many(items):
+    """
+    批量换算，整批只读取一次汇率表
+
+    Args:
+        items: 可迭代的 (金额, 货币代码)
+
+    Returns:
+        list: 与传入顺序一致的美元金额
+    """
+    rates = get_rates()
+    return [to_usd(amount, currency, rates) for amount, currency in items]
+
+
+def to_date(value):
+    """datetime 按当前时区取日期"""
+    if isinstance(value, datetime):
+        if timezone.is_aware(value):
+            value = timezone.localtime(value)
+        return value.date()
+    return value
+
+
+class HistoricalRates:
+    """
+    一批 (货币, 日期) 的历史汇率
+
+    历史汇率不存在（早于第一条记录）时使用当前汇率，当前汇率也不存在时按1:1计算。
+    """
+
+    def __init__(self, history, current_rates):
+        # {货币: ([生效日期升序], [汇率])}
+        self._history = history
+        self._current_rates = current_rates
+
+    def get_rate(self, currency, day):
+        if currency == BASE_CURRENCY:
+            return Decimal('1')
+        dates, rates = self._history.get(currency, ((), ()))
+        index = bisect.bisect_right(dates, to_date(day))
+        if index:
+            return rates[index - 1]
+        return self._current_rates.get(currency)
+
+    def to_usd(self, amount, currency, day):
+        rate = self.get_rate(currency, day)
+        if rate is None:
+            return amount
+        return amount * rate
+
+
+def get_historical_rates(pairs):
+    """
+    一次查询取出一批 (货币, 日期) 需要的历史汇率
+
+    只读取每种货币在最早日期当天或之前的最后一条记录，以及其后到最晚日期之间的记录。
+
+    Args:
+        pairs: 可迭代的 (货币代码, 日期)
+    """
+    from .models import CurrencyRateHistory
+
+    currencies = set()
+    days = set()
+    for currency, day in pairs:
+        if currency != BASE_CURRENCY:
+            currencies.add(currency)
+            days.add(to_date(day))
+
+    history = {}
+    if currencies:
+        first_day, last_day = min(days), max(days)
+        floor = CurrencyRateHistory.objects.filter(
+            currency=OuterRef('currency'), effective_date__lte=first_day
+        ).order_by('-effective_date').values('effective_date')[:1]
+        rows = CurrencyRateHistory.objects.filter(
+            currency__in=currencies,
+            effective_date__lte=last_day,
+        ).annotate(
+            floor_date=Coalesce(Subquery(floor), Value(date.min))
+        ).filter(
+            effective_date__gte=F('floor_date')
+        ).order_by('currency', 'effective_date').values_list('currency', 'effective_date', 'rate_to_usd')
+
+        grouped = defaultdict(lambda: ([], []))
+        for currency, effective_date, rate in rows:
+            grouped[currency][0].append(effective_date)
+            grouped[currency][1].append(rate)
+        history = dict(grouped)
+
+    return HistoricalRates(history, get_rates())
+
+
+def to_usd_on_many(items):
+    """
+    按交易日期批量换算为美元
+
+    Args:
+        items: 可迭代的 (金额, 货币代码, 日期)
+
+    Returns:
+        list: 与传入顺序一致的美元金额
+    """
+    items = list(items)
+    rates = get_historical_rates((currency, day) for _, currency, day in items)
+    return [rates.to_usd(amount, currency, day) for amount, currency, day in items]
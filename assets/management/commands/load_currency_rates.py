@@ -0,0 +1,83 @@
+import csv
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction as db_transaction
+
+from assets.currency import invalidate_rates
+from assets.models import CurrencyRate, CurrencyRateHistory
+from utils.cache import bump_global_cache_version
+
+
+class Command(BaseCommand):
+    help = '从CSV文件批量导入历史汇率（列：currency,effective_date,rate_to_usd），已存在的 (货币, 日期) 会被覆盖'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV文件路径，effective_date 格式为 YYYY-MM-DD')
+        parser.add_argument('--batch-size', dest='batch_size', type=int, default=1000, help='每批写入的条数')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        currencies = {code for code, _ in CurrencyRate.CURRENCY_CHOICES}
+        created = updated = 0
+
+        with open(options['path'], newline='', encoding='utf-8') as f, db_transaction.atomic():
+            batch = {}
+            for line_number, row in enumerate(csv.DictReader(f), start=2):
+                key, rate = self._parse_row(row, line_number, currencies)
+                batch[key] = rate
+                if len(batch) >= batch_size:
+                    batch_created, batch_updated = self._save_batch(batch)
+                    created += batch_created
+                    updated += batch_updated
+                    batch = {}
+            if batch:
+                batch_created, batch_updated = self._save_batch(batch)
+                created += batch_created
+                updated += batch_updated
+
+        # 批量写入不触发模型信号，统一使进程内汇率表和统计缓存失效
+        invalidate_rates()
+        bump_global_cache_version()
+        self.stdout.write(self.style.SUCCESS(f'导入完成，新增{created}条，更新{updated}条'))
+
+    def _parse_row(self, row, line_number, currencies):
+        currency = (row.get('currency') or '').strip().upper()
+        if currency not in currencies:
+            raise CommandError(f'第{line_number}行：不支持的货币代码 {currency!r}')
+        try:
+            effective_date = date.fromisoformat((row.get('effective_date') or '').strip())
+        except ValueError:
+            raise CommandError(f'第{line_number}行：无效的日期 {row.get("effective_date")!r}')
+        try:
+            rate = Decimal((row.get('rate_to_usd') or '').strip())
+        except InvalidOperation:
+            raise CommandError(f'第{line_number}行：无效的汇率 {row.get("rate_to_usd")!r}')
+        if rate <= 0:
+            raise CommandError(f'第{line_number}行：汇率必须大于0')
+        return (currency, effective_date), rate
+
+    def _save_batch(self, batch):
+        """一批记录：查询已存在的 (货币, 日期) 后分别批量更新和批量创建"""
+        existing = {}
+        for currency in {currency for currency, _ in batch}:
+            days = [day for key_currency, day in batch if key_currency == currency]
+            for record in CurrencyRateHistory.objects.filter(currency=currency, effective_date__in=days):
+                existing[(record.currency, record.effective_date)] = record
+
+        to_update = []
+        to_create = []
+        for (currency, effective_date), rate in batch.items():
+            record = existing.get((currency, effective_date))
+            if record is not None:
+                record.rate_to_usd = rate
+                to_update.append(record)
+            else:
+                to_create.append(CurrencyRateHistory(
+                    currency=currency, effective_date=effective_date, rate_to_usd=rate
+                ))
+
+        CurrencyRateHistory.objects.bulk_update(to_update, ['rate_to_usd'])
+        CurrencyRateHistory.objects.bulk_create(to_create)
+        return len(to_create), len(to_update)
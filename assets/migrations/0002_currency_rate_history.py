@@ -0,0 +1,45 @@
+# Generated by Django 3.2.25 on 2026-10-18 02:59
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_rate_history(apps, schema_editor):
+    """现有的当前汇率记为最后更新当天生效的历史汇率"""
+    CurrencyRate = apps.get_model('assets', 'CurrencyRate')
+    CurrencyRateHistory = apps.get_model('assets', 'CurrencyRateHistory')
+    CurrencyRateHistory.objects.bulk_create([
+        CurrencyRateHistory(
+            currency=rate.currency,
+            rate_to_usd=rate.rate_to_usd,
+            effective_date=timezone.localtime(rate.updated_at).date(),
+        )
+        for rate in CurrencyRate.objects.all()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assets', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CurrencyRateHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(choices=[('USD', '美元'), ('CNY', '人民币'), ('EUR', '欧元'), ('JPY', '日元'), ('KRW', '韩元')], max_length=3, verbose_name='货币代码')),
+                ('rate_to_usd', models.DecimalField(decimal_places=6, help_text='1单位该货币等于多少美元', max_digits=15, verbose_name='兑美元汇率')),
+                ('effective_date', models.DateField(verbose_name='生效日期')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+            ],
+            options={
+                'verbose_name': '历史汇率',
+                'verbose_name_plural': '历史汇率',
+                'ordering': ['currency', '-effective_date'],
+                'unique_together': {('currency', 'effective_date')},
+            },
+        ),
+        migrations.RunPython(backfill_rate_history, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,11 @@
 from django.db import models
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from categorization.models import AssetCategory
+from utils.cache import bump_global_cache_version, bump_user_cache_version
 from decimal import Decimal
 
 
@@ -36,6 +41,33 @@ class CurrencyRate(models.Model):
         return f"{self.get_currency_display()} ({self.currency}): {self.rate_to_usd} USD"
 
 
+class CurrencyRateHistory(models.Model):
+    """历史汇率模型，某货币自生效日期起（直到下一条记录）的兑美元汇率"""
+    currency = models.CharField(
+        _('货币代码'),
+        max_length=3,
+        choices=CurrencyRate.CURRENCY_CHOICES
+    )
+    rate_to_usd = models.DecimalField(
+        _('兑美元汇率'),
+        max_digits=15,
+        decimal_places=6,
+        help_text=_('1单位该货币等于多少美元')
+    )
+    effective_date = models.DateField(_('生效日期'))
+    created_at = models.DateTimeField(_('创建时间'), auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('历史汇率')
+        verbose_name_plural = _('历史汇率')
+        ordering = ['currency', '-effective_date']
+        # 唯一约束的索引同时用于按 (货币, 日期) 查找生效汇率
+        unique_together = ('currency', 'effective_date')
+
+    def __str__(self):
+        return f"{self.currency} {self.effective_date}: {self.rate_to_usd} USD"
+
+
 class Asset(models.Model):
     """资产模型"""
     CURRENCY_CHOICES = (
@@ -81,6 +113,19 @@ class Asset(models.Model):
     def __str__(self):
         return f"{self.name} - {self.balance} {self.currency} ({self.user_id})"
     
+    @classmethod
+    def adjust_balance(cls, asset_id, delta):
+        """
+        原子地调整资产余额（UPDATE ... SET balance = balance + delta），
+        并发修改同一资产时不会丢失更新
+        """
+        if not asset_id or not delta:
+            return 0
+        return cls.objects.filter(pk=asset_id).update(
+            balance=F('balance') + delta,
+            updated_at=timezone.now(),
+        )
+    
     def get_balance_in_usd(self):
         """获取资产的美元价值"""
         # 获取分类的正负属性
@@ -95,14 +140,38 @@ class Asset(models.Model):
         if not is_positive:
             amount = -amount
         
-        # 货币转换
-        if self.currency == 'USD':
-            return amount
-        
-        try:
-            rate = CurrencyRate.objects.get(currency=self.currency)
-            return amount * rate.rate_to_usd
-        except CurrencyRate.DoesNotExist:
-            # 如果汇率不存在，仍然返回原始金额（默认1:1比例）
-            # 这样可以避免完全丢失该资产的统计
-            return amount
+        # 货币转换，使用进程内汇率表
+        # 如果汇率不存在，仍然返回原始金额（默认1:1比例）
+        # 这样可以避免完全丢失该资产的统计
+        from .currency import to_usd
+        return to_usd(amount, self.currency)
+
+
+@receiver(post_save, sender=Asset)
+@receiver(post_delete, sender=Asset)
+def asset_changed(sender, instance, **kwargs):
+    """资产变化后，使该用户的统计缓存失效"""
+    bump_user_cache_version(instance.user_id)
+
+
+@receiver(post_save, sender=CurrencyRate)
+@receiver(post_delete, sender=CurrencyRate)
+def currency_rate_changed(sender, instance, **kwargs):
+    """汇率影响所有用户的资产统计，同时使进程内汇率表失效"""
+    from .currency import invalidate_rates
+    if kwargs.get('signal') is post_save and not kwargs.get('raw'):
+        # 当前汇率同时记为当天生效的历史汇率
+        CurrencyRateHistory.objects.update_or_create(
+            currency=instance.currency,
+            effective_date=timezone.localdate(),
+            defaults={'rate_to_usd': instance.rate_to_usd}
+        )
+    invalidate_rates()
+    bump_global_cache_version()
+
+
+@receiver(post_save, sender=CurrencyRateHistory)
+@receiver(post_delete, sender=CurrencyRateHistory)
+def currency_rate_history_changed(sender, instance, **kwargs):
+    """历史汇率影响按日期换算的统计"""
+    bump_global_cache_version()
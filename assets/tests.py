@@ -1,3 +1,115 @@
+import os
+import tempfile
+from io import StringIO
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.core.management import call_command
 from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory
+
+from categorization.models import AssetCategory
+from .currency import get_rates, to_usd_many, to_usd_on_many
+from .models import Asset, CurrencyRate, CurrencyRateHistory
+from .views import AssetViewSet
+
+
+class AssetStatisticsTestCase(TestCase):
+    """资产统计接口"""
+
+    def setUp(self):
+        cache.clear()
+        self.debit = AssetCategory.objects.create(name='Cash', category_type='debit', is_positive_asset=True)
+        self.credit = AssetCategory.objects.create(name='Credit Card', category_type='credit', is_positive_asset=False)
+        CurrencyRate.objects.create(currency='CNY', rate_to_usd=Decimal('0.14'))
+
+        Asset.objects.create(name='Wallet', balance=Decimal('100.10'), user_id='1', category=self.debit)
+        Asset.objects.create(name='Alipay', balance=Decimal('700.00'), user_id='1', currency='CNY', category=self.debit)
+        Asset.objects.create(name='Card', balance=Decimal('50.00'), user_id='1', currency='CNY', category=self.credit)
+        # 汇率不存在时按1:1计算
+        Asset.objects.create(name='Euro', balance=Decimal('5.00'), user_id='1', currency='EUR')
+        Asset.objects.create(name='Hidden', balance=Decimal('9.00'), user_id='1', include_in_total=False)
+        Asset.objects.create(name='Other', balance=Decimal('1000.00'), user_id='2', category=self.debit)
+        # 预先加载进程内汇率表
+        get_rates()
+
+    def get(self, action):
+        request = APIRequestFactory().get(f'/assets/{action}/')
+        request.remote_user = {'id': 1}
+        return AssetViewSet.as_view({'get': action})(request)
+
+    def test_total_assets_in_one_query(self):
+        with self.assertNumQueries(1):
+            data = self.get('total_assets').data['data']
+
+        self.assertEqual(data['total_positive_usd'], '203.10')
+        self.assertEqual(data['total_negative_usd'], '7.00')
+        self.assertEqual(data['net_asset_usd'], '196.10')
+        self.assertEqual(data['asset_count'], 4)
+        self.assertEqual(data['by_currency']['CNY']['net'], {'amount': '650.00', 'amount_in_usd': '91.00'})
+
+    def test_by_category_in_one_query(self):
+        with self.assertNumQueries(1):
+            data = self.get('by_category').data['data']
+
+        self.assertEqual(
+            [(c['category_name'], c['total_balance_usd'], c['asset_count']) for c in data['categories']],
+            [('Cash', '198.10', 2), ('Credit Card', '-7.00', 1)]
+        )
+        self.assertEqual(data['summary'], {
+            'positive_total_usd': '198.10',
+            'negative_total_usd': '-7.00',
+            'net_asset_usd': '205.10',
+        })
+
+    def test_rate_table_refreshed_on_change(self):
+        wallet = Asset.objects.select_related('category').get(name='Alipay')
+        with self.assertNumQueries(0):
+            self.assertEqual(wallet.get_balance_in_usd(), Decimal('98.00'))
+            self.assertEqual(
+                to_usd_many([(Decimal('10'), 'CNY'), (Decimal('10'), 'USD'), (Decimal('10'), 'EUR')]),
+                [Decimal('1.40'), Decimal('10'), Decimal('10')]
+            )
+
+        rate = CurrencyRate.objects.get(currency='CNY')
+        rate.rate_to_usd = Decimal('0.15')
+        rate.save()
+        self.assertEqual(wallet.get_balance_in_usd(), Decimal('105.00'))
+
+
+class CurrencyRateHistoryTestCase(TestCase):
+    """历史汇率"""
+
+    def setUp(self):
+        cache.clear()
+        CurrencyRate.objects.create(currency='EUR', rate_to_usd=Decimal('1.10'))
+
+    def test_load_and_convert_on_date(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write('currency,effective_date,rate_to_usd\n')
+            f.write('CNY,2023-01-01,0.15\nCNY,2023-06-01,0.14\nEUR,2023-01-01,1.05\n')
+        self.addCleanup(os.remove, f.name)
+        get_rates()
+        call_command('load_currency_rates', f.name, stdout=StringIO())
+        # 当前汇率保存时记为当天的历史汇率
+        self.assertEqual(CurrencyRateHistory.objects.count(), 4)
+        # 导入后进程内汇率表失效，下次换算重新加载
+        with self.assertNumQueries(1):
+            get_rates()
 
-# Create your tests here.
+        get_rates()
+        with self.assertNumQueries(1):
+            amounts = to_usd_on_many([
+                (Decimal('100'), 'CNY', date(2022, 12, 31)),  # 早于历史汇率，当前汇率也不存在，按1:1计算
+                (Decimal('100'), 'CNY', date(2023, 3, 1)),
+                (Decimal('100'), 'CNY', date(2024, 1, 1)),
+                (Decimal('100'), 'EUR', date(2023, 3, 1)),
+                (Decimal('100'), 'EUR', timezone.localdate() + timedelta(days=1)),
+                (Decimal('100'), 'USD', date(2023, 3, 1)),
+            ])
+        self.assertEqual(amounts, [
+            Decimal('100'), Decimal('15.00'), Decimal('14.00'),
+            Decimal('105.00'), Decimal('110.00'), Decimal('100'),
+        ])
@@ -1,5 +1,5 @@
 from django.shortcuts import render
-from django.db.models import Sum, Count, F, Q, DecimalField
+from django.db.models import Sum, Count, F, Q, Value, BooleanField, DecimalField
 from django.db.models.functions import Coalesce
 from rest_framework import status, serializers
 from rest_framework.decorators import action
@@ -7,14 +7,15 @@ from rest_framework.viewsets import GenericViewSet
 from django.utils.translation import gettext_lazy as _
 from decimal import Decimal
 
+from utils.cache import cache_user_response
 from utils.permissions import IsAuthenticatedExternal
 from utils.mixins import *
+from .currency import get_rates, to_usd
 from .models import Asset, CurrencyRate
 from .serializers import (
     AssetSerializer, AssetCreateSerializer, CurrencyRateSerializer,
     AssetTotalByTypeSerializer
 )
-from categorization.models import AssetCategory
 
 
 class CurrencyRateViewSet(ListModelMixin, RetrieveModelMixin, GenericViewSet):
@@ -65,53 +66,49 @@ class AssetViewSet(CreateModelMixin,
         serializer.save(user_id=user_id)
     
     @action(detail=False, methods=['get'])
+    @cache_user_response('assets:total_assets')
     def total_assets(self, request):
         """计算用户总资产数额（美元）"""
         queryset = self.get_queryset().filter(include_in_total=True)
         
-        # 获取所有分类信息，用于判断正负资产
-        categories = {cat.id: cat for cat in AssetCategory.objects.all()}
-        
-        # 获取所有货币汇率
-        currency_rates = {rate.currency: rate.rate_to_usd for rate in CurrencyRate.objects.all()}
+        # 一次分组查询：按货币和正负资产汇总余额，汇率取自进程内汇率表
+        # 未分类的资产视为正资产
+        currency_totals = queryset.order_by().annotate(
+            is_positive=Coalesce('category__is_positive_asset', Value(True), output_field=BooleanField())
+        ).values('currency', 'is_positive').annotate(
+            total_balance=Sum('balance'),
+            asset_count=Count('id'),
+        ).order_by('currency')
+        currency_rates = get_rates()
         
         # 初始化统计变量
         total_positive_usd = Decimal('0.00')  # 正资产总额
         total_negative_usd = Decimal('0.00')  # 负资产总额
         assets_by_currency = {}  # 按货币统计
+        asset_count = 0
         
-        # 遍历所有资产计算总值
-        for asset in queryset:
-            # 判断资产是正是负
-            is_positive = True
-            if asset.category_id and asset.category_id in categories:
-                is_positive = categories[asset.category_id].is_positive_asset
+        for row in currency_totals:
+            currency = row['currency']
+            amount = row['total_balance']
+            asset_count += row['asset_count']
             
-            # 计算美元价值
-            amount = asset.balance
-            if asset.currency == 'USD':
-                usd_value = amount
-            elif asset.currency in currency_rates:
-                usd_value = amount * currency_rates[asset.currency]
-            else:
-                # 汇率不存在时，使用1:1汇率（保留原值）
-                usd_value = amount
+            # 计算美元价值，汇率不存在时使用1:1汇率（保留原值）
+            usd_value = to_usd(amount, currency, currency_rates)
             
             # 分别累加正负资产
-            if is_positive:
+            if row['is_positive']:
                 total_positive_usd += usd_value
             else:
                 total_negative_usd += usd_value
             
             # 累加按货币统计
-            currency = asset.currency
             if currency not in assets_by_currency:
                 assets_by_currency[currency] = {
                     'positive': Decimal('0.00'),
                     'negative': Decimal('0.00')
                 }
-                
-            if is_positive:
+            
+            if row['is_positive']:
                 assets_by_currency[currency]['positive'] += amount
             else:
                 assets_by_currency[currency]['negative'] += amount
@@ -146,57 +143,62 @@ class AssetViewSet(CreateModelMixin,
                 'total_negative_usd': str(total_negative_usd.quantize(Decimal('0.01'))),
                 'net_asset_usd': str(net_asset_usd.quantize(Decimal('0.01'))),
                 'by_currency': formatted_by_currency,
-                'asset_count': queryset.count(),
+                'asset_count': asset_count,
             },
             msg=_('获取成功')
         )
     
     @action(detail=False, methods=['get'])
+    @cache_user_response('assets:by_category')
     def by_category(self, request):
         """列出用户每种资产分类的总额"""
         queryset = self.get_queryset().filter(include_in_total=True)
-        print(queryset)
         
-        # 获取所有分类
-        categories = {cat.id: cat for cat in AssetCategory.objects.all()}
+        # 一次分组查询：按分类和货币汇总余额（未分类的资产不参与统计），汇率取自进程内汇率表
+        category_totals = queryset.filter(category__isnull=False).order_by(
+            'category__sort_order', 'category__category_type', 'category__name', 'category_id'
+        ).values(
+            'category_id', 'category__name', 'category__category_type',
+            'category__is_positive_asset', 'currency'
+        ).annotate(
+            total_balance=Sum('balance'),
+            asset_count=Count('id'),
+        )
+        currency_rates = get_rates()
         
         # 准备结果数组
-        result = []
+        result = {}
         positive_total = Decimal('0.00')
         negative_total = Decimal('0.00')
         
         # 按分类统计
-        for category_id, category in categories.items():
-            category_assets = queryset.filter(category_id=category_id)
-            
-            if not category_assets.exists():
-                continue
+        for row in category_totals:
+            is_positive = row['category__is_positive_asset']
             
-            # 手动计算该分类下所有资产的美元总值
-            category_total_usd = Decimal('0.00')
-            for asset in category_assets:
-                # 获取美元价值
-                asset_value = asset.get_balance_in_usd()
-                category_total_usd += asset_value
-            
-            # 确定正负资产类型
-            is_positive = category.is_positive_asset
+            # 与 Asset.get_balance_in_usd 一致：负资产取反，汇率不存在时按1:1计算
+            amount = row['total_balance'] if is_positive else -row['total_balance']
+            amount = to_usd(amount, row['currency'], currency_rates)
             
             # 累加到总额
             if is_positive:
-                positive_total += category_total_usd
+                positive_total += amount
             else:
-                negative_total += category_total_usd
+                negative_total += amount
             
-            # 添加到结果
-            result.append({
-                'category_id': category_id,
-                'category_name': category.name,
-                'category_type': category.category_type,
+            category = result.setdefault(row['category_id'], {
+                'category_id': row['category_id'],
+                'category_name': row['category__name'],
+                'category_type': row['category__category_type'],
                 'is_positive_asset': is_positive,
-                'total_balance_usd': category_total_usd.quantize(Decimal('0.01')),
-                'asset_count': category_assets.count(),
+                'total_balance_usd': Decimal('0.00'),
+                'asset_count': 0,
             })
+            category['total_balance_usd'] += amount
+            category['asset_count'] += row['asset_count']
+        
+        result = list(result.values())
+        for category in result:
+            category['total_balance_usd'] = category['total_balance_usd'].quantize(Decimal('0.01'))
         
         # 对结果按资产总额降序排序
         result.sort(key=lambda x: (not x['is_positive_asset'], -float(x['total_balance_usd'])))
@@ -1,6 +1,10 @@
 from django.db import models
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.utils.translation import gettext_lazy as _
 
+from utils.cache import bump_global_cache_version
+
 
 class LedgerCategory(models.Model):
     """账本分类模型"""
@@ -71,3 +75,15 @@ class TransactionCategory(models.Model):
     def __str__(self):
         category_type = _('收入') if self.is_income else _('支出')
         return f"{category_type}-{self.name}"
+
+
+@receiver(post_save, sender=AssetCategory)
+@receiver(post_delete, sender=AssetCategory)
+@receiver(post_save, sender=TransactionCategory)
+@receiver(post_delete, sender=TransactionCategory)
+def category_changed(sender, instance, **kwargs):
+    """分类名称和正负属性出现在所有用户的统计中"""
+    if sender is TransactionCategory:
+        from .resolver import invalidate_categories
+        invalidate_categories()
+    bump_global_cache_version()
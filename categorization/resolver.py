@@ -0,0 +1,215 @@
+"""
+交易分类解析
+
+AI 提取的交易只带分类名称字符串，这里把它映射为 TransactionCategory 的ID。
+分类是所有用户共享的少量数据，在进程内保存一份按收支方向分组的名称索引
+（分类名、locale/ 中各语言的译名和常用别名），解析时不查询数据库。
+分类保存/删除时索引失效（见 categorization.models 中的信号），
+其他进程在 CATEGORY_RESOLVER_TTL 秒后重新加载。
+
+匹配顺序：名称/译名/别名精确匹配 → 分类名包含该字符串 → 该字符串包含分类名
+→ 相似度匹配 → 默认分类 Others → 该方向的第一个分类。
+"该字符串包含分类名"按完整的词或相邻的几个词匹配（petrol 不匹配 pet），
+中日韩文字没有空格分词，仍按子串匹配。
+"""
+import difflib
+import gettext
+import logging
+import re
+import threading
+import time
+import unicodedata
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction as db_transaction
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CATEGORY_NAME = 'Others'
+
+# 相似度匹配的最低分数（difflib.SequenceMatcher.ratio）
+FUZZY_CUTOFF = 0.8
+
+# 每个方向缓存的解析结果数量上限，超过后清空
+RESOLVED_CACHE_SIZE = 1000
+
+# 常见的分类别名：别名 -> 分类名称
+CATEGORY_ALIASES = {
+    'dining': 'Food', 'meal': 'Food', 'restaurant': 'Food', '餐饮': 'Food', '吃饭': 'Food',
+    'clothing': 'Clothes', 'apparel': 'Clothes', '服饰': 'Clothes', '衣服': 'Clothes',
+    'transportation': 'Transport', 'taxi': 'Transport', 'commute': 'Transport', '交通': 'Transport',
+    'vegetable': 'Vegetables', '蔬菜': 'Vegetables',
+    'snack': 'Snacks', '零食': 'Snacks',
+    'grocery': 'Groceries', 'supermarket': 'Groceries', '日用品': 'Groceries', '超市': 'Groceries',
+    '购物': 'Shopping',
+    'fruit': 'Fruits', '水果': 'Fruits',
+    'sport': 'Sports', 'fitness': 'Sports', '运动': 'Sports',
+    'phone': 'Communication', 'telecom': 'Communication', '通讯': 'Communication', '话费': 'Communication',
+    'education': 'Study', 'learning': 'Study', '学习': 'Study', '教育': 'Study',
+    'cosmetics': 'Beauty', '美容': 'Beauty', '美妆': 'Beauty',
+    'pet': 'Pets', '宠物': 'Pets',
+    'fun': 'Entertainment', '娱乐': 'Entertainment',
+    'electronics': 'Digital', '数码': 'Digital',
+    'gift': 'Gifts', '礼物': 'Gifts', '礼品': 'Gifts',
+    'trip': 'Travel', '旅行': 'Travel', '旅游': 'Travel',
+    'home': 'Household', 'rent': 'Household', '居家': 'Household', '住房': 'Household',
+    'other': 'Others', 'misc': 'Others', '其他': 'Others',
+    'wage': 'Salary', 'wages': 'Salary', 'paycheck': 'Salary', '工资': 'Salary', '薪水': 'Salary',
+    'part time': 'Part-time Job', 'side job': 'Part-time Job', '兼职': 'Part-time Job',
+    'investment': 'Investments', 'dividend': 'Investments', '投资': 'Investments', '理财': 'Investments',
+}
+
+
+# 中日韩文字
+_CJK = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff'
+_CJK_RE = re.compile(f'[{_CJK}]')
+_WORD_RE = re.compile(f'[^\\W{_CJK}]+')
+
+
+def normalize(name):
+    """统一全角半角和大小写，去掉标点，合并空白"""
+    name = unicodedata.normalize('NFKC', str(name or '')).casefold().replace('&', ' and ')
+    return ' '.join(re.sub(r'[^\w\s]', ' ', name).split())
+
+
+def get_locale_translations(names):
+    """
+    从 locale/ 中各语言的 django.mo 读取分类名称的译名
+
+    Returns:
+        dict: {分类名称: {译名, ...}}
+    """
+    locale_dir = Path(settings.BASE_DIR) / 'locale'
+    translations = {name: set() for name in names}
+    if not locale_dir.is_dir():
+        return translations
+
+    for language_dir in sorted(locale_dir.iterdir()):
+        try:
+            catalog = gettext.translation('django', localedir=str(locale_dir), languages=[language_dir.name])
+        except OSError:
+            continue
+        for name in names:
+            translated = catalog.gettext(name)
+            if translated and translated != name:
+                translations[name].add(translated)
+    return translations
+
+
+class CategoryIndex:
+    """某一收支方向的分类名称索引"""
+
+    def __init__(self):
+        self.exact = {}    # {规范化名称/译名/别名: 分类ID}
+        self.names = []    # [(规范化分类名称, 分类ID)]，按分类排序
+        self.default_id = None
+        self.first_id = None
+        self._resolved = {}
+
+    def add(self, category_id, name, translations):
+        key = normalize(name)
+        if self.first_id is None:
+            self.first_id = category_id
+        if self.default_id is None and name == DEFAULT_CATEGORY_NAME:
+            self.default_id = category_id
+        self.names.append((key, category_id))
+        for variant in (key, *(normalize(t) for t in translations)):
+            if variant:
+                self.exact.setdefault(variant, category_id)
+
+    def add_alias(self, alias, name):
+        category_id = self.exact.get(normalize(name))
+        if category_id is not None:
+            self.exact.setdefault(normalize(alias), category_id)
+
+    def resolve(self, name):
+        key = normalize(name)
+        if key not in self._resolved:
+            if len(self._resolved) >= RESOLVED_CACHE_SIZE:
+                self._resolved = {}
+            self._resolved[key] = self._match(key)
+        return self._resolved[key]
+
+    def _match(self, key):
+        if not key:
+            return self.default_id or self.first_id
+        if key in self.exact:
+            return self.exact[key]
+        # 分类名包含该字符串（与原来的 name__icontains 一致，取排序靠前的分类）
+        for name, category_id in self.names:
+            if key in name:
+                return category_id
+        # 该字符串包含分类名/译名/别名（完整的词或词组，中日韩文字为子串），取最长的
+        words = _WORD_RE.findall(key)
+        phrases = {' '.join(words[i:j]) for i in range(len(words)) for j in range(i + 1, len(words) + 1)}
+        contained = [
+            variant for variant in self.exact
+            if variant in phrases or (_CJK_RE.search(variant) and variant in key)
+        ]
+        if contained:
+            return self.exact[max(contained, key=len)]
+        close = difflib.get_close_matches(key, list(self.exact), n=1, cutoff=FUZZY_CUTOFF)
+        if close:
+            return self.exact[close[0]]
+        return self.default_id or self.first_id
+
+
+class CategoryResolver:
+    """进程内的分类名称解析器"""
+
+    def __init__(self):
+        self._indexes = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def get_indexes(self):
+        ttl = getattr(settings, 'CATEGORY_RESOLVER_TTL', 300)
+        indexes = self._indexes
+        if indexes is not None and time.monotonic() - self._loaded_at < ttl:
+            return indexes
+
+        with self._lock:
+            if self._indexes is None or time.monotonic() - self._loaded_at >= ttl:
+                self._indexes = self.load()
+                self._loaded_at = time.monotonic()
+            return self._indexes
+
+    def load(self):
+        from .models import TransactionCategory
+
+        categories = list(TransactionCategory.objects.values_list('id', 'name', 'is_income'))
+        translations = get_locale_translations({name for _, name, _ in categories})
+
+        indexes = {True: CategoryIndex(), False: CategoryIndex()}
+        for category_id, name, is_income in categories:
+            indexes[is_income].add(category_id, name, translations.get(name, ()))
+        for index in indexes.values():
+            for alias, name in CATEGORY_ALIASES.items():
+                index.add_alias(alias, name)
+
+        logger.debug(f"加载交易分类索引: {len(categories)}个分类")
+        return indexes
+
+    def resolve(self, name, is_income):
+        """分类名称对应的分类ID，没有任何分类时返回None"""
+        return self.get_indexes()[bool(is_income)].resolve(name)
+
+    def invalidate(self):
+        """分类变化后调用，下次解析时重新加载；事务提交后再清空一次"""
+        def clear():
+            self._indexes = None
+
+        clear()
+        db_transaction.on_commit(clear)
+
+
+resolver = CategoryResolver()
+
+
+def resolve_category_id(name, is_income):
+    return resolver.resolve(name, is_income)
+
+
+def invalidate_categories():
+    resolver.invalidate()
@@ -1,3 +1,47 @@
 from django.test import TestCase
 
-# Create your tests here.
+from .models import TransactionCategory
+from .resolver import resolve_category_id
+
+
+class CategoryResolverTestCase(TestCase):
+    """AI提取交易的分类解析"""
+
+    def setUp(self):
+        create = TransactionCategory.objects.create
+        self.food = create(name='Food', is_income=False, sort_order=1)
+        self.transport = create(name='Transport', is_income=False, sort_order=2)
+        self.others = create(name='Others', is_income=False, sort_order=3)
+        self.salary = create(name='Salary', is_income=True, sort_order=1)
+        self.other_income = create(name='Others', is_income=True, sort_order=2)
+
+    def test_resolve_without_queries(self):
+        resolve_category_id('Food', False)
+        with self.assertNumQueries(0):
+            self.assertEqual(resolve_category_id(' FOOD ', False), self.food.id)       # 精确匹配
+            self.assertEqual(resolve_category_id('Transportation', False), self.transport.id)  # 别名
+            self.assertEqual(resolve_category_id('餐饮', False), self.food.id)
+            self.assertEqual(resolve_category_id('foo', False), self.food.id)          # 分类名包含
+            self.assertEqual(resolve_category_id('Taxi ride', False), self.transport.id)
+            self.assertEqual(resolve_category_id('Fod', False), self.food.id)          # 相似度
+            self.assertEqual(resolve_category_id('unknown', False), self.others.id)    # 默认分类
+            self.assertEqual(resolve_category_id(None, True), self.other_income.id)
+            self.assertEqual(resolve_category_id('wage', True), self.salary.id)
+
+        # 分类变化后重新加载
+        coffee = TransactionCategory.objects.create(name='Coffee', is_income=False)
+        self.assertEqual(resolve_category_id('coffee', False), coffee.id)
+
+    def test_contained_names_match_whole_words(self):
+        create = TransactionCategory.objects.create
+        pets = create(name='Pets', is_income=False, sort_order=4)
+        create(name='Entertainment', is_income=False, sort_order=5)
+        household = create(name='Household', is_income=False, sort_order=6)
+
+        self.assertEqual(resolve_category_id('pet grooming', False), pets.id)
+        self.assertEqual(resolve_category_id('monthly rent', False), household.id)
+        self.assertEqual(resolve_category_id('今天吃饭', False), self.food.id)
+        # 分类名/别名只是其他单词的一部分时不匹配
+        for name in ('petrol', 'carpet', 'competition', 'refund', 'fundraiser', 'car rental', 'parent gift'):
+            with self.subTest(name=name):
+                self.assertEqual(resolve_category_id(name, False), self.others.id)
@@ -1,8 +1,12 @@
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 from django.core.validators import MinValueValidator
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from decimal import Decimal
 
+from utils.cache import bump_user_cache_version
+
 
 class Goal(models.Model):
     """梦想基金模型"""
@@ -67,3 +71,16 @@ class Deposit(models.Model):
     
     def __str__(self):
         return f"{self.goal.name} - {self.amount}"
+
+
+@receiver(post_save, sender=Goal)
+@receiver(post_delete, sender=Goal)
+def goal_changed(sender, instance, **kwargs):
+    """梦想基金变化后，使该用户的统计缓存失效"""
+    bump_user_cache_version(instance.user_id)
+
+
+@receiver(post_save, sender=Deposit)
+def deposit_changed(sender, instance, **kwargs):
+    """存款后，使该用户的统计缓存失效"""
+    bump_user_cache_version(instance.goal.user_id)
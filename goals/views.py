@@ -7,6 +7,7 @@ from rest_framework.viewsets import GenericViewSet
 from django.utils.translation import gettext_lazy as _
 from decimal import Decimal
 
+from utils.cache import cache_user_response
 from utils.permissions import IsAuthenticatedExternal
 from utils.mixins import *
 from .models import Goal, Deposit
@@ -146,6 +147,7 @@ class GoalViewSet(CreateModelMixin,
         })
     
     @action(detail=False, methods=['get'])
+    @cache_user_response('goals:summary')
     def summary(self, request):
         """获取用户梦想基金总览"""
         queryset = self.get_queryset()
@@ -1,18 +1,68 @@
 # middleware/auth.py
+import hashlib
+import logging
+import time
+
 import requests
 from django.conf import settings
+from django.core.cache import cache
 from django.http import JsonResponse
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+
+from utils.http_client import get_client
+
+logger = logging.getLogger(__name__)
+
+# Token验证结果缓存的键前缀
+TOKEN_CACHE_PREFIX = 'auth:token:'
+USER_INVALIDATED_PREFIX = 'auth:user-invalidated:'
+
+# 缓存条目状态
+TOKEN_VALID = 'valid'
+TOKEN_INVALID = 'invalid'
+
+
+def _token_cache_key(token):
+    """Token缓存键，只保存Token的哈希值，避免明文落入缓存"""
+    digest = hashlib.sha256(token.encode('utf-8')).hexdigest()
+    return f'{TOKEN_CACHE_PREFIX}{digest}'
+
+
+def _user_invalidated_key(user_id):
+    return f'{USER_INVALIDATED_PREFIX}{user_id}'
+
+
+def _get_user_invalidated_at(user_id):
+    return cache.get(_user_invalidated_key(user_id), 0)
+
+
+def invalidate_token(token):
+    """使单个Token的验证缓存失效（如用户登出）"""
+    if token:
+        cache.delete(_token_cache_key(token.strip()))
+
+
+def invalidate_user(user_id):
+    """
+    使某个用户所有Token的验证缓存失效（如会员状态或密码变更）
+
+    记录失效时间，验证开始时间早于该时间的缓存条目都不再使用，
+    包括失效时正在向用户服务验证、随后才写入的条目。
+    """
+    cache.set(_user_invalidated_key(user_id), time.time(), timeout=None)
 
 
 class TokenAuthMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
         self.auth_api_url = f"{settings.BASE_URL.rstrip('/')}/users/api/users/me/"
-        print(self.auth_api_url)
+        self.cache_ttl = getattr(settings, 'AUTH_TOKEN_CACHE_TTL', 300)
+        self.negative_cache_ttl = getattr(settings, 'AUTH_TOKEN_NEGATIVE_CACHE_TTL', 30)
         self.exempt_paths = [
             '/users/api/auth/login/',
+            # 用户服务的回调，使用服务密钥认证（见 middleware.views.InvalidateUserView）
+            '/api/auth/invalidate/',
+            # 运维指标，使用服务密钥认证（见 utils.views.InternalStatsView）
+            '/api/internal/',
             '/admin/',
             '/openapi',
             '/static/',
@@ -42,32 +92,66 @@ class TokenAuthMiddleware:
         if not token:
             return JsonResponse({'detail': 'Missing credentials'}, status=401)
 
-        session = requests.Session()
-        retries = Retry(total=2, backoff_factor=0.1)
-        session.mount('https://', HTTPAdapter(max_retries=retries))
+        # 优先使用缓存的验证结果
+        cached = self.get_cached_result(token)
+        if cached is not None:
+            state, user_info = cached
+            if state == TOKEN_INVALID:
+                return JsonResponse({'detail': 'Invalid token'}, status=401)
+            return user_info
 
+        # 在请求用户服务之前记录验证时间，验证期间发生的用户级失效会使本次结果不被使用
+        verified_at = time.time()
         try:
-            # 直接发送原始Token（无Bearer前缀）
-            response = session.get(
+            # 直接发送原始Token（无Bearer前缀），超时和重试见 OUTBOUND_HTTP_UPSTREAMS['auth']
+            response = get_client('auth').get(
                 self.auth_api_url,
                 headers={'Authorization': token},  # 关键修改点
-                timeout=3
             )
-            print(response.status_code)
-            print(response.json())
+            logger.debug(f"用户服务验证Token: 状态码={response.status_code}")
             response.raise_for_status()
-            return response.json().get('data', {})
+            user_info = response.json().get('data', {})
+            self.cache_result(token, TOKEN_VALID, user_info, verified_at)
+            return user_info
         except requests.HTTPError as e:
-            return JsonResponse(
-                {'detail': 'Invalid token'},
-                status=401 if e.response.status_code == 401 else 503
-            )
+            if e.response.status_code == 401:
+                # 负缓存：短时间内拒绝同一个无效Token，不再请求用户服务
+                self.cache_result(token, TOKEN_INVALID)
+                return JsonResponse({'detail': 'Invalid token'}, status=401)
+            return JsonResponse({'detail': 'Invalid token'}, status=503)
         except requests.RequestException:
             return JsonResponse({'detail': 'Auth service error'}, status=503)
 
+    def get_cached_result(self, token):
+        """读取Token验证缓存，返回 (状态, 用户信息) 或 None"""
+        if not self.cache_ttl:
+            return None
+
+        entry = cache.get(_token_cache_key(token))
+        if not entry:
+            return None
+
+        state, user_info, verified_at = entry
+        if state == TOKEN_VALID:
+            # 用户级失效：验证开始后该用户的缓存被失效过
+            user_id = user_info.get('id') if isinstance(user_info, dict) else None
+            if user_id is not None and _get_user_invalidated_at(user_id) >= verified_at:
+                return None
+        return state, user_info
+
+    def cache_result(self, token, state, user_info=None, verified_at=None):
+        """写入Token验证缓存，verified_at 为开始向用户服务验证的时间"""
+        timeout = self.cache_ttl if state == TOKEN_VALID else self.negative_cache_ttl
+        if not timeout:
+            return
+
+        if verified_at is None:
+            verified_at = time.time()
+        cache.set(_token_cache_key(token), (state, user_info, verified_at), timeout=timeout)
+
     def extract_token(self, request):
         """从请求中提取Token（不再处理Bearer前缀）"""
         raw_token = request.headers.get('Authorization', '')
         if raw_token:
             return raw_token.strip()
-        return request.COOKIES.get(settings.TOKEN_COOKIE_NAME)
\ No newline at end of file
+        return request.COOKIES.get(settings.TOKEN_COOKIE_NAME)
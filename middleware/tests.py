@@ -0,0 +1,97 @@
+from unittest import mock
+
+import requests
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from rest_framework.test import APIRequestFactory
+
+from .auth import TokenAuthMiddleware, invalidate_user
+from .views import InvalidateUserView, LogoutView
+
+
+def auth_response(status_code, data=None):
+    response = mock.Mock(status_code=status_code)
+    response.json.return_value = {'data': data or {}}
+    if status_code >= 400:
+        response.raise_for_status.side_effect = requests.HTTPError(response=response)
+    return response
+
+
+@override_settings(AUTH_TOKEN_CACHE_TTL=300, AUTH_TOKEN_NEGATIVE_CACHE_TTL=30, AUTH_INVALIDATE_SERVICE_KEY='secret')
+class TokenAuthCacheTestCase(TestCase):
+    """Token验证结果缓存"""
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch('middleware.auth.get_client')
+        self.client_get = patcher.start().return_value.get
+        self.addCleanup(patcher.stop)
+        self.client_get.return_value = auth_response(200, {'id': 1, 'is_premium': False})
+        self.middleware = TokenAuthMiddleware(lambda request: HttpResponse(status=204))
+
+    def call(self, token='token-a'):
+        request = RequestFactory().get('/api/ledgers/', HTTP_AUTHORIZATION=token)
+        response = self.middleware(request)
+        return response, getattr(request, 'remote_user', None)
+
+    def test_cache_hit_and_ttl(self):
+        with mock.patch('time.time', return_value=1000.0):
+            self.assertEqual(self.call()[1], {'id': 1, 'is_premium': False})
+            self.call()
+            self.assertEqual(self.client_get.call_count, 1)
+        # 超过 AUTH_TOKEN_CACHE_TTL 后重新验证
+        with mock.patch('time.time', return_value=1301.0):
+            self.call()
+        self.assertEqual(self.client_get.call_count, 2)
+
+    def test_invalid_token_negative_cache(self):
+        self.client_get.return_value = auth_response(401)
+        self.assertEqual(self.call()[0].status_code, 401)
+        self.assertEqual(self.call()[0].status_code, 401)
+        self.assertEqual(self.client_get.call_count, 1)
+
+    def test_upstream_error_without_json_body(self):
+        # 网关返回的错误页不是JSON，不应导致中间件异常
+        response = auth_response(502)
+        response.json.side_effect = ValueError('not json')
+        self.client_get.return_value = response
+        self.assertEqual(self.call()[0].status_code, 503)
+
+    def test_logout_invalidates_token(self):
+        self.call()
+        request = APIRequestFactory().post('/api/auth/logout/', HTTP_AUTHORIZATION='token-a')
+        request.remote_user = {'id': 1}
+        self.assertEqual(LogoutView.as_view()(request).status_code, 200)
+
+        self.call()
+        self.assertEqual(self.client_get.call_count, 2)
+
+    def test_user_invalidation_endpoint(self):
+        self.call('token-a')
+        self.call('token-b')
+        view = InvalidateUserView.as_view()
+        request = APIRequestFactory().post('/api/auth/invalidate/', {'user_id': 1}, format='json')
+        self.assertEqual(view(request).status_code, 403)
+        request = APIRequestFactory().post(
+            '/api/auth/invalidate/', {'user_id': 1}, format='json', HTTP_X_SERVICE_KEY='secret'
+        )
+        self.assertEqual(view(request).status_code, 200)
+
+        # 该用户的所有Token都重新验证，会员状态随之更新
+        self.client_get.return_value = auth_response(200, {'id': 1, 'is_premium': True})
+        self.assertTrue(self.call('token-a')[1]['is_premium'])
+        self.assertTrue(self.call('token-b')[1]['is_premium'])
+        self.assertEqual(self.client_get.call_count, 4)
+
+    def test_invalidation_during_verification(self):
+        def verify(*args, **kwargs):
+            # 验证请求进行中时用户被失效，旧结果不能被缓存使用
+            invalidate_user(1)
+            return auth_response(200, {'id': 1, 'is_premium': False})
+
+        self.client_get.side_effect = verify
+        self.call()
+        self.client_get.side_effect = None
+        self.call()
+        self.assertEqual(self.client_get.call_count, 2)
@@ -0,0 +1,8 @@
+from django.urls import path
+
+from .views import InvalidateUserView, LogoutView
+
+urlpatterns = [
+    path('logout/', LogoutView.as_view(), name='auth-logout'),
+    path('invalidate/', InvalidateUserView.as_view(), name='auth-invalidate'),
+]
@@ -0,0 +1,57 @@
+import hmac
+
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from utils.permissions import IsAuthenticatedExternal
+from .auth import invalidate_token, invalidate_user
+
+
+class LogoutView(APIView):
+    """客户端登出时调用，立即使当前Token的验证缓存失效"""
+    permission_classes = [IsAuthenticatedExternal]
+
+    def post(self, request):
+        token = request.headers.get('Authorization', '') or request.COOKIES.get(settings.TOKEN_COOKIE_NAME)
+        invalidate_token(token)
+        return Response({
+            'code': 200,
+            'msg': _('已退出登录'),
+            'data': None
+        })
+
+
+class InvalidateUserView(APIView):
+    """
+    用户服务在会员状态、密码等变化后回调，使该用户所有Token的验证缓存失效
+
+    请求头 X-Service-Key 必须与 settings.AUTH_INVALIDATE_SERVICE_KEY 一致，未配置密钥时拒绝所有请求。
+    """
+
+    def post(self, request):
+        service_key = getattr(settings, 'AUTH_INVALIDATE_SERVICE_KEY', '')
+        provided = request.headers.get('X-Service-Key', '')
+        if not service_key or not hmac.compare_digest(provided, service_key):
+            return Response({
+                'code': 403,
+                'msg': _('无效的服务密钥'),
+                'data': None
+            }, status=status.HTTP_403_FORBIDDEN)
+
+        user_id = request.data.get('user_id')
+        if user_id in (None, ''):
+            return Response({
+                'code': 400,
+                'msg': _('缺少用户ID参数'),
+                'data': None
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        invalidate_user(user_id)
+        return Response({
+            'code': 200,
+            'msg': _('缓存已失效'),
+            'data': {'user_id': user_id}
+        })
@@ -1,10 +1,9 @@
 from django.contrib import admin
 from django.utils.translation import gettext_lazy as _
 from django.utils.html import format_html
-from django.db.models import Sum, Count, Case, When, Value, DecimalField
-from django.db.models.functions import Coalesce
 from decimal import Decimal
 from .models import Transaction
+from .statistics import compute_statistics
 
 
 @admin.register(Transaction)
@@ -149,23 +148,9 @@ class TransactionAdmin(admin.ModelAdmin):
             cl = response.context_data['cl']
             queryset = cl.queryset
             
-            # 计算总收支情况
-            summary = queryset.aggregate(
-                total_expense=Coalesce(Sum(Case(
-                    When(is_expense=True, then='amount'),
-                    default=Value(Decimal('0')),
-                    output_field=DecimalField()
-                )), Value(Decimal('0')), output_field=DecimalField()),
-                total_income=Coalesce(Sum(Case(
-                    When(is_expense=False, then='amount'),
-                    default=Value(Decimal('0')),
-                    output_field=DecimalField()
-                )), Value(Decimal('0')), output_field=DecimalField()),
-                transaction_count=Count('id')
-            )
-            
-            # 计算净额
-            net_amount = summary['total_income'] - summary['total_expense']
+            # 一次分组查询得到总收支
+            summary = compute_statistics(queryset)[0]
+            net_amount = summary['net_amount']
             
             # 添加到上下文
             if not extra_context:
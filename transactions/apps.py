@@ -1,8 +1,24 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 from django.utils.translation import gettext_lazy as _
 
 
+def ensure_search_index(sender, using='default', **kwargs):
+    """migrate 后检查全文索引，SQLite 重建交易表后触发器会丢失"""
+    from django.db import connections
+    from django.db.migrations.recorder import MigrationRecorder
+    from .search import install_search_index
+
+    connection = connections[using]
+    applied = MigrationRecorder(connection).applied_migrations()
+    if ('transactions', '0003_transaction_search_document') in applied:
+        install_search_index(connection)
+
+
 class TransactionsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'transactions'
     verbose_name = _('交易记录')
+
+    def ready(self):
+        post_migrate.connect(ensure_search_index, sender=self)
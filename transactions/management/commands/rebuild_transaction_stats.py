@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from transactions.rollup import rebuild_daily_stats
+
+
+class Command(BaseCommand):
+    help = '根据交易记录重建按天汇总（TransactionDailyStat）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', dest='user_id', help='只重建指定用户的汇总')
+
+    def handle(self, *args, **options):
+        user_id = options.get('user_id')
+        self.stdout.write(f"开始重建交易日汇总{f'（用户ID={user_id}）' if user_id else ''}...")
+        count = rebuild_daily_stats(user_id=user_id)
+        self.stdout.write(self.style.SUCCESS(f'重建完成，共写入{count}条汇总'))
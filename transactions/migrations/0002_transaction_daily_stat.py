@@ -0,0 +1,80 @@
+# Generated by Django 3.2.25 on 2026-10-18 02:52
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def backfill_daily_stats(apps, schema_editor):
+    """根据现有交易记录生成按天汇总"""
+    Transaction = apps.get_model('transactions', 'Transaction')
+    TransactionDailyStat = apps.get_model('transactions', 'TransactionDailyStat')
+
+    rows = Transaction.objects.filter(include_in_stats=True).order_by().annotate(
+        day=TruncDate('transaction_date')
+    ).values('user_id', 'ledger_id', 'asset_id', 'category_id', 'day', 'is_expense').annotate(
+        total_amount=Sum('amount'),
+        transaction_count=Count('id'),
+    )
+
+    batch = []
+    for row in rows.iterator():
+        batch.append(TransactionDailyStat(
+            user_id=row['user_id'],
+            ledger_id=row['ledger_id'],
+            asset_id=row['asset_id'] or 0,
+            category_id=row['category_id'] or 0,
+            day=row['day'],
+            is_expense=row['is_expense'],
+            total_amount=row['total_amount'],
+            transaction_count=row['transaction_count'],
+        ))
+        if len(batch) >= 1000:
+            TransactionDailyStat.objects.bulk_create(batch)
+            batch = []
+
+    if batch:
+        TransactionDailyStat.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransactionDailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.CharField(max_length=50, verbose_name='用户ID')),
+                ('ledger_id', models.BigIntegerField(verbose_name='账本ID')),
+                ('asset_id', models.BigIntegerField(default=0, help_text='0表示未关联资产', verbose_name='资产ID')),
+                ('category_id', models.BigIntegerField(default=0, help_text='0表示未分类', verbose_name='分类ID')),
+                ('day', models.DateField(verbose_name='日期')),
+                ('is_expense', models.BooleanField(verbose_name='是否支出')),
+                ('total_amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=20, verbose_name='交易总额')),
+                ('transaction_count', models.IntegerField(default=0, verbose_name='交易笔数')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': '交易日汇总',
+                'verbose_name_plural': '交易日汇总',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='transactiondailystat',
+            index=models.Index(fields=['user_id', 'day'], name='transaction_user_id_76441b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transactiondailystat',
+            index=models.Index(fields=['user_id', 'asset_id', 'day'], name='transaction_user_id_b0d279_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='transactiondailystat',
+            unique_together={('user_id', 'ledger_id', 'asset_id', 'category_id', 'day', 'is_expense')},
+        ),
+        migrations.RunPython(backfill_daily_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,110 @@
+# Generated by Django 3.2.25 on 2026-10-18 03:04
+
+import re
+
+from django.db import migrations, models
+
+# 以下分词规则和索引SQL复制自本迁移编写时的 transactions.search，
+# 迁移不引用应用代码，避免之后修改 search 模块改变历史迁移的行为
+_CJK = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff'
+_TOKEN_RE = re.compile(f'[{_CJK}]|[^\\W{_CJK}]+')
+
+FTS_TABLE = 'transactions_transaction_fts'
+
+SQLITE_INSTALL_SQL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    f"search_document, content='transactions_transaction', content_rowid='id', tokenize='unicode61')",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON transactions_transaction BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, search_document) VALUES (new.id, new.search_document); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON transactions_transaction BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_document) VALUES ('delete', old.id, old.search_document); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF search_document ON transactions_transaction BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_document) VALUES ('delete', old.id, old.search_document); "
+    f"INSERT INTO {FTS_TABLE}(rowid, search_document) VALUES (new.id, new.search_document); END",
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+
+SQLITE_UNINSTALL_SQL = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ai",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_au",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+POSTGRESQL_INSTALL_SQL = [
+    "ALTER TABLE transactions_transaction ADD COLUMN IF NOT EXISTS search_vector tsvector "
+    "GENERATED ALWAYS AS (to_tsvector('simple', coalesce(search_document, ''))) STORED",
+    "CREATE INDEX IF NOT EXISTS transactions_transaction_search_idx "
+    "ON transactions_transaction USING GIN (search_vector)",
+]
+
+POSTGRESQL_UNINSTALL_SQL = [
+    "DROP INDEX IF EXISTS transactions_transaction_search_idx",
+    "ALTER TABLE transactions_transaction DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def build_search_document(*parts):
+    return ' '.join(token for part in parts for token in _TOKEN_RE.findall((part or '').lower()))
+
+
+def backfill_search_documents(apps, schema_editor):
+    """为现有交易记录生成搜索文本"""
+    Transaction = apps.get_model('transactions', 'Transaction')
+    queryset = Transaction.objects.select_related('ledger', 'asset', 'category').only(
+        'notes', 'search_document', 'ledger__name', 'asset__name', 'category__name'
+    ).order_by('pk')
+
+    batch = []
+    for tx in queryset.iterator(chunk_size=1000):
+        tx.search_document = build_search_document(
+            tx.ledger.name if tx.ledger_id else '',
+            tx.asset.name if tx.asset_id else '',
+            tx.category.name if tx.category_id else '',
+            tx.notes,
+        )
+        batch.append(tx)
+        if len(batch) >= 1000:
+            Transaction.objects.bulk_update(batch, ['search_document'])
+            batch = []
+
+    if batch:
+        Transaction.objects.bulk_update(batch, ['search_document'])
+
+
+def _execute(schema_editor, statements):
+    with schema_editor.connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+
+
+def create_search_index(apps, schema_editor):
+    _execute(schema_editor, {
+        'postgresql': POSTGRESQL_INSTALL_SQL,
+        'sqlite': SQLITE_INSTALL_SQL,
+    }.get(schema_editor.connection.vendor, []))
+
+
+def drop_search_index(apps, schema_editor):
+    _execute(schema_editor, {
+        'postgresql': POSTGRESQL_UNINSTALL_SQL,
+        'sqlite': SQLITE_UNINSTALL_SQL,
+    }.get(schema_editor.connection.vendor, []))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0002_transaction_daily_stat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='search_document',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='搜索文本'),
+        ),
+        migrations.RunPython(backfill_search_documents, migrations.RunPython.noop),
+        # PostgreSQL：tsvector 生成列和GIN索引；SQLite：FTS5表和同步触发器
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -1,12 +1,13 @@
-from django.db import models
+from django.db import models, transaction as db_transaction
 from django.utils.translation import gettext_lazy as _
-from django.db.models.signals import pre_save, post_save, pre_delete
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
 from django.dispatch import receiver
 from decimal import Decimal
 
 from ledger.models import Ledger
 from assets.models import Asset
 from categorization.models import TransactionCategory
+from utils.cache import bump_user_cache_version
 
 
 class Transaction(models.Model):
@@ -42,8 +43,12 @@ class Transaction(models.Model):
     transaction_date = models.DateTimeField(_('交易时间'), db_index=True)
     notes = models.TextField(_('备注'), blank=True)
     include_in_stats = models.BooleanField(_('纳入统计'), default=True)
+    # 全文搜索文本（账本、资产、分类名称和备注），见 transactions.search
+    search_document = models.TextField(_('搜索文本'), blank=True, default='', editable=False)
     
     # 用于余额变更追踪
+    # 批量写入（transactions.services）自行汇总调整余额和统计汇总时设为True，跳过信号中的更新
+    _skip_balance_update = False
     _original_asset_id = None
     _original_amount = None
     _original_is_expense = None
@@ -79,103 +84,201 @@ class Transaction(models.Model):
             # 如果不匹配，则更新交易类型以匹配分类
             self.is_expense = not self.category.is_income
         
-        super().save(*args, **kwargs)
+        # 读取原记录、写入交易和调整余额在同一事务中完成
+        # 与 Model.save_base 相同，不单独创建保存点
+        with db_transaction.atomic(using=kwargs.get('using'), savepoint=False):
+            super().save(*args, **kwargs)
     
-    def update_asset_balance(self):
-        """更新关联资产的余额"""
-        if not self.asset:
-            return
+    @staticmethod
+    def balance_effect(amount, is_expense):
+        """交易对资产余额的影响：支出为负，收入为正"""
+        amount = amount or Decimal('0.00')
+        return -amount if is_expense else amount
+    
+    def get_balance_deltas(self, original=None):
+        """
+        计算本次保存需要对各资产余额做的调整
         
-        # 计算变动金额
-        change_amount = self.amount
-        if self.is_expense:
-            change_amount = -change_amount
+        Args:
+            original: 数据库中原记录的字段值（至少包含asset_id、amount、is_expense），新建时为None
         
-        # 更新资产余额
-        self.asset.balance += change_amount
-        self.asset.save(update_fields=['balance', 'updated_at'])
+        Returns:
+            dict: {资产ID: 变动金额}
+        """
+        deltas = {}
+        if original and original['asset_id']:
+            deltas[original['asset_id']] = -self.balance_effect(original['amount'], original['is_expense'])
+        if self.asset_id:
+            deltas[self.asset_id] = deltas.get(self.asset_id, Decimal('0.00')) + \
+                self.balance_effect(self.amount, self.is_expense)
+        return {asset_id: delta for asset_id, delta in deltas.items() if delta}
+    
+    def apply_balance_deltas(self, deltas):
+        """对每个资产执行一次原子更新，并同步已加载的资产对象"""
+        cached_asset = self._state.fields_cache.get('asset')
+        for asset_id, delta in deltas.items():
+            Asset.adjust_balance(asset_id, delta)
+            if cached_asset is not None and cached_asset.pk == asset_id:
+                cached_asset.balance += delta
+    
+    def update_asset_balance(self):
+        """更新关联资产的余额"""
+        self.apply_balance_deltas(self.get_balance_deltas())
     
     def restore_original_balance(self):
         """还原修改前对资产余额的影响"""
         if not self._original_asset_id:
             return
-        
-        try:
-            original_asset = Asset.objects.get(pk=self._original_asset_id)
-            
-            # 计算原始交易对余额的影响
-            original_change = self._original_amount
-            if self._original_is_expense:
-                original_change = -original_change
-            
-            # 还原余额（反向操作）
-            original_asset.balance -= original_change
-            original_asset.save(update_fields=['balance', 'updated_at'])
-            
-        except Asset.DoesNotExist:
-            pass
-
-
-# 信号处理器用于管理资产余额变更
+        Asset.adjust_balance(
+            self._original_asset_id,
+            -self.balance_effect(self._original_amount, self._original_is_expense)
+        )
+
+
+class TransactionDailyStat(models.Model):
+    """
+    交易记录按天汇总
+    
+    只统计纳入统计（include_in_stats）的交易，由信号和批量写入增量维护（见 transactions.rollup），
+    统计接口按天读取汇总，而不是扫描全部交易记录。
+    资产和分类为空时记为0，保证唯一约束对其生效。
+    """
+    user_id = models.CharField(_('用户ID'), max_length=50)
+    ledger_id = models.BigIntegerField(_('账本ID'))
+    asset_id = models.BigIntegerField(_('资产ID'), default=0, help_text=_('0表示未关联资产'))
+    category_id = models.BigIntegerField(_('分类ID'), default=0, help_text=_('0表示未分类'))
+    day = models.DateField(_('日期'))
+    is_expense = models.BooleanField(_('是否支出'))
+    total_amount = models.DecimalField(_('交易总额'), max_digits=20, decimal_places=2, default=Decimal('0.00'))
+    transaction_count = models.IntegerField(_('交易笔数'), default=0)
+    updated_at = models.DateTimeField(_('更新时间'), auto_now=True)
+    
+    class Meta:
+        verbose_name = _('交易日汇总')
+        verbose_name_plural = _('交易日汇总')
+        unique_together = [('user_id', 'ledger_id', 'asset_id', 'category_id', 'day', 'is_expense')]
+        indexes = [
+            models.Index(fields=['user_id', 'day']),
+            models.Index(fields=['user_id', 'asset_id', 'day']),
+        ]
+    
+    def __str__(self):
+        return f"{self.user_id} {self.day}: {self.total_amount} ({self.transaction_count})"
+
+
+# 信号处理器用于管理资产余额和按天汇总的变更
+# 余额和汇总都通过 F 表达式原子更新，每次变更对每个受影响的资产/汇总行只执行一条UPDATE
 @receiver(pre_save, sender=Transaction)
-def transaction_pre_save(sender, instance, **kwargs):
-    """交易记录保存前的处理，用于还原对原始资产的影响"""
-    if instance.pk:  # 仅对更新操作处理
-        try:
-            # 获取数据库中的原始记录
-            old_instance = Transaction.objects.get(pk=instance.pk)
-            
-            # 如果资产、金额或交易类型变化，则需要还原原始资产的余额
-            if (old_instance.asset_id != instance.asset_id or 
-                old_instance.amount != instance.amount or
-                old_instance.is_expense != instance.is_expense):
-                
-                # 保存原始值
-                instance._original_asset_id = old_instance.asset_id
-                instance._original_amount = old_instance.amount
-                instance._original_is_expense = old_instance.is_expense
-                
-                # 只有当原始资产存在时才还原余额
-                if old_instance.asset_id:
-                    # 还原原始资产余额
-                    old_change = old_instance.amount
-                    if old_instance.is_expense:
-                        old_change = -old_change
-                    
-                    if old_instance.asset:
-                        old_instance.asset.balance -= old_change
-                        old_instance.asset.save(update_fields=['balance', 'updated_at'])
-            
-        except Transaction.DoesNotExist:
-            pass
+def transaction_pre_save(sender, instance, raw=False, using=None, **kwargs):
+    """交易记录保存前，锁定并读取原记录，计算需要调整的资产余额和按天汇总"""
+    from .rollup import ROLLUP_FIELDS, get_rollup_deltas
+    from .search import SEARCH_SOURCE_FIELDS, get_search_document
+    
+    if raw or instance._skip_balance_update:
+        return
+    
+    original = None
+    if instance.pk:  # 仅对更新操作读取原记录
+        original = Transaction.objects.using(using).select_for_update().filter(
+            pk=instance.pk
+        ).values(*dict.fromkeys(ROLLUP_FIELDS + SEARCH_SOURCE_FIELDS)).first()
+    
+    # 新建或备注、账本、资产、分类变化时重新生成搜索文本
+    if original is None or any(original[field] != getattr(instance, field) for field in SEARCH_SOURCE_FIELDS):
+        instance.search_document = get_search_document(instance)
+    
+    if original:
+        # 保存原始值
+        instance._original_asset_id = original['asset_id']
+        instance._original_amount = original['amount']
+        instance._original_is_expense = original['is_expense']
+    
+    instance._balance_deltas = instance.get_balance_deltas(original)
+    instance._rollup_deltas = get_rollup_deltas(original, instance)
 
 @receiver(post_save, sender=Transaction)
-def transaction_post_save(sender, instance, created, **kwargs):
-    """交易记录保存后的处理，用于更新当前资产的余额"""
-    # 只有当资产存在时才更新余额
-    if not instance.asset:
+def transaction_post_save(sender, instance, created, raw=False, using=None, **kwargs):
+    """交易记录保存后，更新受影响资产的余额和按天汇总"""
+    from .rollup import apply_rollup_deltas, get_rollup_deltas
+    
+    if raw or instance._skip_balance_update:
         return
-        
-    # 计算变动金额
-    change_amount = instance.amount
-    if instance.is_expense:
-        change_amount = -change_amount
     
-    # 更新当前资产余额
-    instance.asset.balance += change_amount
-    instance.asset.save(update_fields=['balance', 'updated_at'])
+    deltas = instance.__dict__.pop('_balance_deltas', None)
+    if deltas is None:
+        deltas = instance.get_balance_deltas()
+    instance.apply_balance_deltas(deltas)
+    
+    rollup_deltas = instance.__dict__.pop('_rollup_deltas', None)
+    if rollup_deltas is None:
+        rollup_deltas = get_rollup_deltas(None, instance)
+    apply_rollup_deltas(rollup_deltas, using=using)
+    
+    # 当前值成为下一次保存的原始值
+    instance._original_asset_id = instance.asset_id
+    instance._original_amount = instance.amount
+    instance._original_is_expense = instance.is_expense
 
 @receiver(pre_delete, sender=Transaction)
-def transaction_pre_delete(sender, instance, **kwargs):
-    """交易记录删除前，还原对资产余额的影响"""
-    if not instance.asset:
+def transaction_pre_delete(sender, instance, using=None, **kwargs):
+    """交易记录删除前，还原对资产余额和按天汇总的影响"""
+    from .rollup import apply_rollup_deltas, get_rollup_deltas
+    
+    if instance._skip_balance_update:
         return
-        
-    # 计算该交易对资产余额的影响
-    change_amount = instance.amount
-    if instance.is_expense:
-        change_amount = -change_amount
     
     # 还原余额（反向操作）
-    instance.asset.balance -= change_amount
-    instance.asset.save(update_fields=['balance', 'updated_at'])
+    if instance.asset_id:
+        instance.apply_balance_deltas({
+            instance.asset_id: -instance.balance_effect(instance.amount, instance.is_expense)
+        })
+    
+    apply_rollup_deltas(get_rollup_deltas(instance, None), using=using)
+
+@receiver(post_save, sender=Transaction)
+@receiver(post_delete, sender=Transaction)
+def transaction_changed(sender, instance, **kwargs):
+    """交易记录变化后，使该用户的统计缓存失效"""
+    bump_user_cache_version(instance.user_id)
+
+
+@receiver(pre_delete, sender=TransactionCategory)
+def category_pre_delete(sender, instance, using=None, **kwargs):
+    """分类删除前，将其按天汇总并入未分类"""
+    from .rollup import move_category_rollups
+    
+    instance._rollup_user_ids = move_category_rollups(instance.pk, using=using)
+
+@receiver(post_delete, sender=TransactionCategory)
+def category_post_delete(sender, instance, **kwargs):
+    """交易记录的分类置空后，使受影响用户的统计缓存失效"""
+    for user_id in instance.__dict__.pop('_rollup_user_ids', ()):
+        bump_user_cache_version(user_id)
+
+
+# 账本、资产和交易分类改名后，重新生成相关交易的搜索文本
+SEARCH_NAME_SOURCES = {Ledger: 'ledger_id', Asset: 'asset_id', TransactionCategory: 'category_id'}
+
+
+@receiver(pre_save, sender=Ledger)
+@receiver(pre_save, sender=Asset)
+@receiver(pre_save, sender=TransactionCategory)
+def search_name_pre_save(sender, instance, raw=False, using=None, **kwargs):
+    """记录名称是否修改"""
+    instance._search_name_changed = False
+    if raw or not instance.pk:
+        return
+    original_name = sender.objects.using(using).filter(pk=instance.pk).values_list('name', flat=True).first()
+    instance._search_name_changed = original_name is not None and original_name != instance.name
+
+
+@receiver(post_save, sender=Ledger)
+@receiver(post_save, sender=Asset)
+@receiver(post_save, sender=TransactionCategory)
+def search_name_post_save(sender, instance, created, raw=False, using=None, **kwargs):
+    from .search import refresh_search_documents
+    
+    if instance.__dict__.pop('_search_name_changed', False):
+        refresh_search_documents(
+            Transaction.objects.using(using).filter(**{SEARCH_NAME_SOURCES[sender]: instance.pk})
+        )
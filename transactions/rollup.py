@@ -0,0 +1,279 @@
+"""
+交易记录按天汇总（TransactionDailyStat）的维护和读取
+
+汇总键为 (用户, 账本, 资产, 分类, 日期, 收支方向)，只统计纳入统计的交易。
+单条交易的增删改由 transactions.models 中的信号维护，
+批量写入和批量删除由 transactions.services 汇总后一次性维护。
+"""
+import logging
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction as db_transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Transaction, TransactionDailyStat
+
+logger = logging.getLogger(__name__)
+
+# 计算汇总键和金额需要的交易字段
+ROLLUP_FIELDS = (
+    'user_id', 'ledger_id', 'asset_id', 'category_id',
+    'transaction_date', 'is_expense', 'include_in_stats', 'amount',
+)
+
+# 汇总表的唯一键
+KEY_FIELDS = ('user_id', 'ledger_id', 'asset_id', 'category_id', 'day', 'is_expense')
+
+
+def to_day(value):
+    """交易时间所在的日期（当前时区），与数据库中 TruncDate 的结果一致"""
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return timezone.localtime(value).date()
+
+
+def _get(obj, field):
+    return obj[field] if isinstance(obj, dict) else getattr(obj, field)
+
+
+def rollup_key(obj):
+    """
+    交易记录（实例或字段字典）对应的汇总键，不纳入统计时返回None
+    """
+    if not _get(obj, 'include_in_stats'):
+        return None
+    return (
+        str(_get(obj, 'user_id')),
+        _get(obj, 'ledger_id'),
+        _get(obj, 'asset_id') or 0,
+        _get(obj, 'category_id') or 0,
+        to_day(_get(obj, 'transaction_date')),
+        bool(_get(obj, 'is_expense')),
+    )
+
+
+def add_rollup_delta(deltas, key, amount, count):
+    if key is None:
+        return
+    total, total_count = deltas.get(key, (Decimal('0.00'), 0))
+    deltas[key] = (total + amount, total_count + count)
+
+
+def get_rollup_deltas(old, new):
+    """
+    一条交易记录从 old 变为 new 时需要对汇总表做的调整
+
+    Args:
+        old: 原记录（实例或字段字典），新建时为None
+        new: 新记录，删除时为None
+
+    Returns:
+        dict: {汇总键: (金额变动, 笔数变动)}
+    """
+    deltas = {}
+    if old is not None:
+        add_rollup_delta(deltas, rollup_key(old), -(_get(old, 'amount') or Decimal('0.00')), -1)
+    if new is not None:
+        add_rollup_delta(deltas, rollup_key(new), _get(new, 'amount') or Decimal('0.00'), 1)
+    # 汇总键和金额都没有变化时不需要更新
+    return {key: delta for key, delta in deltas.items() if delta != (0, 0)}
+
+
+def get_instances_rollup_deltas(transactions, sign=1):
+    """一批交易记录实例对汇总表的影响"""
+    deltas = {}
+    for tx in transactions:
+        add_rollup_delta(deltas, rollup_key(tx), sign * (tx.amount or Decimal('0.00')), sign)
+    return deltas
+
+
+def get_queryset_rollup_deltas(queryset, sign=1):
+    """用一条聚合查询计算一组交易记录对汇总表的影响"""
+    rows = queryset.filter(include_in_stats=True).order_by().annotate(
+        day=TruncDate('transaction_date')
+    ).values('user_id', 'ledger_id', 'asset_id', 'category_id', 'day', 'is_expense').annotate(
+        total_amount=Sum('amount'),
+        transaction_count=Count('id'),
+    )
+
+    deltas = {}
+    for row in rows:
+        key = (row['user_id'], row['ledger_id'], row['asset_id'] or 0, row['category_id'] or 0,
+               row['day'], row['is_expense'])
+        add_rollup_delta(deltas, key, sign * row['total_amount'], sign * row['transaction_count'])
+    return deltas
+
+
+def apply_rollup_deltas(deltas, using=None):
+    """
+    将调整原子地累加到汇总表，每个汇总键一条 UPDATE；
+    汇总行不存在时插入，笔数减为0的汇总行删除
+    """
+    manager = TransactionDailyStat.objects.db_manager(using)
+    for key, (amount, count) in deltas.items():
+        lookup = dict(zip(KEY_FIELDS, key))
+        queryset = manager.filter(**lookup)
+        changes = {
+            'total_amount': F('total_amount') + amount,
+            'transaction_count': F('transaction_count') + count,
+            'updated_at': timezone.now(),
+        }
+
+        if not queryset.update(**changes):
+            if count <= 0:
+                # 汇总与交易记录不一致（例如汇总尚未回填），不写入负数
+                logger.warning(f"交易日汇总不存在，跳过扣减: {lookup}")
+                continue
+            try:
+                with db_transaction.atomic(using=manager.db):
+                    manager.create(total_amount=amount, transaction_count=count, **lookup)
+            except IntegrityError:
+                # 并发请求已插入同一汇总行
+                queryset.update(**changes)
+
+        if count < 0:
+            queryset.filter(transaction_count__lte=0).delete()
+
+
+def move_category_rollups(category_id, using=None):
+    """
+    分类删除后交易记录的分类会被置空（SET_NULL，不触发交易记录的信号），
+    将该分类的汇总行并入对应的未分类汇总行
+
+    Returns:
+        set: 受影响的用户ID
+    """
+    manager = TransactionDailyStat.objects.db_manager(using)
+    with db_transaction.atomic(using=manager.db):
+        stats = list(manager.select_for_update().filter(category_id=category_id))
+        deltas = {}
+        for stat in stats:
+            key = tuple(getattr(stat, field) for field in KEY_FIELDS)
+            add_rollup_delta(deltas, key[:3] + (0,) + key[4:], stat.total_amount, stat.transaction_count)
+        manager.filter(pk__in=[stat.pk for stat in stats]).delete()
+        apply_rollup_deltas(deltas, using=using)
+    return {stat.user_id for stat in stats}
+
+
+def rebuild_daily_stats(user_id=None):
+    """
+    根据交易记录重建按天汇总（回填或修复不一致）
+
+    Returns:
+        int: 写入的汇总行数
+    """
+    transactions = Transaction.objects.all()
+    stats = TransactionDailyStat.objects.all()
+    if user_id is not None:
+        transactions = transactions.filter(user_id=user_id)
+        stats = stats.filter(user_id=user_id)
+
+    deltas = get_queryset_rollup_deltas(transactions)
+    with db_transaction.atomic():
+        stats.delete()
+        TransactionDailyStat.objects.bulk_create([
+            TransactionDailyStat(total_amount=amount, transaction_count=count, **dict(zip(KEY_FIELDS, key)))
+            for key, (amount, count) in deltas.items()
+        ], batch_size=1000)
+    return len(deltas)
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def get_daily_stats(user_id, start=None, end=None, ledger_id=None, asset_id=None,
+                    category_id=None, is_expense=None, group_by='category_id'):
+    """
+    获取按天、分类（或资产）和收支方向汇总的统计数据
+
+    start/end 之间完整的天从汇总表读取；起止时间落在一天中间时，
+    这两个不完整的天直接从交易记录补算。
+
+    Args:
+        group_by: 除日期和收支方向外的分组字段，'category_id' 或 'asset_id'
+
+    Returns:
+        list: [{'day', group_by, 'is_expense', 'total_amount', 'transaction_count'}]，
+        未分类（未关联资产）时为None
+    """
+    if group_by not in ('category_id', 'asset_id'):
+        raise ValueError(f"不支持的分组字段: {group_by}")
+
+    filters = {'user_id': str(user_id)}
+    if ledger_id:
+        filters['ledger_id'] = ledger_id
+    if asset_id:
+        filters['asset_id'] = asset_id
+    if category_id:
+        filters['category_id'] = category_id
+    if is_expense is not None:
+        filters['is_expense'] = is_expense
+
+    # 汇总表可以完整覆盖的日期范围 [first_day, last_day]
+    first_day = last_day = None
+    partial_ranges = []
+    if start is not None:
+        start_local = timezone.localtime(start)
+        first_day = start_local.date()
+        if start_local.time() != time.min:
+            first_day += timedelta(days=1)
+            partial_ranges.append((start, _day_start(first_day) - timedelta(microseconds=1)))
+    if end is not None:
+        end_local = timezone.localtime(end)
+        last_day = end_local.date()
+        if end_local.time() != time.max:
+            last_day -= timedelta(days=1)
+            partial_ranges.append((_day_start(end_local.date()), end))
+    if first_day is not None and last_day is not None and first_day > last_day:
+        # 起止时间在同一天内，或不足完整的一天
+        partial_ranges = [(start, end)] if start <= end else []
+
+    groups = defaultdict(lambda: [Decimal('0.00'), 0])
+
+    covers_full_days = not (first_day is not None and last_day is not None and first_day > last_day)
+    if covers_full_days:
+        stats = TransactionDailyStat.objects.filter(**filters)
+        if first_day is not None:
+            stats = stats.filter(day__gte=first_day)
+        if last_day is not None:
+            stats = stats.filter(day__lte=last_day)
+        rows = stats.values('day', group_by, 'is_expense').annotate(
+            total=Sum('total_amount'), count=Sum('transaction_count')
+        ).order_by()
+        for row in rows:
+            group = groups[(row['day'], row[group_by] or None, row['is_expense'])]
+            group[0] += row['total']
+            group[1] += row['count']
+
+    for range_start, range_end in partial_ranges:
+        queryset = Transaction.objects.filter(
+            include_in_stats=True,
+            transaction_date__gte=range_start,
+            transaction_date__lte=range_end,
+            **filters
+        )
+        rows = queryset.annotate(day=TruncDate('transaction_date')).values(
+            'day', group_by, 'is_expense'
+        ).annotate(total=Sum('amount'), count=Count('id')).order_by()
+        for row in rows:
+            group = groups[(row['day'], row[group_by], row['is_expense'])]
+            group[0] += row['total']
+            group[1] += row['count']
+
+    return [
+        {
+            'day': day,
+            group_by: group_id,
+            'is_expense': expense,
+            'total_amount': total,
+            'transaction_count': count,
+        }
+        for (day, group_id, expense), (total, count) in sorted(
+            groups.items(), key=lambda item: (item[0][0], item[0][1] or 0, item[0][2])
+        )
+    ]
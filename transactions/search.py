@@ -0,0 +1,238 @@
+"""
+交易记录全文搜索
+
+每条交易保存一份搜索文本（search_document）：账本、资产、分类名称和备注，
+写入时由 transactions.models 中的信号和批量写入维护，名称修改时重新生成。
+中日韩文字逐字分词，查询时按相邻字的短语匹配，效果接近原来的包含匹配。
+
+索引按数据库分别建立：
+- PostgreSQL：由 search_document 生成的 tsvector 列 search_vector 和 GIN 索引，按 ts_rank 排序
+- SQLite：外部内容的 FTS5 表，由触发器同步，按 bm25 排序
+- 其他数据库：退化为 search_document 的包含匹配
+"""
+import logging
+import re
+
+from django.db import connections
+from django.db.models import BooleanField, FloatField, Value
+from django.db.models.expressions import RawSQL
+
+logger = logging.getLogger(__name__)
+
+# 生成搜索文本需要的交易字段
+SEARCH_SOURCE_FIELDS = ('notes', 'ledger_id', 'asset_id', 'category_id')
+
+# 中日韩文字单独成词，其他文字按连续的字母数字成词
+_CJK = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff'
+_TOKEN_RE = re.compile(f'[{_CJK}]|[^\\W{_CJK}]+')
+
+FTS_TABLE = 'transactions_transaction_fts'
+
+# 每批重新生成搜索文本的交易条数
+REFRESH_BATCH_SIZE = 1000
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall((text or '').lower())
+
+
+def build_search_document(*parts):
+    """由名称和备注生成搜索文本（分词后以空格连接）"""
+    return ' '.join(token for part in parts for token in tokenize(part))
+
+
+def _related_name(instance, field, model):
+    """已加载的关联对象直接取名称，否则查询"""
+    related_id = getattr(instance, f'{field}_id')
+    if not related_id:
+        return ''
+    cached = instance._state.fields_cache.get(field)
+    if cached is not None and cached.pk == related_id:
+        return cached.name
+    return model.objects.filter(pk=related_id).values_list('name', flat=True).first() or ''
+
+
+def get_search_document(transaction):
+    """交易记录的搜索文本"""
+    from assets.models import Asset
+    from categorization.models import TransactionCategory
+    from ledger.models import Ledger
+
+    return build_search_document(
+        _related_name(transaction, 'ledger', Ledger),
+        _related_name(transaction, 'asset', Asset),
+        _related_name(transaction, 'category', TransactionCategory),
+        transaction.notes,
+    )
+
+
+def set_search_documents(transactions):
+    """为一批交易记录生成搜索文本，未加载的账本、资产和分类每种一次查询"""
+    from assets.models import Asset
+    from categorization.models import TransactionCategory
+    from ledger.models import Ledger
+
+    names = {}
+    for field, model in (('ledger', Ledger), ('asset', Asset), ('category', TransactionCategory)):
+        field_names = {}
+        missing = set()
+        for tx in transactions:
+            cached = tx._state.fields_cache.get(field)
+            related_id = getattr(tx, f'{field}_id')
+            if cached is not None and cached.pk == related_id:
+                field_names[related_id] = cached.name
+            elif related_id:
+                missing.add(related_id)
+        missing -= set(field_names)
+        if missing:
+            field_names.update(model.objects.filter(pk__in=missing).values_list('pk', 'name'))
+        names[field] = field_names
+
+    for tx in transactions:
+        tx.search_document = build_search_document(
+            names['ledger'].get(tx.ledger_id, ''),
+            names['asset'].get(tx.asset_id, ''),
+            names['category'].get(tx.category_id, ''),
+            tx.notes,
+        )
+
+
+def refresh_search_documents(queryset, batch_size=REFRESH_BATCH_SIZE):
+    """重新生成一批交易记录的搜索文本（账本、资产或分类改名后调用）"""
+    from .models import Transaction
+
+    pks = list(queryset.order_by().values_list('pk', flat=True))
+    for start in range(0, len(pks), batch_size):
+        batch = list(
+            Transaction.objects.filter(pk__in=pks[start:start + batch_size])
+            .select_related('ledger', 'asset', 'category')
+        )
+        set_search_documents(batch)
+        Transaction.objects.bulk_update(batch, ['search_document'])
+    return len(pks)
+
+
+def _build_fts5_query(terms):
+    # 每个词作为短语（中日韩文字为相邻字的短语），最后一个字前缀匹配，词之间为AND
+    return ' '.join(f'"{" ".join(tokens)}"*' for tokens in terms)
+
+
+def _build_tsquery(terms):
+    return ' & '.join(' <-> '.join(tokens) + ':*' for tokens in terms)
+
+
+def search_transactions(queryset, text):
+    """
+    按关键词筛选交易记录，并添加相关度 search_rank（越大越相关）
+
+    Returns:
+        筛选后的查询集，未排序
+    """
+    from .models import Transaction
+
+    terms = [tokens for tokens in (tokenize(word) for word in text.split()) if tokens]
+    if not terms:
+        return queryset.filter(search_document__icontains=text.strip()).annotate(
+            search_rank=Value(0.0, output_field=FloatField())
+        )
+
+    table = connections[queryset.db].ops.quote_name(Transaction._meta.db_table)
+    vendor = connections[queryset.db].vendor
+
+    if vendor == 'postgresql':
+        tsquery = _build_tsquery(terms)
+        return queryset.filter(RawSQL(
+            f"{table}.search_vector @@ to_tsquery('simple', %s)", [tsquery], output_field=BooleanField()
+        )).annotate(search_rank=RawSQL(
+            f"ts_rank({table}.search_vector, to_tsquery('simple', %s))", [tsquery], output_field=FloatField()
+        ))
+
+    if vendor == 'sqlite':
+        # 全文索引表与交易表连接一次，bm25() 只能在 MATCH 所在的查询中计算，
+        # 因此用 extra() 把索引表加入 FROM，而不是每行执行一次相关子查询
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            where=[f"{FTS_TABLE}.rowid = {table}.id", f"{FTS_TABLE} MATCH %s"],
+            params=[_build_fts5_query(terms)],
+            select={'search_rank': f"-bm25({FTS_TABLE})"},
+        )
+
+    query = queryset
+    for tokens in terms:
+        query = query.filter(search_document__icontains=' '.join(tokens))
+    return query.annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+SQLITE_INSTALL_SQL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    f"search_document, content='transactions_transaction', content_rowid='id', tokenize='unicode61')",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON transactions_transaction BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, search_document) VALUES (new.id, new.search_document); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON transactions_transaction BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_document) VALUES ('delete', old.id, old.search_document); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF search_document ON transactions_transaction BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_document) VALUES ('delete', old.id, old.search_document); "
+    f"INSERT INTO {FTS_TABLE}(rowid, search_document) VALUES (new.id, new.search_document); END",
+]
+
+SQLITE_UNINSTALL_SQL = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ai",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_au",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+# 生成列需要 PostgreSQL 12 及以上
+POSTGRESQL_INSTALL_SQL = [
+    "ALTER TABLE transactions_transaction ADD COLUMN IF NOT EXISTS search_vector tsvector "
+    "GENERATED ALWAYS AS (to_tsvector('simple', coalesce(search_document, ''))) STORED",
+    "CREATE INDEX IF NOT EXISTS transactions_transaction_search_idx "
+    "ON transactions_transaction USING GIN (search_vector)",
+]
+
+POSTGRESQL_UNINSTALL_SQL = [
+    "DROP INDEX IF EXISTS transactions_transaction_search_idx",
+    "ALTER TABLE transactions_transaction DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def install_search_index(connection):
+    """
+    建立全文索引（可重复执行）
+
+    SQLite 修改表结构时会重建交易表，触发器随旧表删除，
+    因此每次 migrate 后（见 TransactionsConfig.ready）检查并在缺失时重建索引。
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            for sql in POSTGRESQL_INSTALL_SQL:
+                cursor.execute(sql)
+        return True
+
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name IN (%s, %s, %s)",
+                [f'{FTS_TABLE}_ai', f'{FTS_TABLE}_ad', f'{FTS_TABLE}_au']
+            )
+            if cursor.fetchone()[0] == 3:
+                return False
+            for sql in SQLITE_INSTALL_SQL:
+                cursor.execute(sql)
+            # 根据交易表重建全文索引内容
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        logger.info("已建立交易记录全文索引")
+        return True
+
+    return False
+
+
+def uninstall_search_index(connection):
+    """删除全文索引"""
+    statements = {
+        'postgresql': POSTGRESQL_UNINSTALL_SQL,
+        'sqlite': SQLITE_UNINSTALL_SQL,
+    }.get(connection.vendor, [])
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
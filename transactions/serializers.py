@@ -1,12 +1,21 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.utils.translation import gettext_lazy as _
 from utils.serializers_fields import TimestampField
 from .models import Transaction
+from .services import bulk_create_transactions
+from assets.models import Asset
+from categorization.models import TransactionCategory
+from ledger.models import Ledger
 from ledger.serializers import LedgerSerializer
 from assets.serializers import AssetSerializer
 from categorization.serializers import TransactionCategorySerializer
 
 
+# TransactionSerializer 嵌套序列化用到的关联对象，查询时应一并 select_related
+TRANSACTION_DETAIL_RELATED = ('ledger', 'ledger__category', 'asset', 'asset__category', 'category')
+
+
 class TransactionSerializer(serializers.ModelSerializer):
     """交易记录序列化器"""
     ledger_detail = LedgerSerializer(source='ledger', read_only=True)
@@ -85,6 +94,74 @@ class TransactionCreateSerializer(serializers.ModelSerializer):
         return attrs
 
 
+class TransactionBulkItemSerializer(serializers.Serializer):
+    """批量创建中的单条交易，关联对象以ID传入，由外层序列化器批量校验"""
+    is_expense = serializers.BooleanField(default=True)
+    ledger = serializers.IntegerField()
+    asset = serializers.IntegerField(required=False, allow_null=True)
+    category = serializers.IntegerField(required=False, allow_null=True)
+    amount = serializers.DecimalField(max_digits=17, decimal_places=2)
+    transaction_date = TimestampField()
+    notes = serializers.CharField(required=False, allow_blank=True, default='')
+    include_in_stats = serializers.BooleanField(default=True)
+
+
+class TransactionBulkCreateSerializer(serializers.Serializer):
+    """批量创建交易记录的序列化器"""
+    transactions = TransactionBulkItemSerializer(many=True, allow_empty=False)
+    
+    def validate_transactions(self, value):
+        max_size = getattr(settings, 'TRANSACTION_BULK_CREATE_MAX', 1000)
+        if len(value) > max_size:
+            raise serializers.ValidationError(_('单次最多创建{max_size}条交易记录').format(max_size=max_size))
+        return value
+    
+    def validate(self, attrs):
+        """每种关联对象只查询一次，并校验账本和资产属于当前用户"""
+        user_id = self.context['user_id']
+        items = attrs['transactions']
+        
+        def ids_of(field):
+            return {item[field] for item in items if item.get(field)}
+        
+        ledgers = {ledger.pk: ledger for ledger in Ledger.objects.filter(pk__in=ids_of('ledger'), user_id=user_id)}
+        assets = {asset.pk: asset for asset in Asset.objects.filter(pk__in=ids_of('asset'), user_id=str(user_id))}
+        categories = TransactionCategory.objects.in_bulk(ids_of('category'))
+        
+        errors = {}
+        for index, item in enumerate(items):
+            item_errors = {}
+            if item['ledger'] not in ledgers:
+                item_errors['ledger'] = _('账本不存在')
+            if item.get('asset') and item['asset'] not in assets:
+                item_errors['asset'] = _('资产不存在')
+            if item.get('category') and item['category'] not in categories:
+                item_errors['category'] = _('交易分类不存在')
+            if item_errors:
+                errors[index] = item_errors
+        if errors:
+            raise serializers.ValidationError({'transactions': errors})
+        
+        attrs['transactions'] = [
+            Transaction(
+                user_id=user_id,
+                is_expense=item['is_expense'],
+                ledger=ledgers[item['ledger']],
+                asset=assets.get(item.get('asset')),
+                category=categories.get(item.get('category')),
+                amount=item['amount'],
+                transaction_date=item['transaction_date'],
+                notes=item.get('notes', ''),
+                include_in_stats=item['include_in_stats'],
+            )
+            for item in items
+        ]
+        return attrs
+    
+    def create(self, validated_data):
+        return bulk_create_transactions(validated_data['transactions'])
+
+
 class TransactionSummarySerializer(serializers.Serializer):
     """交易汇总序列化器"""
     total_expense = serializers.DecimalField(max_digits=20, decimal_places=2)
@@ -0,0 +1,208 @@
+"""
+交易记录的批量写入和批量删除
+
+逐条 Transaction.objects.create / QuerySet.delete 会为每条记录触发信号，
+每条记录都要单独更新一次资产余额和按天汇总。这里按集合写入或删除交易记录，
+再汇总余额和统计的变动，每个受影响的资产或汇总行只执行一条 UPDATE。
+"""
+import logging
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+
+import pytz
+from django.core.cache import cache
+from django.db import connections, models, router, transaction as db_transaction
+from django.db.models import Case, DecimalField, F, Sum, When
+
+from assets.models import Asset
+from utils.cache import bump_user_cache_version
+from .models import Transaction
+from .rollup import apply_rollup_deltas, get_instances_rollup_deltas, get_queryset_rollup_deltas
+from .search import set_search_documents
+
+logger = logging.getLogger(__name__)
+
+# 单条 INSERT 语句包含的最大行数
+BULK_CREATE_BATCH_SIZE = 500
+
+
+def aggregate_balance_deltas(transactions):
+    """按资产汇总一批交易对余额的影响，返回 {资产ID: 变动金额}"""
+    deltas = defaultdict(lambda: Decimal('0.00'))
+    for tx in transactions:
+        if tx.asset_id:
+            deltas[tx.asset_id] += Transaction.balance_effect(tx.amount, tx.is_expense)
+    return {asset_id: delta for asset_id, delta in deltas.items() if delta}
+
+
+def bulk_create_transactions(transactions, batch_size=BULK_CREATE_BATCH_SIZE):
+    """
+    批量创建交易记录，并汇总更新资产余额和按天汇总
+
+    Args:
+        transactions: 未保存的 Transaction 实例列表
+        batch_size: 每条 INSERT 语句的行数
+
+    Returns:
+        list: 已保存（带主键）的 Transaction 实例，顺序与传入一致
+    """
+    transactions = list(transactions)
+    if not transactions:
+        return []
+
+    for tx in transactions:
+        # 与 Transaction.save 保持一致：交易类型以已加载的分类为准
+        category = tx._state.fields_cache.get('category')
+        if category is not None and category.is_income != (not tx.is_expense):
+            tx.is_expense = not category.is_income
+
+    # 批量写入不经过 pre_save 信号，在这里生成搜索文本
+    set_search_documents(transactions)
+
+    db = router.db_for_write(Transaction)
+    with db_transaction.atomic(using=db):
+        if connections[db].features.can_return_rows_from_bulk_insert:
+            Transaction.objects.using(db).bulk_create(transactions, batch_size=batch_size)
+        else:
+            # 数据库不支持批量插入后返回主键（如SQLite）时逐条插入，但仍跳过信号中的余额更新
+            for tx in transactions:
+                tx._skip_balance_update = True
+                try:
+                    tx.save(using=db, force_insert=True)
+                finally:
+                    tx._skip_balance_update = False
+
+        for asset_id, delta in aggregate_balance_deltas(transactions).items():
+            Asset.adjust_balance(asset_id, delta)
+        apply_rollup_deltas(get_instances_rollup_deltas(transactions), using=db)
+        bump_user_cache_version(*{tx.user_id for tx in transactions})
+
+    for tx in transactions:
+        tx._original_asset_id = tx.asset_id
+        tx._original_amount = tx.amount
+        tx._original_is_expense = tx.is_expense
+
+    logger.debug(f"批量创建交易记录{len(transactions)}条")
+    return transactions
+
+
+# 每批删除的交易记录条数，余额调整与删除在同一事务中完成
+BULK_DELETE_BATCH_SIZE = 2000
+
+# 批量删除进度在缓存中的保留时间（秒）
+DELETE_PROGRESS_TTL = 60 * 60 * 24
+
+
+def build_delete_queryset(user_id, filters):
+    """
+    根据筛选条件构建待删除的交易记录查询集
+
+    Args:
+        user_id: 用户ID
+        filters: 筛选条件（ledger_id、asset_id、category_id、start_date、end_date，日期为秒级时间戳）
+    """
+    queryset = Transaction.objects.filter(user_id=user_id)
+
+    for field in ('ledger_id', 'asset_id', 'category_id'):
+        if filters.get(field):
+            queryset = queryset.filter(**{field: filters[field]})
+
+    for param, lookup in (('start_date', 'transaction_date__gte'), ('end_date', 'transaction_date__lte')):
+        if filters.get(param):
+            try:
+                value = datetime.fromtimestamp(int(filters[param]), tz=pytz.UTC)
+                queryset = queryset.filter(**{lookup: value})
+            except (ValueError, TypeError):
+                pass
+
+    return queryset
+
+
+def aggregate_queryset_balance_deltas(queryset):
+    """用一条聚合查询计算一组交易对各资产余额的影响，返回 {资产ID: 变动金额}"""
+    rows = queryset.exclude(asset_id=None).order_by().values('asset_id').annotate(
+        delta=Sum(Case(
+            When(is_expense=True, then=-F('amount')),
+            default=F('amount'),
+            output_field=DecimalField(max_digits=17, decimal_places=2),
+        ))
+    )
+    return {row['asset_id']: row['delta'] for row in rows if row['delta']}
+
+
+def _delete_related(pks, using):
+    """删除或置空引用这些交易记录的数据（如消息与交易的关联）"""
+    for related in Transaction._meta.related_objects:
+        if not related.one_to_many:
+            continue
+        related_qs = related.related_model._base_manager.using(using).filter(
+            **{f'{related.field.name}__in': pks}
+        )
+        if related.on_delete is models.SET_NULL:
+            related_qs.update(**{related.field.name: None})
+        else:
+            related_qs.delete()
+
+
+def bulk_delete_transactions(queryset, batch_size=BULK_DELETE_BATCH_SIZE, progress=None):
+    """
+    按集合删除交易记录并还原其对资产余额的影响，不逐条加载记录、不触发删除信号
+
+    每批记录在一个事务中完成：聚合查询计算各资产和各汇总行的变动，
+    每个资产/汇总行一条 UPDATE，再直接 DELETE 交易记录。
+
+    Args:
+        queryset: 待删除的交易记录
+        batch_size: 每批删除的条数
+        progress: 每批完成后回调 progress(已删除条数)
+
+    Returns:
+        int: 删除的条数
+    """
+    db = router.db_for_write(Transaction)
+    queryset = queryset.using(db).order_by()
+    deleted = 0
+
+    while True:
+        with db_transaction.atomic(using=db):
+            # 锁定本批记录，避免聚合与删除之间被并发修改
+            rows = list(queryset.select_for_update().values_list('pk', 'user_id')[:batch_size])
+            if not rows:
+                break
+            pks = [pk for pk, _ in rows]
+
+            batch = Transaction._base_manager.using(db).filter(pk__in=pks)
+            for asset_id, delta in aggregate_queryset_balance_deltas(batch).items():
+                Asset.adjust_balance(asset_id, -delta)
+            apply_rollup_deltas(get_queryset_rollup_deltas(batch, sign=-1), using=db)
+
+            _delete_related(pks, db)
+            # QuerySet.delete 在存在删除信号时会逐条加载记录，这里直接执行 DELETE
+            deleted += batch._raw_delete(db)
+            bump_user_cache_version(*{user_id for _, user_id in rows})
+
+        if progress:
+            progress(deleted)
+        if len(pks) < batch_size:
+            break
+
+    logger.debug(f"批量删除交易记录{deleted}条")
+    return deleted
+
+
+def delete_progress_key(task_id):
+    return f"transactions:delete:{task_id}"
+
+
+def get_delete_progress(task_id):
+    """获取异步删除任务的进度"""
+    return cache.get(delete_progress_key(task_id))
+
+
+def set_delete_progress(task_id, **progress):
+    """更新异步删除任务的进度"""
+    current = cache.get(delete_progress_key(task_id)) or {}
+    current.update(progress)
+    cache.set(delete_progress_key(task_id), current, DELETE_PROGRESS_TTL)
+    return current
@@ -0,0 +1,192 @@
+"""
+交易统计
+
+汇总（summary）、按时间段（periods）和按分类（categories）三种统计
+由同一批分组行折叠得到：分组行来自对交易记录的一次分组查询，
+或来自按天汇总表（transactions.rollup），不再对同一范围分别扫描三次。
+"""
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+from assets.currency import BASE_CURRENCY, to_usd_on_many
+from assets.models import Asset
+from categorization.models import TransactionCategory
+
+
+def get_period_start(day, period):
+    """日期所在统计周期的第一天，与 TruncDay/TruncWeek/TruncMonth/TruncYear 一致"""
+    if period == 'day':
+        return day
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    if period == 'year':
+        return day.replace(month=1, day=1)
+    return day.replace(day=1)
+
+
+def get_categories(category_ids):
+    """批量获取分类，已删除的分类不在结果中"""
+    category_ids = {category_id for category_id in category_ids if category_id}
+    if not category_ids:
+        return {}
+    return TransactionCategory.objects.in_bulk(category_ids)
+
+
+def query_statistic_rows(queryset, period_trunc=None):
+    """
+    对交易记录执行一次分组查询，按 (时间段, 分类, 收支方向) 分组
+
+    Args:
+        queryset: 已筛选的交易记录
+        period_trunc: 时间段截断函数（如 TruncMonth('transaction_date')），为None时不按时间段分组
+    """
+    fields = ['category_id', 'category__name', 'category__is_income', 'is_expense']
+    queryset = queryset.order_by()
+    if period_trunc is not None:
+        queryset = queryset.annotate(period=period_trunc)
+        fields.insert(0, 'period')
+
+    rows = queryset.values(*fields).annotate(
+        total_amount=Sum('amount'),
+        transaction_count=Count('id'),
+    )
+    return [
+        {
+            'period': row.get('period'),
+            'category_id': row['category_id'],
+            'category_name': row['category__name'],
+            'category_is_income': row['category__is_income'],
+            'is_expense': row['is_expense'],
+            'total_amount': row['total_amount'],
+            'transaction_count': row['transaction_count'],
+        }
+        for row in rows
+    ]
+
+
+def rollup_statistic_rows(daily_stats, period):
+    """将按天汇总（get_daily_stats 的结果）转换为分组行，已删除的分类视为未分类"""
+    categories = get_categories(row['category_id'] for row in daily_stats)
+    rows = []
+    for row in daily_stats:
+        category = categories.get(row['category_id'])
+        rows.append({
+            'period': get_period_start(row['day'], period),
+            'category_id': category.pk if category else None,
+            'category_name': category.name if category else None,
+            'category_is_income': category.is_income if category else None,
+            'is_expense': row['is_expense'],
+            'total_amount': row['total_amount'],
+            'transaction_count': row['transaction_count'],
+        })
+    return rows
+
+
+def fold_statistics(rows, date_format=None, uncategorized_name=''):
+    """
+    将分组行折叠为三种统计
+
+    Returns:
+        (summary, periods, categories)：
+        summary 为 total_expense/total_income/net_amount/transaction_count，
+        periods 按时间段升序，categories 按金额降序（不含未分类）
+    """
+    def new_totals():
+        return {'total_expense': Decimal('0'), 'total_income': Decimal('0'), 'transaction_count': 0}
+
+    summary = new_totals()
+    period_totals = defaultdict(new_totals)
+    category_totals = {}
+
+    for row in rows:
+        direction = 'total_expense' if row['is_expense'] else 'total_income'
+        targets = [summary]
+        if row['period'] is not None:
+            targets.append(period_totals[row['period']])
+        for totals in targets:
+            totals[direction] += row['total_amount']
+            totals['transaction_count'] += row['transaction_count']
+
+        if row['category_id']:
+            category = category_totals.setdefault(row['category_id'], {
+                'category_id': row['category_id'],
+                'category_name': row['category_name'] or uncategorized_name,
+                'is_income': row['category_is_income'],
+                'total_amount': Decimal('0'),
+                'transaction_count': 0,
+            })
+            category['total_amount'] += row['total_amount']
+            category['transaction_count'] += row['transaction_count']
+
+    # 计算净额
+    summary['net_amount'] = summary['total_income'] - summary['total_expense']
+
+    periods = [
+        {
+            'period': period.strftime(date_format) if date_format else period,
+            'total_expense': totals['total_expense'],
+            'total_income': totals['total_income'],
+            'net_amount': totals['total_income'] - totals['total_expense'],
+            'transaction_count': totals['transaction_count'],
+        }
+        for period, totals in sorted(period_totals.items())
+    ]
+
+    categories = sorted(category_totals.values(), key=lambda stat: stat['total_amount'], reverse=True)
+    return summary, periods, categories
+
+
+def compute_statistics(queryset, period_trunc=None, date_format=None, uncategorized_name=''):
+    """一次分组查询计算交易记录的汇总、按时间段和按分类统计"""
+    return fold_statistics(query_statistic_rows(queryset, period_trunc), date_format, uncategorized_name)
+
+
+def fold_usd_summary(rows):
+    """
+    将按 (日期, 货币, 收支方向) 分组的行换算为美元后汇总，涉及的历史汇率一次查询取出
+
+    Args:
+        rows: 可迭代的 {'day', 'currency', 'is_expense', 'total_amount', 'transaction_count'}，
+            未关联资产的 currency 为None，按美元计算
+    """
+    rows = list(rows)
+    amounts = to_usd_on_many(
+        (row['total_amount'], row['currency'] or BASE_CURRENCY, row['day'])
+        for row in rows
+    )
+
+    summary = {'total_expense': Decimal('0'), 'total_income': Decimal('0'), 'transaction_count': 0}
+    for row, amount in zip(rows, amounts):
+        summary['total_expense' if row['is_expense'] else 'total_income'] += amount
+        summary['transaction_count'] += row['transaction_count']
+    summary['net_amount'] = summary['total_income'] - summary['total_expense']
+    return summary
+
+
+def compute_usd_summary(queryset):
+    """
+    按交易当天的汇率换算为美元后的收支汇总
+
+    一次分组查询按 (日期, 资产货币, 收支方向) 汇总交易记录。
+    """
+    rows = queryset.order_by().annotate(day=TruncDate('transaction_date')).values(
+        'day', 'asset__currency', 'is_expense'
+    ).annotate(
+        total_amount=Sum('amount'),
+        transaction_count=Count('id'),
+    )
+    return fold_usd_summary({**row, 'currency': row['asset__currency']} for row in rows)
+
+
+def rollup_usd_summary(daily_stats):
+    """
+    由按 (日期, 资产, 收支方向) 的按天汇总（get_daily_stats(group_by='asset_id') 的结果）
+    计算美元收支汇总，资产货币一次查询取出，已删除的资产按美元计算
+    """
+    asset_ids = {row['asset_id'] for row in daily_stats if row['asset_id']}
+    currencies = dict(Asset.objects.filter(pk__in=asset_ids).values_list('id', 'currency')) if asset_ids else {}
+    return fold_usd_summary({**row, 'currency': currencies.get(row['asset_id'])} for row in daily_stats)
@@ -0,0 +1,26 @@
+import logging
+
+from celery import shared_task
+
+from .services import build_delete_queryset, bulk_delete_transactions, set_delete_progress
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(bind=True, ignore_result=True)
+def delete_transactions_task(self, user_id, filters):
+    """异步批量删除交易记录，进度写入缓存供 delete_all_status 查询"""
+    task_id = self.request.id
+    set_delete_progress(task_id, state='running')
+
+    try:
+        deleted = bulk_delete_transactions(
+            build_delete_queryset(user_id, filters),
+            progress=lambda count: set_delete_progress(task_id, deleted=count),
+        )
+    except Exception as e:
+        logger.error(f"批量删除交易记录失败: 用户ID={user_id}, 错误: {str(e)}")
+        set_delete_progress(task_id, state='failed')
+        raise
+
+    set_delete_progress(task_id, state='completed', deleted=deleted)
@@ -1,3 +1,481 @@
-from django.test import TestCase
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models.functions import TruncMonth
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from datetime import timedelta
+from rest_framework.test import APIRequestFactory
+
+from assets.models import Asset, CurrencyRate, CurrencyRateHistory
+from ledger.models import Ledger
+from categorization.models import TransactionCategory
+from .models import Transaction, TransactionDailyStat
+from .rollup import rebuild_daily_stats
+from .statistics import compute_statistics
+from .views import TransactionViewSet
+
+
+class TransactionBalanceTestCase(TestCase):
+    """交易记录对资产余额的影响"""
+
+    def setUp(self):
+        self.ledger = Ledger.objects.create(name='Daily', user_id=1)
+        self.cash = Asset.objects.create(name='Cash', balance=Decimal('100.00'), user_id='1')
+        self.card = Asset.objects.create(name='Card', balance=Decimal('50.00'), user_id='1')
+
+    def create_transaction(self, **kwargs):
+        data = {
+            'user_id': '1',
+            'ledger': self.ledger,
+            'asset': self.cash,
+            'amount': Decimal('10.00'),
+            'transaction_date': timezone.now(),
+        }
+        data.update(kwargs)
+        return Transaction.objects.create(**data)
+
+    def assertBalances(self, cash, card):
+        self.cash.refresh_from_db()
+        self.card.refresh_from_db()
+        self.assertEqual(self.cash.balance, Decimal(cash))
+        self.assertEqual(self.card.balance, Decimal(card))
+
+    def test_create_update_delete(self):
+        tx = self.create_transaction()
+        self.assertBalances('90.00', '50.00')
+
+        tx.amount = Decimal('25.00')
+        tx.save()
+        self.assertBalances('75.00', '50.00')
+
+        tx.is_expense = False
+        tx.save()
+        self.assertBalances('125.00', '50.00')
+
+        tx.asset = self.card
+        tx.save()
+        self.assertBalances('100.00', '75.00')
+
+        tx.delete()
+        self.assertBalances('100.00', '50.00')
+
+    def test_stale_instances_do_not_lose_updates(self):
+        """两个请求各自持有旧的资产对象时，余额变更都应生效"""
+        first = Transaction(user_id='1', ledger=self.ledger, asset=Asset.objects.get(pk=self.cash.pk),
+                            amount=Decimal('10.00'), transaction_date=timezone.now())
+        second = Transaction(user_id='1', ledger=self.ledger, asset=Asset.objects.get(pk=self.cash.pk),
+                             amount=Decimal('5.00'), transaction_date=timezone.now())
+        first.save()
+        second.save()
+        self.assertBalances('85.00', '50.00')
+
+    def test_unchanged_save_does_not_touch_asset(self):
+        tx = self.create_transaction()
+        tx.notes = 'lunch'
+        # 读取原记录 + 更新交易，不再写资产
+        with self.assertNumQueries(2):
+            tx.save()
+        self.assertBalances('90.00', '50.00')
+
+
+class TransactionBulkCreateTestCase(TestCase):
+    """批量创建交易记录"""
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.ledger = Ledger.objects.create(name='Daily', user_id=1)
+        self.cash = Asset.objects.create(name='Cash', balance=Decimal('100.00'), user_id='1')
+        self.card = Asset.objects.create(name='Card', balance=Decimal('50.00'), user_id='1')
+        self.other_asset = Asset.objects.create(name='Other', balance=Decimal('0.00'), user_id='2')
+
+    def post(self, items):
+        request = self.factory.post('/transactions/bulk_create/', {'transactions': items}, format='json')
+        request.remote_user = {'id': 1}
+        return TransactionViewSet.as_view({'post': 'bulk_create'})(request)
+
+    def item(self, asset, amount, is_expense=True):
+        return {
+            'ledger': self.ledger.id,
+            'asset': asset.id,
+            'amount': amount,
+            'is_expense': is_expense,
+            'transaction_date': 1700000000000,
+        }
+
+    def test_bulk_create_aggregates_balances(self):
+        response = self.post([
+            self.item(self.cash, '10.00'),
+            self.item(self.cash, '5.50'),
+            self.item(self.cash, '20.00', is_expense=False),
+            self.item(self.card, '7.00'),
+        ])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['data']['created_count'], 4)
+        self.assertEqual(Transaction.objects.filter(user_id='1').count(), 4)
+
+        self.cash.refresh_from_db()
+        self.card.refresh_from_db()
+        self.assertEqual(self.cash.balance, Decimal('104.50'))
+        self.assertEqual(self.card.balance, Decimal('43.00'))
+
+    def test_rejects_assets_of_other_users(self):
+        response = self.post([self.item(self.cash, '10.00'), self.item(self.other_asset, '1.00')])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Transaction.objects.exists())
+        self.cash.refresh_from_db()
+        self.assertEqual(self.cash.balance, Decimal('100.00'))
+
+
+class TransactionBulkDeleteTestCase(TestCase):
+    """批量删除交易记录"""
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.ledger = Ledger.objects.create(name='Daily', user_id=1)
+        self.cash = Asset.objects.create(name='Cash', balance=Decimal('100.00'), user_id='1')
+        self.card = Asset.objects.create(name='Card', balance=Decimal('50.00'), user_id='1')
+        for asset, amount, is_expense in ((self.cash, '10.00', True), (self.cash, '30.00', False),
+                                          (self.card, '5.00', True), (None, '1.00', True)):
+            Transaction.objects.create(user_id='1', ledger=self.ledger, asset=asset, amount=Decimal(amount),
+                                       is_expense=is_expense, transaction_date=timezone.now())
+
+    def get(self, action, path, data=None):
+        request = self.factory.get(path, data)
+        request.remote_user = {'id': 1}
+        return TransactionViewSet.as_view({'get': action})(request)
+
+    def delete_all(self, data=None):
+        request = self.factory.delete('/transactions/delete_all/' + (f'?{data}' if data else ''))
+        request.remote_user = {'id': 1}
+        return TransactionViewSet.as_view({'delete': 'delete_all'})(request)
+
+    def assertBalances(self, cash, card):
+        self.cash.refresh_from_db()
+        self.card.refresh_from_db()
+        self.assertEqual(self.cash.balance, Decimal(cash))
+        self.assertEqual(self.card.balance, Decimal(card))
+
+    def test_delete_all_restores_balances(self):
+        from ai_messages.models import Message, MessageSession
+        session = MessageSession.objects.create(user_id=1, model='Qwen')
+        message = Message.objects.create(user_id=1, session=session, content='ok')
+        message.link_transactions(list(Transaction.objects.values_list('id', flat=True)))
+
+        self.assertBalances('120.00', '45.00')
+        response = self.delete_all()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data']['deleted_count'], 4)
+        self.assertFalse(Transaction.objects.exists())
+        self.assertFalse(message.transactions.exists())
+        self.assertBalances('100.00', '50.00')
+
+    def test_delete_all_with_filter(self):
+        response = self.delete_all(f'asset_id={self.cash.id}')
+        self.assertEqual(response.data['data']['deleted_count'], 2)
+        self.assertEqual(Transaction.objects.count(), 2)
+        self.assertBalances('100.00', '45.00')
+
+    @override_settings(TRANSACTION_BULK_DELETE_ASYNC_THRESHOLD=2)
+    def test_large_delete_runs_in_background(self):
+        response = self.delete_all()
+        self.assertEqual(response.status_code, 202)
+        task_id = response.data['data']['task_id']
+
+        # 测试环境中任务同步执行
+        response = self.get('delete_all_status', '/transactions/delete_all_status/', {'task_id': task_id})
+        self.assertEqual(response.data['data']['state'], 'completed')
+        self.assertEqual(response.data['data']['deleted_count'], 4)
+        self.assertBalances('100.00', '50.00')
+
+
+class TransactionDailyStatTestCase(TestCase):
+    """按天汇总的增量维护及统计接口"""
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.ledger = Ledger.objects.create(name='Daily', user_id=1)
+        self.cash = Asset.objects.create(name='Cash', balance=Decimal('100.00'), user_id='1')
+        self.food = TransactionCategory.objects.create(name='Food', is_income=False)
+        self.salary = TransactionCategory.objects.create(name='Salary', is_income=True)
+        self.now = timezone.now()
+
+    def create_transaction(self, amount, category, days_ago=0, **kwargs):
+        kwargs.setdefault('asset', self.cash)
+        return Transaction.objects.create(
+            user_id='1', ledger=self.ledger, category=category,
+            amount=Decimal(amount), transaction_date=self.now - timedelta(days=days_ago), **kwargs
+        )
+
+    def snapshot(self):
+        return sorted(TransactionDailyStat.objects.values_list(
+            'ledger_id', 'asset_id', 'category_id', 'day', 'is_expense', 'total_amount', 'transaction_count'
+        ))
+
+    def assertRollupConsistent(self):
+        incremental = self.snapshot()
+        rebuild_daily_stats()
+        self.assertEqual(incremental, self.snapshot())
+
+    def test_incremental_maintenance_matches_rebuild(self):
+        lunch = self.create_transaction('12.00', self.food)
+        self.create_transaction('8.00', self.food)
+        pay = self.create_transaction('500.00', self.salary, days_ago=1)
+        self.create_transaction('3.00', self.food, include_in_stats=False)
+        self.assertRollupConsistent()
+
+        lunch.amount = Decimal('15.00')
+        lunch.save()
+        pay.transaction_date = self.now - timedelta(days=40)
+        pay.save()
+        self.assertRollupConsistent()
+
+        lunch.delete()
+        self.assertRollupConsistent()
+
+        request = self.factory.delete('/transactions/delete_all/')
+        request.remote_user = {'id': 1}
+        TransactionViewSet.as_view({'delete': 'delete_all'})(request)
+        self.assertEqual(self.snapshot(), [])
+
+    def test_stats_from_rollup_match_raw_rows(self):
+        self.create_transaction('12.00', self.food)
+        self.create_transaction('8.00', self.food)
+        self.create_transaction('500.00', self.salary)
+        self.create_transaction('20.00', None)
+
+        def by_ledger(**params):
+            request = self.factory.get('/transactions/by_ledger/', {'ledger_id': self.ledger.id, **params})
+            request.remote_user = {'id': 1}
+            return TransactionViewSet.as_view({'get': 'by_ledger'})(request).data['data']
+
+        for period in ('day', 'week', 'month', 'year'):
+            from_rollup = by_ledger(period=period)
+            # 带 min_amount 参数时直接统计交易记录
+            from_rows = by_ledger(period=period, min_amount='0')
+            self.assertEqual(from_rollup, from_rows)
+
+        # 回退路径：汇总、时间段和分类统计只需一次分组查询
+        with self.assertNumQueries(1):
+            summary, periods, categories = compute_statistics(
+                Transaction.objects.all(), TruncMonth('transaction_date'), '%Y-%m'
+            )
+        self.assertEqual(summary['transaction_count'], 4)
+        self.assertEqual([c['category_name'] for c in categories], ['Salary', 'Food'])
+
+        summary = by_ledger()['summary']
+        self.assertEqual(Decimal(summary['total_expense']), Decimal('40.00'))
+        self.assertEqual(Decimal(summary['total_income']), Decimal('500.00'))
+        self.assertEqual(summary['transaction_count'], 4)
+
+        request = self.factory.get('/transactions/asset_monthly_categories/', {'asset_id': self.cash.id})
+        request.remote_user = {'id': 1}
+        response = TransactionViewSet.as_view({'get': 'asset_monthly_categories'})(request)
+        month = response.data['data']['results'][0]
+        self.assertEqual(Decimal(month['total_expense']), Decimal('40.00'))
+        self.assertEqual({c['category_name'] for c in month['categories']}, {'Food', 'Salary', 'Others'})
+
+
+    def test_usd_summary_from_rollup(self):
+        CurrencyRate.objects.create(currency='EUR', rate_to_usd=Decimal('1.10'))
+        CurrencyRateHistory.objects.create(currency='EUR', rate_to_usd=Decimal('1.20'),
+                                           effective_date=timezone.localdate() - timedelta(days=400))
+        euro = Asset.objects.create(name='Euro', balance=Decimal('0.00'), currency='EUR', user_id='1')
+        self.create_transaction('12.00', self.food)
+        self.create_transaction('10.00', self.food, asset=euro)
+        self.create_transaction('500.00', self.salary, asset=euro, is_expense=False)
+        self.create_transaction('20.00', None, asset=None)
+
+        def summary_usd(**params):
+            request = self.factory.get('/transactions/by_ledger/', {'ledger_id': self.ledger.id, **params})
+            request.remote_user = {'id': 1}
+            return TransactionViewSet.as_view({'get': 'by_ledger'})(request).data['data']['summary_usd']
+
+        with mock.patch('transactions.views.compute_usd_summary') as compute_usd_summary:
+            from_rollup = summary_usd(period='year')
+        compute_usd_summary.assert_not_called()
+        self.assertEqual(from_rollup, summary_usd(period='year', min_amount='0'))
+        self.assertEqual(Decimal(from_rollup['total_expense']), Decimal('43.00'))
+
+    def test_deleting_category_moves_rollup_to_uncategorized(self):
+        self.create_transaction('12.00', self.food)
+        self.create_transaction('20.00', None)
+        self.create_transaction('5.00', self.food, days_ago=1)
+
+        self.food.delete()
+        self.assertFalse(TransactionDailyStat.objects.filter(category_id=self.food.id).exists())
+        self.assertIn(
+            (self.ledger.id, self.cash.id, 0, timezone.localtime(self.now).date(), True, Decimal('32.00'), 2),
+            self.snapshot(),
+        )
+        self.assertRollupConsistent()
+
+class TransactionAdminTestCase(TestCase):
+    """交易记录管理列表页的收支汇总"""
+
+    def setUp(self):
+        self.ledger = Ledger.objects.create(name='Admin', user_id=1)
+        self.food = TransactionCategory.objects.create(name='Food', is_income=False)
+        Transaction.objects.create(user_id='1', ledger=self.ledger, category=self.food,
+                                   amount=Decimal('12.50'), transaction_date=timezone.now())
+        Transaction.objects.create(user_id='1', ledger=self.ledger, is_expense=False,
+                                   amount=Decimal('100.00'), transaction_date=timezone.now())
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin_user)
+        # reverse() 会带上 FORCE_SCRIPT_NAME 前缀，测试客户端直接请求 path_info
+        self.url = '/admin/transactions/transaction/'
+
+    def test_changelist_summary(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total_expense'], Decimal('12.50'))
+        self.assertEqual(response.context['total_income'], Decimal('100.00'))
+        self.assertEqual(response.context['net_amount'], Decimal('87.50'))
+        self.assertEqual(response.context['transaction_count'], 2)
+
+        response = self.client.get(self.url, {'is_expense__exact': '1'})
+        self.assertEqual(response.context['total_income'], Decimal('0.00'))
+        self.assertEqual(response.context['transaction_count'], 1)
+
+class StatisticsCacheTestCase(TestCase):
+    """统计接口缓存按用户版本号失效"""
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.ledger = Ledger.objects.create(name='Daily', user_id=1)
+        self.cash = Asset.objects.create(name='Cash', balance=Decimal('100.00'), user_id='1')
+
+    def get(self, viewset, action, params):
+        request = self.factory.get(f'/{action}/', params)
+        request.remote_user = {'id': 1}
+        return viewset.as_view({'get': action})(request)
+
+    def test_cached_until_user_data_changes(self):
+        from assets.views import AssetViewSet
+
+        by_ledger = lambda: self.get(TransactionViewSet, 'by_ledger', {'ledger_id': self.ledger.id})
+        total_assets = lambda: self.get(AssetViewSet, 'total_assets', {})
+
+        self.assertEqual(by_ledger().data['data']['summary']['transaction_count'], 0)
+        self.assertEqual(total_assets().data['data']['net_asset_usd'], '100.00')
+
+        with self.assertNumQueries(0):
+            by_ledger()
+            total_assets()
+
+        Transaction.objects.create(user_id='1', ledger=self.ledger, asset=self.cash,
+                                   amount=Decimal('10.00'), transaction_date=timezone.now())
+
+        self.assertEqual(by_ledger().data['data']['summary']['transaction_count'], 1)
+        self.assertEqual(total_assets().data['data']['net_asset_usd'], '90.00')
+
+
+class TransactionPaginationTestCase(TestCase):
+    """交易记录列表的游标分页和总数模式"""
+
+    def setUp(self):
+        cache.clear()
+        self.factory = APIRequestFactory()
+        ledger = Ledger.objects.create(name='Daily', user_id=1)
+        now = timezone.now()
+        # 同一时间的多笔交易按ID区分先后
+        for days_ago in (0, 1, 1, 1, 2):
+            Transaction.objects.create(user_id='1', ledger=ledger, amount=Decimal('1.00'),
+                                       transaction_date=now - timedelta(days=days_ago))
+        self.expected = list(Transaction.objects.order_by('-transaction_date', '-id').values_list('id', flat=True))
+
+    def list(self, url, params=None, status_code=200):
+        request = self.factory.get(url, params)
+        request.remote_user = {'id': 1}
+        response = TransactionViewSet.as_view({'get': 'list'})(request)
+        self.assertEqual(response.status_code, status_code)
+        return response.data
+
+    def test_walk_pages_forward_and_back(self):
+        with self.assertNumQueries(1):
+            data = self.list('/transactions/', {'pagination': 'cursor', 'page_size': 2})['data']
+        self.assertNotIn('count', data)
+        self.assertIsNone(data['previous'])
+
+        pages = [[item['id'] for item in data['results']]]
+        while data['next']:
+            data = self.list(data['next'])['data']
+            pages.append([item['id'] for item in data['results']])
+        self.assertEqual(sum(pages, []), self.expected)
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+
+        data = self.list(data['previous'])['data']
+        self.assertEqual([item['id'] for item in data['results']], pages[1])
+
+        self.list('/transactions/', {'cursor': 'invalid'}, status_code=404)
+
+    def test_count_modes(self):
+        with self.assertNumQueries(1):
+            data = self.list('/transactions/', {'count_mode': 'none', 'page_size': 2, 'page': 2})['data']
+        self.assertNotIn('count', data)
+        self.assertEqual([item['id'] for item in data['results']], self.expected[2:4])
+        self.assertIn('page=3', data['next'])
+        self.assertNotIn('page=', data['previous'])
+        self.list('/transactions/', {'count_mode': 'none', 'page': 4, 'page_size': 2}, status_code=404)
+
+        # 非PostgreSQL数据库的估算按缓存处理，相同用户和筛选条件第二次不再 COUNT
+        with self.assertNumQueries(2):
+            self.assertEqual(self.list('/transactions/', {'count_mode': 'estimate'})['data']['count'], 5)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.list('/transactions/', {'count_mode': 'cached', 'page': 1})['data']['count'], 5)
+        with self.assertNumQueries(2):
+            self.assertEqual(self.list('/transactions/', {'count_mode': 'cached', 'is_expense': 'true'})['data']['count'], 5)
+
+
+class TransactionSearchTestCase(TestCase):
+    """交易记录全文搜索"""
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.ledger = Ledger.objects.create(name='Daily', user_id=1)
+        self.food = TransactionCategory.objects.create(name='Food', is_income=False)
+        now = timezone.now()
+        self.lunch = Transaction.objects.create(user_id='1', ledger=self.ledger, category=self.food,
+                                                amount=Decimal('30.00'), notes='午餐费', transaction_date=now)
+        self.team = Transaction.objects.create(user_id='1', ledger=self.ledger, amount=Decimal('80.00'),
+                                               notes='Lunch with team, lunch again', transaction_date=now)
+        Transaction.objects.create(user_id='2', ledger=Ledger.objects.create(name='Other', user_id=2),
+                                   amount=Decimal('5.00'), notes='lunch', transaction_date=now)
+
+    def search(self, text):
+        request = self.factory.get('/transactions/', {'search': text})
+        request.remote_user = {'id': 1}
+        response = TransactionViewSet.as_view({'get': 'list'})(request)
+        return [item['id'] for item in response.data['data']['results']]
+
+    def test_search(self):
+        self.assertEqual(self.search('午餐'), [self.lunch.id])
+        self.assertEqual(self.search('餐费'), [self.lunch.id])
+        self.assertEqual(self.search('LUN'), [self.team.id])
+        self.assertEqual(self.search('food 午'), [self.lunch.id])
+        self.assertEqual(self.search('lunch dinner'), [])
+
+        # 名称和备注修改后重新生成搜索文本
+        self.ledger.name = 'Travel'
+        self.ledger.save()
+        self.assertEqual(set(self.search('travel')), {self.lunch.id, self.team.id})
+        self.team.notes = 'dinner'
+        self.team.save()
+        self.assertEqual(self.search('lunch'), [])
+        self.team.delete()
+        self.assertEqual(self.search('travel'), [self.lunch.id])
+
+    def test_sqlite_ranks_with_single_fts_join(self):
+        brunch = Transaction.objects.create(user_id='1', ledger=self.ledger, amount=Decimal('9.00'),
+                                            notes='lunch for the office after the quarterly planning meeting',
+                                            transaction_date=self.team.transaction_date)
+        with CaptureQueriesContext(connection) as queries:
+            results = self.search('lunch')
+        # 重复出现关键词的记录相关度更高
+        self.assertEqual(results, [self.team.id, brunch.id])
+        search_sql = next(q['sql'] for q in queries.captured_queries if 'bm25' in q['sql'])
+        self.assertEqual(search_sql.count('MATCH'), 1)
@@ -1,23 +1,34 @@
 from django.shortcuts import render
-from django.db.models import Sum, Count, Case, When, F, Q, Value, CharField, DecimalField
-from django.db.models.functions import TruncDay, TruncWeek, TruncMonth, TruncYear, Coalesce
+from django.db.models.functions import TruncDay, TruncWeek, TruncMonth, TruncYear
 from rest_framework import status, serializers
 from rest_framework.decorators import action
 from rest_framework.viewsets import GenericViewSet
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
+from collections import defaultdict
 from datetime import datetime, timedelta
 from decimal import Decimal
+import uuid
 import pytz
+from django.conf import settings
 from rest_framework.response import Response
 
+from utils.cache import cache_user_response
 from utils.permissions import IsAuthenticatedExternal
 from utils.mixins import *
 from .models import Transaction
+from .rollup import get_daily_stats
+from .search import search_transactions
+from .statistics import (
+    compute_statistics, compute_usd_summary, fold_statistics, get_categories, rollup_statistic_rows,
+    rollup_usd_summary,
+)
+from .services import build_delete_queryset, bulk_delete_transactions, get_delete_progress, set_delete_progress
+from .tasks import delete_transactions_task
 from .serializers import (
-    TransactionSerializer, TransactionCreateSerializer,
+    TransactionSerializer, TransactionCreateSerializer, TransactionBulkCreateSerializer,
     TransactionSummarySerializer, CategorySummarySerializer,
-    MonthlyStatSerializer
+    MonthlyStatSerializer, TRANSACTION_DETAIL_RELATED
 )
 
 
@@ -32,6 +43,8 @@ class TransactionViewSet(CreateModelMixin,
     queryset = Transaction.objects.all()
     serializer_class = TransactionSerializer
     permission_classes = [IsAuthenticatedExternal]
+    # pagination=cursor 时按 (交易时间, ID) 游标分页，使用 (user_id, transaction_date) 索引
+    keyset_ordering = ('-transaction_date', '-id')
     
     def get_serializer_class(self):
         """根据操作返回不同的序列化器"""
@@ -125,17 +138,12 @@ class TransactionViewSet(CreateModelMixin,
             include_in_stats = include_in_stats.lower() in ('true', '1', 'yes')
             queryset = queryset.filter(include_in_stats=include_in_stats)
             
-        # 搜索关键词
+        # 搜索关键词：全文索引匹配账本、资产、分类名称和备注，按相关度排序
         search = self.request.GET.get('search')
         if search:
-            queryset = queryset.filter(
-                Q(notes__icontains=search) |
-                Q(category__name__icontains=search) |
-                Q(asset__name__icontains=search) |
-                Q(ledger__name__icontains=search)
-            )
+            queryset = search_transactions(queryset, search).order_by('-search_rank', '-transaction_date')
             
-        return queryset.select_related('ledger', 'asset', 'category')
+        return queryset.select_related(*TRANSACTION_DETAIL_RELATED)
     
     def perform_create(self, serializer):
         """创建交易记录时自动添加用户ID"""
@@ -146,7 +154,35 @@ class TransactionViewSet(CreateModelMixin,
             
         serializer.save(user_id=user_id)
     
+    @action(detail=False, methods=['post'])
+    def bulk_create(self, request):
+        """批量创建交易记录（导入历史账单等），按资产汇总一次性更新余额"""
+        user_id = None
+        if hasattr(request, 'remote_user'):
+            user_id = request.remote_user.get('id')
+            
+        if not user_id:
+            return Response({
+                'code': 401,
+                'msg': _('无法获取用户ID'),
+                'data': None
+            }, status=status.HTTP_401_UNAUTHORIZED)
+        
+        serializer = TransactionBulkCreateSerializer(data=request.data, context={'user_id': user_id})
+        serializer.is_valid(raise_exception=True)
+        transactions = serializer.save()
+        
+        return self.get_success_response(
+            data={
+                'created_count': len(transactions),
+                'ids': [tx.id for tx in transactions],
+            },
+            msg=_('创建成功'),
+            status_code=status.HTTP_201_CREATED
+        )
+    
     @action(detail=False, methods=['get'])
+    @cache_user_response('transactions:by_ledger')
     def by_ledger(self, request):
         """根据账本ID列出交易记录，并计算统计数据"""
         ledger_id = request.query_params.get('ledger_id')
@@ -169,78 +205,24 @@ class TransactionViewSet(CreateModelMixin,
             transaction_date__lte=end_datetime
         )
         
-        # 计算总统计数据
-        summary = period_queryset.aggregate(
-            total_expense=Coalesce(Sum(Case(
-                When(is_expense=True, then='amount'),
-                default=Value(Decimal('0')),
-                output_field=DecimalField()
-            )), Value(Decimal('0')), output_field=DecimalField()),
-            total_income=Coalesce(Sum(Case(
-                When(is_expense=False, then='amount'),
-                default=Value(Decimal('0')),
-                output_field=DecimalField()
-            )), Value(Decimal('0')), output_field=DecimalField()),
-            transaction_count=Count('id')
-        )
-        
-        # 计算净额
-        summary['net_amount'] = summary['total_income'] - summary['total_expense']
-        
-        # 按时间段分组统计 - 修复类型混合问题
-        period_stats = period_queryset.annotate(
-            period=period_trunc
-        ).values('period').annotate(
-            total_expense=Coalesce(Sum(Case(
-                When(is_expense=True, then='amount'),
-                default=Value(Decimal('0')),
-                output_field=DecimalField()
-            )), Value(Decimal('0')), output_field=DecimalField()),
-            total_income=Coalesce(Sum(Case(
-                When(is_expense=False, then='amount'),
-                default=Value(Decimal('0')),
-                output_field=DecimalField()
-            )), Value(Decimal('0')), output_field=DecimalField()),
-            transaction_count=Count('id')
-        ).order_by('period')
-        
-        # 格式化时间并计算净额
-        formatted_periods = []
-        for stat in period_stats:
-            if stat['period']:
-                period_str = stat['period'].strftime(date_format)
-                formatted_periods.append({
-                    'period': period_str,
-                    'total_expense': stat['total_expense'],
-                    'total_income': stat['total_income'],
-                    'net_amount': stat['total_income'] - stat['total_expense'],
-                    'transaction_count': stat['transaction_count']
-                })
-        
-        # 按分类统计
-        category_stats = period_queryset.values(
-            'category_id', 
-            'category__name', 
-            'category__is_income'
-        ).annotate(
-            total_amount=Sum('amount'),
-            transaction_count=Count('id')
-        ).order_by('-total_amount')
-        
-        # 格式化分类统计
-        formatted_categories = []
-        for stat in category_stats:
-            if stat['category_id']:
-                formatted_categories.append({
-                    'category_id': stat['category_id'],
-                    'category_name': stat['category__name'] or _('未分类'),
-                    'is_income': stat['category__is_income'],
-                    'total_amount': stat['total_amount'],
-                    'transaction_count': stat['transaction_count']
-                })
+        # 账本内的交易可能使用不同货币的资产，按交易当天的汇率换算为美元汇总
+        if self._can_use_rollup(period):
+            summary, formatted_periods, formatted_categories = self._get_rollup_statistics(
+                period, start_datetime, end_datetime, date_format,
+                ledger_id=ledger_id, uncategorized_name=_('未分类')
+            )
+            usd_summary = rollup_usd_summary(self._get_rollup_daily_stats(
+                start_datetime, end_datetime, group_by='asset_id', ledger_id=ledger_id
+            ))
+        else:
+            summary, formatted_periods, formatted_categories = compute_statistics(
+                period_queryset, period_trunc, date_format, uncategorized_name=_('未分类')
+            )
+            usd_summary = compute_usd_summary(period_queryset)
         
         # 序列化结果
         summary_serializer = TransactionSummarySerializer(summary)
+        usd_summary_serializer = TransactionSummarySerializer(usd_summary)
         periods_serializer = TransactionSummarySerializer(formatted_periods, many=True)
         categories_serializer = CategorySummarySerializer(formatted_categories, many=True)
         
@@ -248,6 +230,7 @@ class TransactionViewSet(CreateModelMixin,
         return self.get_success_response(
             data={
                 'summary': summary_serializer.data,
+                'summary_usd': usd_summary_serializer.data,
                 'periods': periods_serializer.data,
                 'categories': categories_serializer.data,
                 'navigation': navigation_info
@@ -256,6 +239,7 @@ class TransactionViewSet(CreateModelMixin,
         )
     
     @action(detail=False, methods=['get'])
+    @cache_user_response('transactions:by_asset')
     def by_asset(self, request):
         """根据资产获取交易记录的统计数据"""
         asset_id = request.query_params.get('asset_id')
@@ -283,75 +267,15 @@ class TransactionViewSet(CreateModelMixin,
             transaction_date__lte=end_datetime
         )
         
-        # 计算总收支情况 - 修复类型混合问题
-        summary = period_queryset.aggregate(
-            total_expense=Coalesce(Sum(Case(
-                When(is_expense=True, then='amount'),
-                default=Value(Decimal('0')),
-                output_field=DecimalField()
-            )), Value(Decimal('0')), output_field=DecimalField()),
-            total_income=Coalesce(Sum(Case(
-                When(is_expense=False, then='amount'),
-                default=Value(Decimal('0')),
-                output_field=DecimalField()
-            )), Value(Decimal('0')), output_field=DecimalField()),
-            transaction_count=Count('id')
-        )
-        
-        # 计算净额
-        summary['net_amount'] = summary['total_income'] - summary['total_expense']
-        
-        # 按时间段分组统计 - 修复类型混合问题
-        period_stats = period_queryset.annotate(
-            period=period_trunc
-        ).values('period').annotate(
-            total_expense=Coalesce(Sum(Case(
-                When(is_expense=True, then='amount'),
-                default=Value(Decimal('0')),
-                output_field=DecimalField()
-            )), Value(Decimal('0')), output_field=DecimalField()),
-            total_income=Coalesce(Sum(Case(
-                When(is_expense=False, then='amount'),
-                default=Value(Decimal('0')),
-                output_field=DecimalField()
-            )), Value(Decimal('0')), output_field=DecimalField()),
-            transaction_count=Count('id')
-        ).order_by('period')
-        
-        # 格式化时间并计算净额
-        formatted_periods = []
-        for stat in period_stats:
-            if stat['period']:
-                period_str = stat['period'].strftime(date_format)
-                formatted_periods.append({
-                    'period': period_str,
-                    'total_expense': stat['total_expense'],
-                    'total_income': stat['total_income'],
-                    'net_amount': stat['total_income'] - stat['total_expense'],
-                    'transaction_count': stat['transaction_count']
-                })
-        
-        # 按分类统计
-        category_stats = period_queryset.values(
-            'category_id', 
-            'category__name', 
-            'category__is_income'
-        ).annotate(
-            total_amount=Sum('amount'),
-            transaction_count=Count('id')
-        ).order_by('-total_amount')
-        
-        # 格式化分类统计
-        formatted_categories = []
-        for stat in category_stats:
-            if stat['category_id']:
-                formatted_categories.append({
-                    'category_id': stat['category_id'],
-                    'category_name': stat['category__name'] or 'Others',
-                    'is_income': stat['category__is_income'],
-                    'total_amount': stat['total_amount'],
-                    'transaction_count': stat['transaction_count']
-                })
+        if self._can_use_rollup(period):
+            summary, formatted_periods, formatted_categories = self._get_rollup_statistics(
+                period, start_datetime, end_datetime, date_format,
+                asset_id=asset_id, uncategorized_name='Others'
+            )
+        else:
+            summary, formatted_periods, formatted_categories = compute_statistics(
+                period_queryset, period_trunc, date_format, uncategorized_name='Others'
+            )
         
         # 序列化结果
         summary_serializer = TransactionSummarySerializer(summary)
@@ -370,6 +294,7 @@ class TransactionViewSet(CreateModelMixin,
         )
 
     @action(detail=False, methods=['get'])
+    @cache_user_response('transactions:asset_monthly_categories')
     def asset_monthly_categories(self, request):
         """根据资产ID查询每个月按分类统计的数据"""
         # 获取资产ID
@@ -393,13 +318,6 @@ class TransactionViewSet(CreateModelMixin,
                 status_code=status.HTTP_401_UNAUTHORIZED
             )
 
-        # 基础查询集
-        queryset = Transaction.objects.filter(
-            user_id=user_id,
-            asset_id=asset_id,
-            include_in_stats=True
-        )
-
         # 获取时间范围参数
         start_date = request.query_params.get('start_date')
         end_date = request.query_params.get('end_date')
@@ -407,43 +325,40 @@ class TransactionViewSet(CreateModelMixin,
         if start_date:
             try:
                 start_date = datetime.fromtimestamp(int(start_date), tz=pytz.UTC)
-                queryset = queryset.filter(transaction_date__gte=start_date)
             except (ValueError, TypeError):
-                pass
+                start_date = None
 
         if end_date:
             try:
                 end_date = datetime.fromtimestamp(int(end_date), tz=pytz.UTC)
-                queryset = queryset.filter(transaction_date__lte=end_date)
             except (ValueError, TypeError):
-                pass
+                end_date = None
+
+        # 从按天汇总读取，按月份、分类和收支方向合并
+        daily_stats = get_daily_stats(user_id, start_date or None, end_date or None, asset_id=asset_id)
+        categories = get_categories(row['category_id'] for row in daily_stats)
+
+        monthly_stats = defaultdict(lambda: [Decimal('0'), 0])
+        for row in daily_stats:
+            category_id = row['category_id'] if row['category_id'] in categories else None
+            group = monthly_stats[(row['day'].replace(day=1), category_id, row['is_expense'])]
+            group[0] += row['total_amount']
+            group[1] += row['transaction_count']
 
         # 按月份分组
         monthly_data = {}
 
-        # 按月份和分类分组统计
-        monthly_stats = queryset.annotate(
-            month=TruncMonth('transaction_date')
-        ).values(
-            'month',
-            'category_id',
-            'category__name',
-            'category__is_income',
-            'is_expense'
-        ).annotate(
-            total_amount=Sum('amount'),
-            transaction_count=Count('id')
-        ).order_by('-month', 'category_id')
-
         # 组织数据按月份分组
-        for stat in monthly_stats:
-            month_date = stat['month']
+        for (month_date, category_id, is_expense), (total_amount, transaction_count) in sorted(
+                monthly_stats.items(), key=lambda item: (-item[0][0].toordinal(), item[0][1] or 0)):
             month_str = month_date.strftime('%Y-%m')
 
             if month_str not in monthly_data:
                 monthly_data[month_str] = {
                     'month': month_str,
-                    'month_timestamp': int(month_date.timestamp()),
+                    'month_timestamp': int(timezone.make_aware(
+                        datetime.combine(month_date, datetime.min.time())
+                    ).timestamp()),
                     'categories': [],
                     'total_expense': Decimal('0'),
                     'total_income': Decimal('0'),
@@ -451,19 +366,20 @@ class TransactionViewSet(CreateModelMixin,
                 }
 
             # 添加分类数据
+            category = categories.get(category_id)
             category_data = {
-                'category_id': stat['category_id'],
-                'category_name': stat['category__name'] or 'Others',
-                'is_income': stat['category__is_income'],
-                'total_amount': stat['total_amount'],
-                'transaction_count': stat['transaction_count']
+                'category_id': category_id,
+                'category_name': category.name if category else 'Others',
+                'is_income': category.is_income if category else None,
+                'total_amount': total_amount,
+                'transaction_count': transaction_count
             }
 
             # 更新月度总计
-            if stat['is_expense']:
-                monthly_data[month_str]['total_expense'] += stat['total_amount']
+            if is_expense:
+                monthly_data[month_str]['total_expense'] += total_amount
             else:
-                monthly_data[month_str]['total_income'] += stat['total_amount']
+                monthly_data[month_str]['total_income'] += total_amount
 
             monthly_data[month_str]['categories'].append(category_data)
 
@@ -507,41 +423,31 @@ class TransactionViewSet(CreateModelMixin,
             
         try:
             # 筛选条件参数
-            ledger_id = request.query_params.get('ledger_id')
-            asset_id = request.query_params.get('asset_id')
-            category_id = request.query_params.get('category_id')
-            start_date = request.query_params.get('start_date')
-            end_date = request.query_params.get('end_date')
-            
-            # 构建基础查询集
-            queryset = Transaction.objects.filter(user_id=user_id)
+            filters = {
+                key: request.query_params.get(key)
+                for key in ('ledger_id', 'asset_id', 'category_id', 'start_date', 'end_date')
+                if request.query_params.get(key)
+            }
+            queryset = build_delete_queryset(user_id, filters)
             
-            # 应用筛选条件
-            if ledger_id:
-                queryset = queryset.filter(ledger_id=ledger_id)
-                
-            if asset_id:
-                queryset = queryset.filter(asset_id=asset_id)
-                
-            if category_id:
-                queryset = queryset.filter(category_id=category_id)
+            # 数据量较大时转为后台任务，通过 delete_all_status 查询进度
+            total = queryset.count()
+            if total > getattr(settings, 'TRANSACTION_BULK_DELETE_ASYNC_THRESHOLD', 5000):
+                task_id = str(uuid.uuid4())
+                set_delete_progress(task_id, user_id=str(user_id), state='pending', total=total, deleted=0)
+                delete_transactions_task.apply_async(args=(user_id, filters), task_id=task_id)
                 
-            if start_date:
-                try:
-                    start_date = datetime.fromtimestamp(int(start_date), tz=pytz.UTC)
-                    queryset = queryset.filter(transaction_date__gte=start_date)
-                except (ValueError, TypeError):
-                    pass
-                    
-            if end_date:
-                try:
-                    end_date = datetime.fromtimestamp(int(end_date), tz=pytz.UTC)
-                    queryset = queryset.filter(transaction_date__lte=end_date)
-                except (ValueError, TypeError):
-                    pass
+                return Response({
+                    'code': 202,
+                    'msg': _('删除任务已提交'),
+                    'data': {
+                        'task_id': task_id,
+                        'total': total
+                    }
+                }, status=status.HTTP_202_ACCEPTED)
             
             # 执行删除操作
-            deleted_count = queryset.delete()[0]
+            deleted_count = bulk_delete_transactions(queryset)
             
             return Response({
                 'code': 200,
@@ -562,6 +468,83 @@ class TransactionViewSet(CreateModelMixin,
                 'data': None
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @action(detail=False, methods=['get'])
+    def delete_all_status(self, request):
+        """查询后台批量删除任务的进度"""
+        user_id = None
+        if hasattr(request, 'remote_user'):
+            user_id = request.remote_user.get('id')
+            
+        if not user_id:
+            return Response({
+                'code': 401,
+                'msg': _('无法获取用户ID'),
+                'data': None
+            }, status=status.HTTP_401_UNAUTHORIZED)
+        
+        task_id = request.query_params.get('task_id')
+        progress = get_delete_progress(task_id) if task_id else None
+        if not progress or progress.get('user_id') != str(user_id):
+            return Response({
+                'code': 404,
+                'msg': _('删除任务不存在'),
+                'data': None
+            }, status=status.HTTP_404_NOT_FOUND)
+        
+        return Response({
+            'code': 200,
+            'msg': _('获取成功'),
+            'data': {
+                'task_id': task_id,
+                'state': progress.get('state'),
+                'total': progress.get('total', 0),
+                'deleted_count': progress.get('deleted', 0)
+            }
+        })
+
+    # 按天汇总无法表达的筛选条件，请求带这些参数时直接统计交易记录
+    ROLLUP_UNSUPPORTED_PARAMS = ('search', 'min_amount', 'max_amount', 'start_date', 'end_date', 'include_in_stats')
+    
+    def _can_use_rollup(self, period):
+        """统计接口能否从按天汇总读取（与 get_queryset 的筛选条件一致时）"""
+        params = self.request.query_params
+        if not getattr(self.request, 'remote_user', {}).get('id'):
+            return False
+        if any(params.get(param) for param in self.ROLLUP_UNSUPPORTED_PARAMS):
+            return False
+        # get_queryset 会按请求中的 period/offset 再次筛选，周期不同时两个范围取交集
+        if params.get('period') and params.get('offset') and params.get('period') != period:
+            return False
+        return True
+    
+    def _get_rollup_filters(self):
+        """get_queryset 中汇总表支持的筛选条件"""
+        params = self.request.query_params
+        filters = {
+            'ledger_id': params.get('ledger_id'),
+            'asset_id': params.get('asset_id'),
+            'category_id': params.get('category_id'),
+        }
+        is_expense = params.get('is_expense')
+        if is_expense is not None:
+            filters['is_expense'] = is_expense.lower() in ('true', '1', 'yes')
+        return filters
+    
+    def _get_rollup_statistics(self, period, start_datetime, end_datetime, date_format,
+                               uncategorized_name, **filters):
+        """从按天汇总计算统计数据，返回 (summary, periods, categories)"""
+        daily_stats = self._get_rollup_daily_stats(start_datetime, end_datetime, **filters)
+        return fold_statistics(rollup_statistic_rows(daily_stats, period), date_format, uncategorized_name)
+    
+    def _get_rollup_daily_stats(self, start_datetime, end_datetime, group_by='category_id', **filters):
+        """按请求的筛选条件读取按天汇总"""
+        rollup_filters = self._get_rollup_filters()
+        rollup_filters.update({key: value for key, value in filters.items() if value})
+        return get_daily_stats(
+            self.request.remote_user.get('id'), start_datetime, end_datetime,
+            group_by=group_by, **rollup_filters
+        )
+    
     def _get_time_period_params(self, time_period, offset=0):
         """
         获取不同时间周期的查询参数，支持时间偏移
@@ -0,0 +1,104 @@
+"""
+按用户版本号失效的接口响应缓存
+
+统计类接口的结果只在用户数据变化时改变。每个用户有一个版本号，
+缓存键包含该版本号；交易、资产、梦想基金和存款的写入路径递增版本号，
+旧版本的缓存自然失效，不需要逐个删除。
+汇率、分类等所有用户共享的数据变化时递增全局版本号。
+"""
+import functools
+import hashlib
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction as db_transaction
+from django.utils import translation
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+logger = logging.getLogger(__name__)
+
+USER_VERSION_KEY = 'stats:user-ver:{user_id}'
+GLOBAL_VERSION_KEY = 'stats:global-ver'
+
+
+def _get_version(key):
+    version = cache.get(key)
+    if version is None:
+        # 版本号丢失（过期或被淘汰）时以当前时间起始，不会与旧版本重复
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key)
+    return version
+
+
+def _incr_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, int(time.time() * 1000), None)
+
+
+def _bump(key):
+    # 立即递增，使旧缓存失效；事务提交后再递增一次，
+    # 避免事务未提交期间读到旧数据的请求写入新版本的缓存
+    _incr_version(key)
+    db_transaction.on_commit(lambda: _incr_version(key))
+
+
+def get_user_cache_version(user_id):
+    return _get_version(USER_VERSION_KEY.format(user_id=user_id))
+
+
+def bump_user_cache_version(*user_ids):
+    """用户数据变化后调用，使该用户的统计缓存失效"""
+    for user_id in {str(user_id) for user_id in user_ids if user_id}:
+        _bump(USER_VERSION_KEY.format(user_id=user_id))
+
+
+def bump_global_cache_version():
+    """汇率、分类等共享数据变化后调用，使所有用户的统计缓存失效"""
+    _bump(GLOBAL_VERSION_KEY)
+
+
+def cache_user_response(scope, timeout=None):
+    """
+    视图集 action 的响应缓存装饰器
+
+    缓存键由接口、用户、用户版本号、全局版本号、语言和查询参数组成，
+    只缓存已认证用户的200响应。
+
+    Args:
+        scope: 接口标识，如 'transactions:by_ledger'
+        timeout: 缓存时间（秒），默认 settings.STATS_CACHE_TTL
+    """
+    def decorator(view_func):
+        @functools.wraps(view_func)
+        def wrapper(self, request, *args, **kwargs):
+            ttl = timeout if timeout is not None else getattr(settings, 'STATS_CACHE_TTL', 600)
+            user_id = getattr(request, 'remote_user', {}).get('id')
+            if not user_id or not ttl:
+                return view_func(self, request, *args, **kwargs)
+
+            params = sorted((key, request.query_params.getlist(key)) for key in request.query_params)
+            params_hash = hashlib.sha256(json.dumps([params, args, kwargs], default=str).encode()).hexdigest()
+            cache_key = (
+                f"stats:{scope}:{user_id}:"
+                f"{get_user_cache_version(user_id)}:{_get_version(GLOBAL_VERSION_KEY)}:"
+                f"{translation.get_language()}:{params_hash}"
+            )
+
+            cached = cache.get(cache_key)
+            if cached is not None:
+                return Response(cached['data'], status=cached['status'])
+
+            response = view_func(self, request, *args, **kwargs)
+            if response.status_code == 200:
+                # 保存渲染后的JSON结构，避免缓存惰性翻译字符串等对象
+                data = json.loads(json.dumps(response.data, cls=JSONEncoder))
+                cache.set(cache_key, {'data': data, 'status': response.status_code}, ttl)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,156 @@
+"""
+进程内共享的出站HTTP客户端
+
+每个上游服务（auth、users、agent）对应一个长期存在的 requests.Session，
+连接池大小、超时和重试策略由 settings.OUTBOUND_HTTP_UPSTREAMS 配置，
+避免每次请求都重新建立TLS连接。
+"""
+import logging
+import threading
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# 未在配置中声明的上游使用的默认参数
+DEFAULT_UPSTREAM_CONFIG = {
+    'pool_connections': 4,
+    'pool_maxsize': 10,
+    'pool_block': False,
+    'timeout': 10,
+    'retries': 0,
+    'backoff_factor': 0.1,
+    'status_forcelist': (),
+}
+
+
+class OutboundClient:
+    """单个上游服务的HTTP客户端，内部复用连接池"""
+
+    def __init__(self, name, **config):
+        self.name = name
+        self.config = {**DEFAULT_UPSTREAM_CONFIG, **config}
+        self.timeout = self.config['timeout']
+        self.session = self._build_session()
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._stats = {
+            'requests': 0,
+            'errors': 0,
+            'total_time': 0.0,
+        }
+
+    def _build_session(self):
+        retries = Retry(
+            total=self.config['retries'],
+            backoff_factor=self.config['backoff_factor'],
+            status_forcelist=list(self.config['status_forcelist']),
+        )
+        adapter = HTTPAdapter(
+            pool_connections=self.config['pool_connections'],
+            pool_maxsize=self.config['pool_maxsize'],
+            pool_block=self.config['pool_block'],
+            max_retries=retries,
+        )
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        self.adapter = adapter
+        return session
+
+    def request(self, method, url, **kwargs):
+        """发送请求，未指定timeout时使用上游的默认超时"""
+        kwargs.setdefault('timeout', self.timeout)
+
+        with self._lock:
+            self._in_flight += 1
+            self._stats['requests'] += 1
+        started = time.monotonic()
+        try:
+            return self.session.request(method, url, **kwargs)
+        except requests.RequestException:
+            with self._lock:
+                self._stats['errors'] += 1
+            raise
+        finally:
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self._in_flight -= 1
+                self._stats['total_time'] += elapsed
+
+    def get(self, url, **kwargs):
+        return self.request('get', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('post', url, **kwargs)
+
+    def pool_stats(self):
+        """连接池使用情况"""
+        pools = []
+        for key in list(self.adapter.poolmanager.pools.keys()):
+            pool = self.adapter.poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            pools.append({
+                'host': f"{key.key_scheme}://{key.key_host}:{key.key_port}",
+                'connections_created': pool.num_connections,
+                # 队列中的None只是空槽位，不是已建立的连接
+                'idle_connections': sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool else 0,
+                'max_size': pool.pool.maxsize if pool.pool else 0,
+                'requests': pool.num_requests,
+            })
+
+        with self._lock:
+            stats = dict(self._stats)
+            in_flight = self._in_flight
+
+        requests_count = stats['requests']
+        return {
+            'upstream': self.name,
+            'in_flight': in_flight,
+            'requests': requests_count,
+            'errors': stats['errors'],
+            'avg_time_ms': round(stats['total_time'] * 1000 / requests_count, 2) if requests_count else 0,
+            'pools': pools,
+        }
+
+    def close(self):
+        self.session.close()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(name):
+    """获取（必要时创建）指定上游的共享客户端"""
+    client = _clients.get(name)
+    if client is not None:
+        return client
+
+    with _clients_lock:
+        client = _clients.get(name)
+        if client is None:
+            upstreams = getattr(settings, 'OUTBOUND_HTTP_UPSTREAMS', {})
+            client = OutboundClient(name, **upstreams.get(name, {}))
+            _clients[name] = client
+            logger.debug(f"创建出站HTTP客户端: {name}")
+    return client
+
+
+def get_pool_stats():
+    """所有已创建客户端的连接池指标"""
+    return [client.pool_stats() for client in list(_clients.values())]
+
+
+def close_clients():
+    """关闭所有客户端（测试或进程退出时使用）"""
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
@@ -1,21 +1,258 @@
+import base64
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Q, QuerySet
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class CustomPagination(PageNumberPagination):
-    """自定义分页类，返回符合项目规范的分页响应格式"""
+    """
+    自定义分页类，返回符合项目规范的分页响应格式
+
+    默认按页码分页。请求带 pagination=cursor（或 cursor 参数）且视图/分页器设置了
+    keyset_ordering 时改用游标（keyset）分页：按排序字段的值定位下一页，
+    不执行 COUNT，也没有深分页的 OFFSET 扫描。
+
+    页码分页的总数由 count_mode 参数（或视图的 pagination_count_mode）控制：
+    exact 精确统计（默认）；none 不返回总数；estimate 使用数据库的估算行数
+    （仅PostgreSQL，其他数据库按 cached 处理）；cached 按用户和筛选条件缓存
+    PAGINATION_COUNT_CACHE_TTL 秒。非 exact 模式多取一条记录判断是否有下一页。
+    """
     page_size = 20
     page_size_query_param = 'page_size'
     max_page_size = 100
-    
+
+    pagination_mode_query_param = 'pagination'
+    cursor_query_param = 'cursor'
+    # 游标分页的排序字段，最后一个字段必须唯一（如 ('-transaction_date', '-id')）
+    keyset_ordering = None
+    invalid_cursor_message = _('无效的游标')
+
+    count_mode_query_param = 'count_mode'
+    count_modes = ('exact', 'none', 'estimate', 'cached')
+    count_mode = 'exact'
+    invalid_page_message = _('无效的页码')
+
+    use_keyset = False
+
+    def paginate_queryset(self, queryset, request, view=None):
+        ordering = self.keyset_ordering or getattr(view, 'keyset_ordering', None)
+        self.use_keyset = bool(
+            ordering
+            and isinstance(queryset, QuerySet)
+            and (request.query_params.get(self.pagination_mode_query_param) == 'cursor'
+                 or self.cursor_query_param in request.query_params)
+        )
+        if self.use_keyset:
+            return self.paginate_keyset(queryset, request, ordering)
+
+        self.current_count_mode = self.get_count_mode(request, view)
+        if self.current_count_mode == 'exact' or not isinstance(queryset, QuerySet):
+            self.current_count_mode = 'exact'
+            return super().paginate_queryset(queryset, request, view)
+        return self.paginate_without_count(queryset, request)
+
+    def get_paginated_data(self, data):
+        """分页响应中 data 部分的内容"""
+        if self.use_keyset:
+            return {
+                'next': self.next_link,
+                'previous': self.previous_link,
+                'results': data
+            }
+
+        paginated = {}
+        if self.current_count_mode == 'exact':
+            paginated['count'] = self.page.paginator.count
+        elif self.current_count_mode != 'none':
+            paginated['count'] = self.approximate_count
+        paginated.update({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data
+        })
+        return paginated
+
     def get_paginated_response(self, data):
         return Response({
             'code': 200,
             'msg': '获取成功',
-            'data': {
-                'count': self.page.paginator.count,
-                'next': self.get_next_link(),
-                'previous': self.get_previous_link(),
-                'results': data
-            }
-        }) 
\ No newline at end of file
+            'data': self.get_paginated_data(data)
+        })
+
+    def get_count_mode(self, request, view=None):
+        mode = (
+            request.query_params.get(self.count_mode_query_param)
+            or getattr(view, 'pagination_count_mode', None)
+            or self.count_mode
+        )
+        return mode if mode in self.count_modes else self.count_mode
+
+    def paginate_without_count(self, queryset, request):
+        """按页码偏移取 page_size + 1 条，不执行 COUNT"""
+        self.request = request
+        page_size = self.get_page_size(request)
+        try:
+            number = int(request.query_params.get(self.page_query_param, 1))
+            if number < 1:
+                raise ValueError
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_page_message)
+
+        offset = (number - 1) * page_size
+        results = list(queryset[offset:offset + page_size + 1])
+        self.page = UncountedPage(results[:page_size], number, has_next=len(results) > page_size)
+        if number > 1 and not self.page.object_list:
+            raise NotFound(self.invalid_page_message)
+
+        if self.current_count_mode == 'estimate':
+            self.approximate_count = estimate_count(queryset)
+            if self.approximate_count is None:
+                self.approximate_count = get_cached_count(queryset, request)
+        elif self.current_count_mode == 'cached':
+            self.approximate_count = get_cached_count(queryset, request)
+        return list(self.page)
+
+    def paginate_keyset(self, queryset, request, ordering):
+        """按 ordering 的字段值定位，取 page_size + 1 条判断是否还有更多"""
+        self.request = request
+        page_size = self.get_page_size(request)
+        fields = [(name.lstrip('-'), name.startswith('-')) for name in ordering]
+
+        position, reverse = self.decode_cursor(request, queryset.model, fields)
+        if reverse:
+            # 向前翻页：反转排序取数，再恢复原顺序
+            fields_for_query = [(name, not descending) for name, descending in fields]
+        else:
+            fields_for_query = fields
+
+        queryset = queryset.order_by(*[
+            f"-{name}" if descending else name for name, descending in fields_for_query
+        ])
+        if position is not None:
+            queryset = queryset.filter(self.build_keyset_filter(fields_for_query, position))
+
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+
+        self.next_link = None
+        self.previous_link = None
+        if results:
+            first = [getattr(results[0], name) for name, descending in fields]
+            last = [getattr(results[-1], name) for name, descending in fields]
+            # 向前翻页得到的页后面一定还有数据；向后翻页时带游标说明前面还有数据
+            has_next = reverse or has_more
+            has_previous = has_more if reverse else position is not None
+            if has_next:
+                self.next_link = self.encode_cursor(last, reverse=False)
+            if has_previous:
+                self.previous_link = self.encode_cursor(first, reverse=True)
+        return results
+
+    @staticmethod
+    def build_keyset_filter(fields, position):
+        """(a, b) 降序时为 a < x OR (a = x AND b < y)，升序时使用 >"""
+        condition = Q()
+        for index, (name, descending) in enumerate(fields):
+            lookup = f"{name}__lt" if descending else f"{name}__gt"
+            clause = Q(**{lookup: position[index]})
+            for previous_index in range(index):
+                clause &= Q(**{fields[previous_index][0]: position[previous_index]})
+            condition |= clause
+        return condition
+
+    def decode_cursor(self, request, model, fields):
+        """返回 (排序字段值列表, 是否向前翻页)，没有游标时为 (None, False)"""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            values = payload['p']
+            if len(values) != len(fields):
+                raise ValueError
+            position = [
+                model._meta.get_field(name).to_python(value)
+                for (name, descending), value in zip(fields, values)
+            ]
+            return position, bool(payload.get('r'))
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, values, reverse):
+        payload = {'p': [
+            value.isoformat() if hasattr(value, 'isoformat') else value if isinstance(value, int) else str(value)
+            for value in values
+        ]}
+        if reverse:
+            payload['r'] = 1
+        encoded = base64.urlsafe_b64encode(json.dumps(payload).encode('utf-8')).decode('ascii')
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+
+class UncountedPage:
+    """不知道总页数的页，提供 get_next_link/get_previous_link 需要的接口"""
+
+    def __init__(self, object_list, number, has_next):
+        self.object_list = object_list
+        self.number = number
+        self._has_next = has_next
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self.number > 1
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def previous_page_number(self):
+        return self.number - 1
+
+
+def estimate_count(queryset):
+    """PostgreSQL 查询计划的估算行数，其他数据库返回None"""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def get_cached_count(queryset, request):
+    """按用户和查询（含筛选条件）缓存的总数"""
+    sql, params = queryset.order_by().query.sql_with_params()
+    user_id = (getattr(request, 'remote_user', None) or {}).get('id')
+    digest = hashlib.sha256(f'{sql}|{params!r}'.encode()).hexdigest()
+    key = f'pagination:count:{user_id}:{digest}'
+
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, getattr(settings, 'PAGINATION_COUNT_CACHE_TTL', 60))
+    return count
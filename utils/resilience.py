@@ -0,0 +1,273 @@
+"""
+出站调用的熔断器和并发隔离（bulkhead）
+
+- CircuitBreaker：统计最近 window_size 次调用，失败率或慢调用率超过阈值时打开，
+  打开期间直接拒绝调用（CircuitOpenError），open_seconds 秒后进入半开状态，
+  放行 half_open_max_calls 次试探调用，全部成功则关闭，任一失败则重新打开。
+- Bulkhead：限制进程内同时进行的调用数，超过时最多等待 max_wait 秒，
+  仍没有空位则拒绝（BulkheadFullError），避免慢上游占满所有worker线程。
+
+状态变化写日志并计数，get_resilience_stats() 返回所有实例的指标。
+"""
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+# 未在配置中声明的参数使用的默认值
+DEFAULT_BREAKER_CONFIG = {
+    'window_size': 20,
+    'minimum_calls': 5,
+    'failure_rate_threshold': 0.5,
+    'slow_call_duration': 10,
+    'slow_call_rate_threshold': 0.5,
+    'open_seconds': 30,
+    'half_open_max_calls': 1,
+}
+
+
+class CallRejected(Exception):
+    """调用被熔断器或并发隔离拒绝，没有发往上游"""
+
+
+class CircuitOpenError(CallRejected):
+    """熔断器打开"""
+
+
+class BulkheadFullError(CallRejected):
+    """并发调用数已满"""
+
+
+class CircuitBreaker:
+    """单个上游（或模型）的熔断器"""
+
+    def __init__(self, name, **config):
+        self.name = name
+        self.config = {**DEFAULT_BREAKER_CONFIG, **config}
+        self.state = STATE_CLOSED
+        self._lock = threading.Lock()
+        # 最近的调用结果：(是否失败, 是否慢调用)
+        self._window = deque(maxlen=self.config['window_size'])
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+        self._half_open_successes = 0
+        self._stats = {
+            'calls': 0,
+            'failures': 0,
+            'slow_calls': 0,
+            'rejected': 0,
+            'transitions': {STATE_OPEN: 0, STATE_HALF_OPEN: 0, STATE_CLOSED: 0},
+        }
+
+    def _transition(self, state):
+        # 调用方持有锁
+        if state == self.state:
+            return
+        logger.warning(f"熔断器状态变化: {self.name} {self.state} -> {state}")
+        self.state = state
+        self._stats['transitions'][state] += 1
+        if state == STATE_OPEN:
+            self._opened_at = time.monotonic()
+        if state == STATE_HALF_OPEN:
+            self._half_open_calls = 0
+            self._half_open_successes = 0
+        if state == STATE_CLOSED:
+            self._window.clear()
+
+    def current_state(self):
+        """当前状态（打开超过 open_seconds 秒时为半开）"""
+        with self._lock:
+            if self.state == STATE_OPEN and time.monotonic() - self._opened_at >= self.config['open_seconds']:
+                self._transition(STATE_HALF_OPEN)
+            return self.state
+
+    def before_call(self):
+        """
+        申请一次调用
+
+        Raises:
+            CircuitOpenError: 熔断器打开，或半开状态下试探调用已满
+        """
+        with self._lock:
+            if self.state == STATE_OPEN and time.monotonic() - self._opened_at >= self.config['open_seconds']:
+                self._transition(STATE_HALF_OPEN)
+            if self.state == STATE_OPEN or (
+                self.state == STATE_HALF_OPEN and self._half_open_calls >= self.config['half_open_max_calls']
+            ):
+                self._stats['rejected'] += 1
+                raise CircuitOpenError(f"{self.name} 熔断中")
+            if self.state == STATE_HALF_OPEN:
+                self._half_open_calls += 1
+
+    def record(self, failed, duration):
+        """记录一次调用的结果和耗时（秒）"""
+        slow = duration >= self.config['slow_call_duration']
+        with self._lock:
+            self._stats['calls'] += 1
+            self._stats['failures'] += int(failed)
+            self._stats['slow_calls'] += int(slow)
+
+            if self.state == STATE_HALF_OPEN:
+                if failed or slow:
+                    self._transition(STATE_OPEN)
+                else:
+                    self._half_open_successes += 1
+                    if self._half_open_successes >= self.config['half_open_max_calls']:
+                        self._transition(STATE_CLOSED)
+                return
+            if self.state == STATE_OPEN:
+                return
+
+            self._window.append((failed, slow))
+            total = len(self._window)
+            if total < self.config['minimum_calls']:
+                return
+            failure_rate = sum(1 for f, _ in self._window if f) / total
+            slow_rate = sum(1 for _, s in self._window if s) / total
+            if (failure_rate >= self.config['failure_rate_threshold']
+                    or slow_rate >= self.config['slow_call_rate_threshold']):
+                self._transition(STATE_OPEN)
+
+    @contextmanager
+    def protect(self):
+        """
+        包裹一次调用：抛出异常或调用 call.fail() 记为失败
+
+            with breaker.protect() as call:
+                response = client.get(url)
+                if response.status_code >= 500:
+                    call.fail()
+        """
+        self.before_call()
+        call = _Call()
+        started = time.monotonic()
+        try:
+            yield call
+        except Exception:
+            call.fail()
+            raise
+        finally:
+            self.record(call.failed, time.monotonic() - started)
+
+    def stats(self):
+        state = self.current_state()
+        with self._lock:
+            stats = {**self._stats, 'transitions': dict(self._stats['transitions'])}
+            window = list(self._window)
+        return {
+            'name': self.name,
+            'state': state,
+            'window_calls': len(window),
+            'window_failures': sum(1 for f, _ in window if f),
+            'window_slow_calls': sum(1 for _, s in window if s),
+            **stats,
+        }
+
+
+class _Call:
+    failed = False
+
+    def fail(self):
+        self.failed = True
+
+
+class Bulkhead:
+    """限制进程内同时进行的调用数"""
+
+    def __init__(self, name, max_concurrent, max_wait=0):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._rejected = 0
+
+    @contextmanager
+    def acquire(self):
+        """
+        占用一个并发名额
+
+        Raises:
+            BulkheadFullError: 等待 max_wait 秒后仍没有空位
+        """
+        if not self._semaphore.acquire(timeout=self.max_wait):
+            with self._lock:
+                self._rejected += 1
+            logger.warning(f"并发调用数已满: {self.name} ({self.max_concurrent})")
+            raise BulkheadFullError(f"{self.name} 并发调用数已满")
+        with self._lock:
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            self._semaphore.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'name': self.name,
+                'max_concurrent': self.max_concurrent,
+                'in_flight': self._in_flight,
+                'rejected': self._rejected,
+            }
+
+
+_breakers = {}
+_bulkheads = {}
+_registry_lock = threading.Lock()
+
+
+def get_breaker(name, setting='CIRCUIT_BREAKERS'):
+    """获取（必要时创建）指定名称的熔断器，参数取 settings.<setting>[name] 或 ['default']"""
+    breaker = _breakers.get(name)
+    if breaker is not None:
+        return breaker
+
+    with _registry_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            configs = getattr(settings, setting, {})
+            breaker = CircuitBreaker(name, **configs.get(name, configs.get('default', {})))
+            _breakers[name] = breaker
+    return breaker
+
+
+def get_bulkhead(name, max_concurrent, max_wait=0):
+    """获取（必要时创建）指定名称的并发隔离"""
+    bulkhead = _bulkheads.get(name)
+    if bulkhead is not None:
+        return bulkhead
+
+    with _registry_lock:
+        bulkhead = _bulkheads.get(name)
+        if bulkhead is None:
+            bulkhead = Bulkhead(name, max_concurrent, max_wait)
+            _bulkheads[name] = bulkhead
+    return bulkhead
+
+
+def get_resilience_stats():
+    """所有熔断器和并发隔离的指标"""
+    return {
+        'breakers': [breaker.stats() for breaker in list(_breakers.values())],
+        'bulkheads': [bulkhead.stats() for bulkhead in list(_bulkheads.values())],
+    }
+
+
+def reset_resilience():
+    """清空所有实例（测试或修改配置后使用）"""
+    with _registry_lock:
+        _breakers.clear()
+        _bulkheads.clear()
@@ -0,0 +1,70 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+from rest_framework.test import APIRequestFactory
+
+from .http_client import close_clients, get_client
+from .views import InternalStatsView
+
+
+class OKHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(
+    OUTBOUND_HTTP_UPSTREAMS={'auth': {'timeout': 3}, 'agent': {'timeout': 30, 'pool_maxsize': 2}},
+    INTERNAL_STATS_KEY='secret',
+)
+class OutboundClientTestCase(SimpleTestCase):
+    """共享的出站HTTP客户端"""
+
+    def setUp(self):
+        close_clients()
+        self.addCleanup(close_clients)
+
+    def test_per_upstream_timeout(self):
+        self.assertEqual(get_client('auth').timeout, 3)
+        self.assertEqual(get_client('agent').timeout, 30)
+        # 未配置的上游使用默认超时
+        self.assertEqual(get_client('users').timeout, 10)
+
+        client = get_client('auth')
+        with mock.patch.object(client.session, 'request') as request:
+            client.get('http://auth.local/me/')
+            client.get('http://auth.local/me/', timeout=1)
+        self.assertEqual([c.kwargs['timeout'] for c in request.call_args_list], [3, 1])
+
+    def test_session_and_connection_reused(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), OKHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = f'http://127.0.0.1:{server.server_port}/'
+
+        client = get_client('agent')
+        self.assertIs(get_client('agent'), client)
+        for _ in range(3):
+            self.assertEqual(client.get(url).status_code, 200)
+
+        request = APIRequestFactory().get('/api/internal/stats/', HTTP_X_SERVICE_KEY='secret')
+        data = InternalStatsView.as_view()(request).data['data']
+        self.assertEqual(set(data), {'outbound_http', 'resilience', 'model_routing'})
+        stats = data['outbound_http']
+        agent = next(item for item in stats if item['upstream'] == 'agent')
+        self.assertEqual(agent['requests'], 3)
+        # 三次请求复用同一个连接
+        self.assertEqual(agent['pools'][0]['connections_created'], 1)
+
+        request = APIRequestFactory().get('/api/internal/stats/')
+        self.assertEqual(InternalStatsView.as_view()(request).status_code, 403)
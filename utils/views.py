@@ -0,0 +1,44 @@
+import hmac
+
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .http_client import get_pool_stats
+from .resilience import get_resilience_stats
+
+
+class InternalStatsView(APIView):
+    """
+    当前进程的出站调用指标（运维使用）：连接池、熔断器和并发隔离、AI模型路由
+
+    请求头 X-Service-Key 必须与 settings.INTERNAL_STATS_KEY 一致，未配置密钥时拒绝所有请求。
+    指标是进程内的，多进程部署时每次请求只返回处理该请求的进程的数据。
+    """
+
+    def get(self, request):
+        stats_key = getattr(settings, 'INTERNAL_STATS_KEY', '')
+        provided = request.headers.get('X-Service-Key', '')
+        if not stats_key or not hmac.compare_digest(provided, stats_key):
+            return Response({
+                'code': 403,
+                'msg': _('无效的服务密钥'),
+                'data': None
+            }, status=status.HTTP_403_FORBIDDEN)
+
+        return Response({
+            'code': 200,
+            'msg': _('获取成功'),
+            'data': self.get_stats()
+        })
+
+    def get_stats(self):
+        from ai_messages.services import get_model_routing_stats
+
+        return {
+            'outbound_http': get_pool_stats(),
+            'resilience': get_resilience_stats(),
+            'model_routing': get_model_routing_stats(),
+        }